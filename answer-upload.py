@@ -10,9 +10,15 @@ import boto3
 import base64
 import tempfile
 import os
+from typing import Tuple
 
 from module.constants import Supported_Video_Type, supported_video_types, MP4
-from media_tools import assert_video_duration, get_video_file_type
+from media_tools import (
+    assert_probe_duration,
+    assert_video_duration,
+    get_video_file_type,
+    probe_media_s3,
+)
 from module.utils import (
     create_json_response,
     s3_bucket,
@@ -21,15 +27,21 @@ from module.utils import (
     get_auth_headers,
 )
 from module.api import (
+    batch_gql,
+    cache_user_can_edit_mentor,
+    cached_user_can_edit_mentor,
     is_upload_in_progress,
+    upload_in_progress_read,
     FetchUploadTaskReq,
     upload_answer_and_task_update,
     AnswerUpdateRequest,
     UploadTaskRequest,
     upload_answer_update,
-    user_can_edit_mentor,
+    user_can_edit_mentor_read,
 )
-from module.logger import get_logger
+from module.logger import get_logger, metrics_handler
+from module.s3_utils import copy_s3_object
+from module.encoding_profiles import is_valid_encoding_profile_selection
 
 
 load_sentry()
@@ -76,15 +88,54 @@ def create_task_list(trim, has_edited_transcript):
     return transcode_web_task, transcode_mobile_task, transcribe_task, trim_upload_task
 
 
+def validate_upload(video_key) -> Tuple[Supported_Video_Type, bool, int]:
+    """Returns the upload's video file type, whether it passes the duration check
+    and its size.
+    Only the container header and index are read, through ranged GETs.
+    Falls back to downloading the whole file if that is not enough."""
+    try:
+        probe, header = probe_media_s3(s3_client, upload_bucket, video_key)
+        if probe.has_video and probe.video_duration < 0:
+            raise Exception("duration not found in the container header")
+        return (
+            get_file_type_or_mp4(header),
+            assert_probe_duration(probe, 1000),
+            probe.size,
+        )
+    except Exception as e:
+        log.info("ranged probe of %s failed (%s), downloading it", video_key, e)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        file_path = os.path.join(
+            work_dir, "original_video"
+        )  # don't assume video file type
+        s3_client.download_file(upload_bucket, video_key, file_path)
+        return (
+            get_file_type_or_mp4(file_path),
+            assert_video_duration(file_path, 1000),
+            os.path.getsize(file_path),
+        )
+
+
+def get_file_type_or_mp4(file_path_or_header) -> Supported_Video_Type:
+    try:
+        return get_video_file_type(file_path_or_header)
+    except Exception as e:
+        log.debug(e)
+        log.debug("unknown file mime type, will attempt to transcode to mp4")
+        return MP4
+
+
 def upload_to_s3(
-    file_path,
+    video_key,
+    video_size,
     video_file_type: Supported_Video_Type,
     s3_path,
     mentor,
     question,
     auth_headers,
 ):
-    log.info("uploading %s to %s", file_path, s3_path)
+    log.info("copying %s to %s", video_key, s3_path)
 
     # to prevent data inconsistency by partial failures (new web.mp3 - old transcript...)
     # first remove old media urls from DB
@@ -107,17 +158,21 @@ def upload_to_s3(
         *[f"web.{extension}" for extension in supported_extensions],
         *[f"mobile.{extension}" for extension in supported_extensions],
         "en.vtt",
+        "original.mediainfo.json",
     ]
     s3_client.delete_objects(
         Bucket=s3_bucket,
         Delete={"Objects": [{"Key": f"{s3_path}/{name}"} for name in all_artifacts]},
     )
 
-    s3_client.upload_file(
-        file_path,
+    copy_s3_object(
+        s3_client,
+        upload_bucket,
+        video_key,
         s3_bucket,
         f"{s3_path}/original.{video_file_type.extension}",
-        ExtraArgs={"ContentType": video_file_type.mime},
+        video_file_type.mime,
+        size=video_size,
     )
 
 
@@ -128,6 +183,7 @@ def get_original_video_url(
     return f"{base_url}/videos/{mentor}/{question}/original.{video_file_type.extension}"
 
 
+@metrics_handler()
 def handler(event, context):
     log.info(event)
     if "body" not in event:
@@ -187,16 +243,35 @@ def handler(event, context):
     )  # vbg videos are expected to be in format of mime type webm with vp9 encoding
     trim = upload_request.get("trim")
     has_edited_transcript = upload_request.get("hasEditedTranscript")
+    # profile name, or dict of stage (trim, web, mobile) -> profile name
+    encoding_profile = upload_request.get("encodingProfile")
+    if not is_valid_encoding_profile_selection(encoding_profile):
+        data = {
+            "error": "Bad Request",
+            "message": f"unknown encoding profile {encoding_profile}",
+        }
+        return create_json_response(401, data, event)
 
-    if not user_can_edit_mentor(mentor, auth_headers):
+    can_edit = cached_user_can_edit_mentor(mentor, auth_headers)
+    if can_edit is None:
+        can_edit, upload_in_progress = batch_gql(
+            [
+                user_can_edit_mentor_read(mentor),
+                upload_in_progress_read(FetchUploadTaskReq(mentor, question)),
+            ],
+            auth_headers,
+        )
+        cache_user_can_edit_mentor(mentor, auth_headers, can_edit)
+    else:
+        upload_in_progress = is_upload_in_progress(
+            FetchUploadTaskReq(mentor, question), auth_headers
+        )
+    if not can_edit:
         data = {
             "error": "not authorized",
             "message": "not authorized",
         }
         return create_json_response(401, data, event)
-    upload_in_progress = is_upload_in_progress(
-        FetchUploadTaskReq(mentor, question), auth_headers
-    )
     if upload_in_progress:
         data = {
             "error": "upload in progress",
@@ -204,30 +279,19 @@ def handler(event, context):
         }
         return create_json_response(401, data, event)
 
-    with tempfile.TemporaryDirectory() as work_dir:
-        file_path = os.path.join(
-            work_dir, "original_video"
-        )  # don't assume video file type
-        s3_client.download_file(upload_bucket, video_key, file_path)
-        try:
-            video_file_type = get_video_file_type(file_path)
-        except Exception as e:
-            log.debug(e)
-            log.debug("unknown file mime type, will attempt to transcode to mp4")
-            video_file_type = MP4
-
-        if not assert_video_duration(file_path, 1000):
-            data = {
-                "error": "Bad Request",
-                "message": "No video found or too short (1sec)!",
-            }
-            return create_json_response(401, data, event)
-
-        s3_path = f"videos/{mentor}/{question}"
-        # this will overwrite any existing file
-        upload_to_s3(
-            file_path, video_file_type, s3_path, mentor, question, auth_headers
-        )
+    video_file_type, has_min_duration, video_size = validate_upload(video_key)
+    if not has_min_duration:
+        data = {
+            "error": "Bad Request",
+            "message": "No video found or too short (1sec)!",
+        }
+        return create_json_response(401, data, event)
+
+    s3_path = f"videos/{mentor}/{question}"
+    # this will overwrite any existing file
+    upload_to_s3(
+        video_key, video_size, video_file_type, s3_path, mentor, question, auth_headers
+    )
 
     (
         transcode_web_task,
@@ -248,6 +312,11 @@ def handler(event, context):
             "video": f"{s3_path}/original.{video_file_type.extension}",
             "isVbgVideo": is_vbg_video,
             **({"trim": trim} if trim is not None else {}),
+            **(
+                {"encodingProfile": encoding_profile}
+                if encoding_profile is not None
+                else {}
+            ),
             "transcodeWebTask": transcode_web_task,
             "transcodeMobileTask": transcode_mobile_task,
             "trimUploadTask": trim_upload_task,
@@ -7,7 +7,7 @@
 import json
 import jwt
 from jsonschema import validate, ValidationError
-from module.logger import get_logger
+from module.logger import get_logger, metrics_handler
 from module.utils import load_sentry, require_env
 
 
@@ -56,6 +56,7 @@ def extract_token_from_header(request):
     return payload
 
 
+@metrics_handler()
 def handler(event, context):
     # do not log the token for security reasons:
     log.debug(f"{event['type']}, {event['methodArn']}")
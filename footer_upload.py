@@ -15,7 +15,7 @@ from module.api import (
     OrgFooterUpdateRequest,
     org_footer_update,
 )
-from module.logger import get_logger
+from module.logger import get_logger, metrics_handler
 from module.utils import (
     create_json_response,
     s3_bucket,
@@ -33,6 +33,7 @@ aws_region = require_env("REGION")
 s3_client = boto3.client("s3", region_name=aws_region)
 
 
+@metrics_handler()
 def handler(event, context):
     log.info(event)
     if "body" not in event:
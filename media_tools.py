@@ -4,21 +4,46 @@
 #
 # The full terms of this copyright and license should always be found in the root directory of this software deliverable as "license.txt" and if these terms are not found with this software, please contact the USC Stevens Center for the full license.
 #
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
 import boto3
 import logging
 import os
 import re
-from typing import List, Optional, Tuple, Union
+import shlex
+import subprocess
+import tempfile
+import threading
+import time
+from typing import (
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+    Tuple,
+    Union,
+)
 import math
 import ffmpy
 import filetype
-import subprocess
-import json
 import hashlib
+import json
+from functools import lru_cache
 from module.api import MentorThumbnailUpdateRequest, mentor_thumbnail_update
-from module.constants import Supported_Video_Type, supported_video_types
+from module.constants import (
+    MP4,
+    WEBM_VP9,
+    Supported_Video_Type,
+    supported_video_types,
+)
 from pymediainfo import MediaInfo
+from module.s3_utils import S3RangeReader, S3StreamUpload
+from module.encoding_profiles import EncodingProfile, get_encoding_profile
+from module.logger import set_metric_dimensions, span, video_metric_dimensions
 
 from module.utils import require_env, s3_bucket
 
@@ -28,12 +53,40 @@ LIB_FILE = os.environ.get(
 )
 FFMPEG_EXECUTABLE = os.environ.get("FFMPEG_EXECUTABLE", "/opt/ffmpeg/ffmpeg")
 FFPROBE_EXECUTABLE = os.environ.get("FFPROBE_EXECUTABLE", "/opt/ffmpeg/ffprobe")
+HASH_BUFFER_SIZE = 1024 * 1024
+# segmented encodes split sources into segments of at least this length
+SEGMENT_MIN_SECS = 15.0
+# off until measured at the lambda memory size: on one cpu segments are slower,
+# and every concat seam is a chance of a glitch
+SEGMENTED_ENCODE = os.environ.get("SEGMENTED_ENCODE", "false").lower() == "true"
+# filetype only looks at the first 261 bytes
+FILE_TYPE_HEADER_SIZE = 8192
+# output args for writing to a pipe: the muxer can't seek back to write an index.
+# fragmented mp4 puts an empty moov first and a moof per keyframe instead,
+# webm loses its cues and duration (so webm is never streamed)
+STREAM_FORMAT_ARGS = {
+    MP4.mime: ("-f", "mp4", "-movflags", "frag_keyframe+empty_moov+default_base_moof"),
+    WEBM_VP9.mime: ("-f", "webm"),
+}
+# streamed renditions skip /tmp but ship as fragmented mp4 (no faststart moov,
+# no top level duration or seek index), so it's opt in
+STREAM_RENDITION_UPLOADS = (
+    os.environ.get("STREAM_RENDITION_UPLOADS", "false").lower() == "true"
+)
+STREAM_UPLOAD_MIME_TYPES = [MP4.mime] if STREAM_RENDITION_UPLOADS else []
+THUMBNAIL_SECS = 1.0
+RANGED_PROBE_MAX_BYTES = 16 * 1024 * 1024
+# ffmpeg is killed when it reports no progress for this long, 0 never kills it.
+# a stream consumer that blocks (e.g. a stuck upload) also stops the progress
+FFMPEG_STALL_SECS = float(os.environ.get("FFMPEG_STALL_SECS", "120"))
+FFMPEG_STALL_CHECK_SECS = 1.0
 
 
 log = logging.getLogger("media-tools")
 
 
-def get_file_mime(video_file) -> str:
+def get_file_mime(video_file: Union[str, bytes]) -> str:
+    """video_file is a path or the first bytes of the file"""
     file_type = filetype.guess(video_file)
     if file_type is None:
         raise Exception("Failed to determine file type")
@@ -46,76 +99,258 @@ def hash_file(filename):
 
     # make a hash object
     h = hashlib.sha1()
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
 
     # open file for reading in binary mode
-    with open(filename, "rb") as file:
-        # loop till the end of the file
-        chunk = 0
-        while chunk != b"":
-            # read only 1024 bytes at a time
-            chunk = file.read(1024)
-            h.update(chunk)
+    with open(filename, "rb", buffering=0) as file:
+        # loop till the end of the file, reusing the same buffer
+        while True:
+            n = file.readinto(buffer)
+            if not n:
+                break
+            h.update(view[:n])
 
     # return the hex representation of digest
     return h.hexdigest()
 
 
-def get_video_metadata(video_file):
-    video_metadata_string = MediaInfo.parse(video_file, library_file=LIB_FILE).to_json()
-    video_metadata = json.loads(video_metadata_string)
-    duration = -1
-    try:
-        tracks = video_metadata["tracks"]
-        video_track = next(
-            (track for track in tracks if track["track_type"] == "Video")
+# mediainfo reports the container format name, ffprobe/ffmpeg use codec names
+MEDIAINFO_CODEC_NAMES = {
+    "AVC": "h264",
+    "HEVC": "hevc",
+    "VP8": "vp8",
+    "VP9": "vp9",
+    "AV1": "av1",
+    "MPEG-4 Visual": "mpeg4",
+    "ProRes": "prores",
+}
+
+
+@dataclass
+class MediaProbe:
+    """Everything the pipeline needs to know about a media file,
+    computed with a single MediaInfo parse (see probe_media)"""
+
+    path: str
+    size: int
+    mtime_ns: int
+    width: int = -1
+    height: int = -1
+    duration: float = -1.0  # secs, first video or audio track
+    video_duration: float = -1.0  # millisecs, as reported by mediainfo
+    video_codec: str = ""
+    pix_fmt: str = ""
+    container: str = ""  # mediainfo general format, e.g. MPEG-4 or WebM
+    audio_codec: str = ""  # mediainfo format of the first audio track, e.g. AAC
+    frame_rate: float = -1.0
+    bit_rate: int = -1  # overall, bits/sec
+    has_audio: bool = False
+    has_video: bool = False
+    metadata_json: str = ""
+
+    @property
+    def dims(self) -> Tuple[int, int]:
+        return (self.width, self.height)
+
+
+def _pix_fmt_from_track(video_track) -> str:
+    chroma = (video_track.chroma_subsampling or "").replace(":", "")
+    if not chroma:
+        return ""
+    alpha = "a" if str(video_track.alpha_mode or "") == "1" else ""
+    bit_depth = int(video_track.bit_depth or 8)
+    depth = f"p{bit_depth}le" if bit_depth > 8 else "p"
+    return f"yuv{alpha}{chroma}{depth}"
+
+
+def _parse_media_probe(path: str, size: int, mtime_ns: int) -> MediaProbe:
+    log.debug("mediainfo parse %s", path)
+    media_info = MediaInfo.parse(path, library_file=LIB_FILE)
+    return _media_probe_from_info(media_info, path, size, mtime_ns)
+
+
+def _media_probe_from_info(
+    media_info: MediaInfo, path: str, size: int, mtime_ns: int
+) -> MediaProbe:
+    probe = MediaProbe(path=path, size=size, mtime_ns=mtime_ns)
+    probe.metadata_json = media_info.to_json()
+    for t in media_info.tracks:
+        if t.track_type in ["Video", "Audio"] and probe.duration < 0:
+            try:
+                probe.duration = float(t.duration) / 1000
+            except Exception:
+                pass
+    probe.has_audio = len(media_info.audio_tracks) > 0
+    probe.has_video = len(media_info.video_tracks) > 0
+    if media_info.general_tracks:
+        probe.container = media_info.general_tracks[0].format or ""
+        probe.bit_rate = _int_or(media_info.general_tracks[0].overall_bit_rate, -1)
+    if probe.has_audio:
+        probe.audio_codec = media_info.audio_tracks[0].format or ""
+    if probe.has_video:
+        video_track = media_info.video_tracks[0]
+        probe.width = video_track.width
+        probe.height = video_track.height
+        try:
+            probe.video_duration = float(video_track.duration)
+        except Exception as e:
+            log.warning(f"Failed to parse video duration: {e}")
+        video_format = video_track.format or ""
+        probe.video_codec = MEDIAINFO_CODEC_NAMES.get(
+            video_format, video_format.lower()
         )
-        duration = float(video_track["duration"])
-    except Exception as e:
-        print(e)
-        print("Failed to parse duration")
+        probe.pix_fmt = _pix_fmt_from_track(video_track)
+        try:
+            probe.frame_rate = float(video_track.frame_rate)
+        except (TypeError, ValueError):
+            pass
+    return probe
+
+
+def _int_or(value, default: int) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+@lru_cache(maxsize=16)
+def _probe_media_cached(path: str, size: int, mtime_ns: int) -> MediaProbe:
+    with span("probe"):
+        return _parse_media_probe(path, size, mtime_ns)
+
+
+def probe_media(path: str) -> MediaProbe:
+    """Returns the MediaProbe for a local file or url.
+    Local files are parsed once and memoized by path, size and mtime,
+    so all helpers below share one parse per file version."""
+    if re.search("^https?", str(path)):
+        return _parse_media_probe(str(path), -1, -1)
+    stat = os.stat(path)
+    return _probe_media_cached(str(path), stat.st_size, stat.st_mtime_ns)
+
+
+def probe_media_cache_info():
+    """hits are mediainfo parses saved by the probe cache"""
+    return _probe_media_cached.cache_info()
+
+
+def probe_media_cache_clear() -> None:
+    _probe_media_cached.cache_clear()
+
+
+def probe_media_s3(
+    s3_client, bucket: str, key: str, max_bytes: int = RANGED_PROBE_MAX_BYTES
+) -> Tuple[MediaProbe, bytes]:
+    """Probes an s3 object without downloading it: mediainfo reads the
+    container header and index through ranged GETs.
+    Returns the probe and the first FILE_TYPE_HEADER_SIZE bytes (for get_video_file_type).
+    Raises S3ReadLimitExceeded when the parser needs more than max_bytes,
+    e.g. a webm without Cues that has to be scanned for its duration."""
+    reader = S3RangeReader(s3_client, bucket, key, max_bytes=max_bytes)
+    header = reader.read(FILE_TYPE_HEADER_SIZE)
+    reader.seek(0)
+    # parse_speed 0 stops after the headers/index instead of sampling frames,
+    # it still seeks to the end for an mp4 moov atom or webm clusters
+    media_info = MediaInfo.parse(reader, library_file=LIB_FILE, parse_speed=0)
+    log.info(
+        "probed s3://%s/%s: fetched %s of %s bytes in %s requests",
+        bucket,
+        key,
+        reader.bytes_fetched,
+        reader.size,
+        reader.requests,
+    )
+    probe = _media_probe_from_info(media_info, f"s3://{bucket}/{key}", reader.size, -1)
+    return probe, header
+
+
+# bump when fields of compact_media_metadata change meaning or go away
+MEDIA_METADATA_VERSION = 1
+
+
+def mediainfo_sidecar_key(video_key: str) -> str:
+    """where the full MediaInfo json of an answer video is stored,
+    next to it so it moves (and gets deleted) with the answer"""
+    return f"{os.path.splitext(video_key)[0]}.mediainfo.json"
+
+
+def compact_media_metadata(probe: MediaProbe, mediainfo_key: str = "") -> Dict:
+    """The parts of the MediaInfo dump that are used, the full dump is
+    the mediainfo_key sidecar (see store_mediainfo_sidecar)"""
+    return {
+        "version": MEDIA_METADATA_VERSION,
+        "container": probe.container,
+        "fileSize": probe.size,
+        "duration": probe.duration,
+        "bitRate": probe.bit_rate,
+        "video": {
+            "codec": probe.video_codec,
+            "width": probe.width,
+            "height": probe.height,
+            "frameRate": probe.frame_rate,
+            "pixFmt": probe.pix_fmt,
+        }
+        if probe.has_video
+        else None,
+        "audio": {"codec": probe.audio_codec} if probe.has_audio else None,
+        "mediainfoKey": mediainfo_key,
+    }
+
+
+def store_mediainfo_sidecar(s3_client, bucket: str, key: str, video_file) -> None:
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=probe_media(video_file).metadata_json.encode("utf-8"),
+        ContentType="application/json",
+    )
+
 
-    video_hash = hash_file(video_file)
-    return video_metadata_string, duration, video_hash
+def get_video_metadata(
+    video_file, video_hash: Optional[str] = None, mediainfo_key: str = ""
+):
+    """(compact metadata json, video duration in millisecs, SHA-1 of the file),
+    pass video_hash when it is already known (see download_file_with_hash)
+    to avoid reading the whole file again"""
+    probe = probe_media(video_file)
+    if probe.video_duration < 0:
+        log.warning("Failed to parse duration")
+    video_hash = video_hash or hash_file(video_file)
+    metadata = json.dumps(compact_media_metadata(probe, mediainfo_key))
+    return metadata, probe.video_duration, video_hash
 
 
 def assert_video_duration(video_file, min_length):
-    minfo = MediaInfo.parse(video_file, library_file=LIB_FILE)
-    try:
-        if len(minfo.video_tracks) == 0 or minfo.video_tracks[0].duration < min_length:
-            return False
-    except Exception as e:
-        log.warning(f"Failed to check video duration: {e}")
+    return assert_probe_duration(probe_media(video_file), min_length)
+
+
+def assert_probe_duration(probe: MediaProbe, min_length):
+    if not probe.has_video:
+        return False
+    if probe.video_duration >= 0 and probe.video_duration < min_length:
+        return False
     return True
 
 
 def has_audio(audio_or_video_file: str) -> bool:
-    media_info = MediaInfo.parse(audio_or_video_file, library_file=LIB_FILE)
-    return len(media_info.audio_tracks) > 0
+    return probe_media(audio_or_video_file).has_audio
+
+
+def set_video_metric_dimensions(probe: MediaProbe) -> None:
+    """the following spans of this invocation are per video duration and resolution"""
+    set_metric_dimensions(**video_metric_dimensions(probe.duration, *probe.dims))
 
 
 def find_duration(audio_or_video_file: str) -> float:
     log.info(audio_or_video_file)
-    media_info = MediaInfo.parse(audio_or_video_file, library_file=LIB_FILE)
-    for t in media_info.tracks:
-        if t.track_type in ["Video", "Audio"]:
-            try:
-                log.debug(t)
-                return float(t.duration / 1000)
-            except Exception:
-                pass
-    return -1.0
+    return probe_media(audio_or_video_file).duration
 
 
 def find_video_dims(video_file: str) -> Tuple[int, int]:
     log.info(video_file)
-    media_info = MediaInfo.parse(video_file, library_file=LIB_FILE)
-    video_tracks = [t for t in media_info.tracks if t.track_type == "Video"]
-    log.debug(video_tracks)
-    return (
-        (video_tracks[0].width, video_tracks[0].height)
-        if len(video_tracks) >= 1
-        else (-1, -1)
-    )
+    return probe_media(video_file).dims
 
 
 def format_secs(secs: Union[float, int, str]) -> str:
@@ -123,8 +358,13 @@ def format_secs(secs: Union[float, int, str]) -> str:
 
 
 def input_output_args_trim_video(
-    start_secs: float, end_secs: float, src_file: str, video_mime_type: str
+    start_secs: float,
+    end_secs: float,
+    src_file: str,
+    video_mime_type: str,
+    profile: Optional[EncodingProfile] = None,
 ) -> Tuple[str, ...]:
+    profile = profile or get_encoding_profile()
     i_w, i_h = find_video_dims(src_file)
     o_w = int(i_w)
     o_h = int(i_h)
@@ -142,51 +382,75 @@ def input_output_args_trim_video(
         format_secs(start_secs),
         "-to",
         format_secs(end_secs),
-        "-c:v",
-        "libx264" if video_mime_type == "video/mp4" else "libvpx-vp9",
-        "-crf",
-        "10",
-        "-c:a",
-        audio_codec,
-        "-b:a",
-        "320k" if video_mime_type == "video/mp4" else "256k"
+        *(
+            profile.x264_args()
+            if video_mime_type == "video/mp4"
+            else profile.vp9_args()
+        ),
+        *profile.audio_args(audio_codec),
     )
     return input_args, output_args
 
 
+def video_filter_crop_scale(
+    crop_iw: float, crop_ih: float, scale_ow: int, scale_oh: int
+) -> str:
+    return f"crop=iw-{crop_iw:.0f}:ih-{crop_ih:.0f},scale={scale_ow:.0f}:{scale_oh:.0f},fps=30"
+
+
+def webm_vp9_ffmpeg_video_codec_args(
+    profile: Optional[EncodingProfile] = None,
+) -> Tuple[str, ...]:
+    profile = profile or get_encoding_profile()
+    return (
+        *profile.vp9_args(),
+        "-pix_fmt",
+        "yuva420p",
+        "-movflags",
+        "+faststart",
+        "-metadata:s:v:0",
+        "alpha_mode=1",
+    )
+
+
+def webm_vp9_ffmpeg_audio_codec_args(
+    profile: Optional[EncodingProfile] = None,
+) -> Tuple[str, ...]:
+    profile = profile or get_encoding_profile()
+    return (*profile.audio_args("libvorbis"), "-ac", "2")
+
+
+def webm_vp9_ffmpeg_codec_args(
+    profile: Optional[EncodingProfile] = None,
+) -> Tuple[str, ...]:
+    return (
+        *webm_vp9_ffmpeg_video_codec_args(profile),
+        *webm_vp9_ffmpeg_audio_codec_args(profile),
+    )
+
+
 # Note: These args REQUIRE the input video to be vp9 encoded, else ffmpeg will throw an error
 def webm_vp9_ffmpeg_transcode_args(
-    crop_iw: float, crop_ih: float, scale_ow: int, scale_oh: int
+    crop_iw: float,
+    crop_ih: float,
+    scale_ow: int,
+    scale_oh: int,
+    profile: Optional[EncodingProfile] = None,
 ):
     return (
         ("-c:v", "libvpx-vp9"),
         (
             "-y",
             "-filter:v",
-            f"crop=iw-{crop_iw:.0f}:ih-{crop_ih:.0f},scale={scale_ow:.0f}:{scale_oh:.0f},fps=30",
-            "-c:v",
-            "libvpx-vp9",
-            "-crf",
-            "10",
-            "-pix_fmt",
-            "yuva420p",
-            "-movflags",
-            "+faststart",
-            "-c:a",
-            "libvorbis",
-            "-b:a",
-            "320k",
-            "-ac",
-            "2",
+            video_filter_crop_scale(crop_iw, crop_ih, scale_ow, scale_oh),
+            *webm_vp9_ffmpeg_codec_args(profile),
             "-loglevel",
             "verbose",
-            "-metadata:s:v:0",
-            "alpha_mode=1",
         ),
     )
 
 
-def get_video_file_type(file_path: str) -> Supported_Video_Type:
+def get_video_file_type(file_path: Union[str, bytes]) -> Supported_Video_Type:
     video_file_mime = get_file_mime(file_path)
     log.debug(f"video mime type: {video_file_mime}")
     try:
@@ -203,63 +467,112 @@ def get_video_file_type(file_path: str) -> Supported_Video_Type:
 
 def get_video_encoding_type(src_file):
     try:
-        ff = ffmpy.FFprobe(
-            inputs={
-                str(src_file): ("-v", "quiet", "-print_format", "json", "-show_streams")
-            },
-            executable=FFPROBE_EXECUTABLE,
-        )
-        output = ff.run(stdout=subprocess.PIPE)
-        data = json.loads(output[0])
-        streams = data["streams"]
-        video_stream = next(
-            stream for stream in streams if stream["codec_type"] == "video"
-        )
-        codec = video_stream["codec_name"]
-        return codec
+        return probe_media(src_file).video_codec
     except Exception as e:
         log.info(e)
         log.info(f"Unable to determine codec type for {src_file}")
         return ""
 
 
+def get_desired_video_file_type(
+    video_file: str, is_vbg_video: bool
+) -> Supported_Video_Type:
+    """vbg videos keep their vp9 webm (alpha channel), everything else becomes mp4"""
+    if not is_vbg_video:
+        return MP4
+    try:
+        file_mime_type = get_file_mime(video_file)
+        file_encoding = get_video_encoding_type(video_file)
+        if file_mime_type == "video/webm" and file_encoding == "vp9":
+            return WEBM_VP9
+    except Exception as e:
+        log.info(
+            f"Failed to determine mime and encoding type for {video_file}, defaulting to mp4"
+        )
+        log.info(e)
+    return MP4
+
+
+def mp4_ffmpeg_video_codec_args(
+    profile: Optional[EncodingProfile] = None,
+) -> Tuple[str, ...]:
+    profile = profile or get_encoding_profile()
+    return (*profile.x264_args(), "-pix_fmt", "yuv420p", "-movflags", "+faststart")
+
+
+def mp4_ffmpeg_audio_codec_args(
+    profile: Optional[EncodingProfile] = None,
+) -> Tuple[str, ...]:
+    profile = profile or get_encoding_profile()
+    return (*profile.audio_args("aac"), "-ac", "2")
+
+
+def mp4_ffmpeg_codec_args(
+    profile: Optional[EncodingProfile] = None,
+) -> Tuple[str, ...]:
+    return (
+        *mp4_ffmpeg_video_codec_args(profile),
+        *mp4_ffmpeg_audio_codec_args(profile),
+    )
+
+
 def mp4_ffmpeg_transcode_args(
-    crop_iw: float, crop_ih: float, scale_ow: int, scale_oh: int
+    crop_iw: float,
+    crop_ih: float,
+    scale_ow: int,
+    scale_oh: int,
+    profile: Optional[EncodingProfile] = None,
 ):
     return (
         None,
         (
             "-y",
             "-filter:v",
-            f"crop=iw-{crop_iw:.0f}:ih-{crop_ih:.0f},scale={scale_ow:.0f}:{scale_oh:.0f},fps=30",
-            "-c:v",
-            "libx264",
-            "-crf",
-            "10",
-            "-pix_fmt",
-            "yuv420p",
-            "-movflags",
-            "+faststart",
-            "-c:a",
-            "aac",
-            "-b:a",
-            "320k",
-            "-ac",
-            "2",
+            video_filter_crop_scale(crop_iw, crop_ih, scale_ow, scale_oh),
+            *mp4_ffmpeg_codec_args(profile),
             "-loglevel",
-            "quiet",
+            "info",
         ),
     )
 
 
-def get_args_video_encode_for_mobile(
-    src_file: str,
-    video_mime_type: str,
+def ffmpeg_codec_args(
+    video_mime_type: str, profile: Optional[EncodingProfile] = None
+) -> Tuple[str, ...]:
+    return (
+        *ffmpeg_video_codec_args(video_mime_type, profile),
+        *ffmpeg_audio_codec_args(video_mime_type, profile),
+    )
+
+
+def ffmpeg_video_codec_args(
+    video_mime_type: str, profile: Optional[EncodingProfile] = None
+) -> Tuple[str, ...]:
+    if video_mime_type == "video/mp4":
+        return mp4_ffmpeg_video_codec_args(profile)
+    elif video_mime_type == "video/webm":
+        return webm_vp9_ffmpeg_video_codec_args(profile)
+    else:
+        raise Exception(f"Unsupported file mime type: {video_mime_type}")
+
+
+def ffmpeg_audio_codec_args(
+    video_mime_type: str, profile: Optional[EncodingProfile] = None
+) -> Tuple[str, ...]:
+    if video_mime_type == "video/mp4":
+        return mp4_ffmpeg_audio_codec_args(profile)
+    elif video_mime_type == "video/webm":
+        return webm_vp9_ffmpeg_audio_codec_args(profile)
+    else:
+        raise Exception(f"Unsupported file mime type: {video_mime_type}")
+
+
+def get_crop_scale_for_mobile(
+    video_dims: Tuple[int, int],
     target_height=480,
-    video_dims: Optional[Tuple[int, int]] = None,
     maintain_original_aspect_ratio=False,
-) -> Tuple[str, ...]:
-    i_w, i_h = video_dims or find_video_dims(src_file)
+) -> Tuple[float, float, int, int]:
+    i_w, i_h = video_dims
     o_w, o_h = (target_height, target_height)
     crop_w = 0
     crop_h = 0
@@ -274,23 +587,16 @@ def get_args_video_encode_for_mobile(
     else:
         o_h = round(min(target_height, i_h))
         o_w = int(i_w * (o_h / i_h))
-    if video_mime_type == "video/mp4":
-        return mp4_ffmpeg_transcode_args(crop_w, crop_h, o_w, o_h)
-    elif video_mime_type == "video/webm":
-        return webm_vp9_ffmpeg_transcode_args(crop_w, crop_h, o_w, o_h)
-    else:
-        raise Exception(f"Unsupported file mime type: {video_mime_type}")
+    return crop_w, crop_h, o_w, o_h
 
 
-def get_args_video_encode_for_web(
-    src_file: str,
-    video_mime_type: str,
+def get_crop_scale_for_web(
+    video_dims: Tuple[int, int],
     max_height=720,
     target_aspect=1.77777777778,
-    video_dims: Optional[Tuple[int, int]] = None,
     maintain_original_aspect_ratio=False,
-) -> Tuple[str, ...]:
-    i_w, i_h = video_dims or find_video_dims(src_file)
+) -> Tuple[float, float, int, int]:
+    i_w, i_h = video_dims
     crop_w = 0
     crop_h = 0
     o_w = 0
@@ -310,14 +616,708 @@ def get_args_video_encode_for_web(
         o_w += 1  # ensure width is divisible by 2
     if o_h % 2 != 0:
         o_h += 1  # ensure height is divisible by 2
+    return crop_w, crop_h, o_w, o_h
+
+
+def get_args_video_encode_for_mobile(
+    src_file: str,
+    video_mime_type: str,
+    target_height=480,
+    video_dims: Optional[Tuple[int, int]] = None,
+    maintain_original_aspect_ratio=False,
+    profile: Optional[EncodingProfile] = None,
+) -> Tuple[str, ...]:
+    crop_w, crop_h, o_w, o_h = get_crop_scale_for_mobile(
+        video_dims or find_video_dims(src_file),
+        target_height=target_height,
+        maintain_original_aspect_ratio=maintain_original_aspect_ratio,
+    )
     if video_mime_type == "video/mp4":
-        return mp4_ffmpeg_transcode_args(crop_w, crop_h, o_w, o_h)
+        return mp4_ffmpeg_transcode_args(crop_w, crop_h, o_w, o_h, profile)
     elif video_mime_type == "video/webm":
-        return webm_vp9_ffmpeg_transcode_args(crop_w, crop_h, o_w, o_h)
+        return webm_vp9_ffmpeg_transcode_args(crop_w, crop_h, o_w, o_h, profile)
     else:
         raise Exception(f"Unsupported file mime type: {video_mime_type}")
 
 
+def get_args_video_encode_for_web(
+    src_file: str,
+    video_mime_type: str,
+    max_height=720,
+    target_aspect=1.77777777778,
+    video_dims: Optional[Tuple[int, int]] = None,
+    maintain_original_aspect_ratio=False,
+    profile: Optional[EncodingProfile] = None,
+) -> Tuple[str, ...]:
+    crop_w, crop_h, o_w, o_h = get_crop_scale_for_web(
+        video_dims or find_video_dims(src_file),
+        max_height=max_height,
+        target_aspect=target_aspect,
+        maintain_original_aspect_ratio=maintain_original_aspect_ratio,
+    )
+    if video_mime_type == "video/mp4":
+        return mp4_ffmpeg_transcode_args(crop_w, crop_h, o_w, o_h, profile)
+    elif video_mime_type == "video/webm":
+        return webm_vp9_ffmpeg_transcode_args(crop_w, crop_h, o_w, o_h, profile)
+    else:
+        raise Exception(f"Unsupported file mime type: {video_mime_type}")
+
+
+@dataclass
+class Rendition:
+    """One output of video_encode_renditions, e.g. web.mp4 or mobile.webm"""
+
+    tag: str
+    target_file: str
+    video_mime_type: str
+    crop_scale: Tuple[float, float, int, int]
+    profile: Optional[EncodingProfile] = None
+
+
+def get_renditions(
+    src_file: str,
+    work_dir: str,
+    tags: List[str],
+    video_file_type: Supported_Video_Type,
+    maintain_original_aspect_ratio=False,
+    profiles: Optional[Dict[str, EncodingProfile]] = None,
+) -> List[Rendition]:
+    """web and/or mobile renditions as produced by
+    video_encode_for_web and video_encode_for_mobile.
+    webm renditions also get an mp4 fallback for browsers that do not support webm
+    (encoded with EncodingProfile.mp4_fallback).
+    profiles is the encoding profile per tag, missing tags get the default one"""
+    profiles = profiles or {}
+    video_dims = find_video_dims(src_file)
+    crop_scale_by_tag = {
+        "web": lambda: get_crop_scale_for_web(
+            video_dims, maintain_original_aspect_ratio=maintain_original_aspect_ratio
+        ),
+        "mobile": lambda: get_crop_scale_for_mobile(
+            video_dims, maintain_original_aspect_ratio=maintain_original_aspect_ratio
+        ),
+    }
+    video_file_types = (
+        [video_file_type, MP4] if video_file_type.mime == "video/webm" else [MP4]
+    )
+    renditions = []
+    for tag in tags:
+        crop_scale = crop_scale_by_tag[tag]()
+        profile = profiles.get(tag) or get_encoding_profile()
+        renditions.extend(
+            Rendition(
+                tag=tag,
+                target_file=os.path.join(work_dir, f"{tag}.{file_type.extension}"),
+                video_mime_type=file_type.mime,
+                crop_scale=crop_scale,
+                profile=(
+                    profile.mp4_fallback()
+                    if file_type == MP4 and video_file_type != MP4
+                    else profile
+                ),
+            )
+            for file_type in video_file_types
+        )
+    return renditions
+
+
+def get_args_video_encode_renditions(
+    renditions: List[Rendition],
+    include_audio=True,
+    thumbnail_file: Optional[str] = None,
+) -> Tuple[Tuple[str, ...], Tuple[str, ...], Dict[str, Tuple[str, ...]]]:
+    """Decodes the source once and splits the frames into one
+    crop/scale chain per distinct geometry, every rendition is a separate output.
+    Renditions with the same geometry (e.g. web.webm and web.mp4) share their
+    scaled frames, they only differ in the encoder.
+    thumbnail_file gets one more branch of unscaled frames (see thumbnail_output_args)"""
+    input_args = (
+        ("-c:v", "libvpx-vp9")
+        if any(r.video_mime_type == "video/webm" for r in renditions)
+        else ()
+    )
+    chains: Dict[Tuple[float, float, int, int], List[int]] = {}
+    for i, r in enumerate(renditions):
+        chains.setdefault(r.crop_scale, []).append(i)
+    branches = len(chains) + (1 if thumbnail_file else 0)
+    split_labels = "".join(f"[s{i}]" for i in range(branches))
+    filters = [f"[0:v]split={branches}{split_labels}"]
+    for i, (crop_scale, outputs) in enumerate(chains.items()):
+        output_labels = "".join(f"[v{j}]" for j in outputs)
+        chain = f"[s{i}]{video_filter_crop_scale(*crop_scale)}"
+        if len(outputs) > 1:
+            chain += f",split={len(outputs)}"
+        filters.append(f"{chain}{output_labels}")
+    global_args = ("-y", "-loglevel", "info", "-filter_complex", ";".join(filters))
+    output_args = {
+        r.target_file: (
+            "-map",
+            f"[v{i}]",
+            *(
+                ("-map", "0:a:0?", *ffmpeg_codec_args(r.video_mime_type, r.profile))
+                if include_audio
+                else ffmpeg_video_codec_args(r.video_mime_type, r.profile)
+            ),
+        )
+        for i, r in enumerate(renditions)
+    }
+    if thumbnail_file:
+        output_args[thumbnail_file] = (
+            "-map",
+            f"[s{len(chains)}]",
+            *thumbnail_output_args(),
+        )
+    return input_args, global_args, output_args
+
+
+def thumbnail_output_args() -> Tuple[str, ...]:
+    """one jpeg of the frame at THUMBNAIL_SECS. The frames before it are
+    decoded anyway for the renditions, so this only costs one jpeg encode.
+    The raw mjpeg muxer writes the same bytes to a file or to a pipe"""
+    return (
+        "-ss",
+        format_secs(THUMBNAIL_SECS),
+        "-frames:v",
+        "1",
+        "-q:v",
+        "2",
+        "-c:v",
+        "mjpeg",
+        "-f",
+        "mjpeg",
+    )
+
+
+def available_cpus() -> int:
+    """cpus this process may run on (lambda gives fewer than cpu_count
+    reports at small memory sizes)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def get_segment_count(src_file: str) -> int:
+    """1 unless SEGMENTED_ENCODE, then one segment per available cpu,
+    but none shorter than SEGMENT_MIN_SECS"""
+    if not SEGMENTED_ENCODE:
+        return 1
+    cpus = available_cpus()
+    if cpus < 2:
+        return 1
+    return max(1, min(cpus, int(find_duration(src_file) // SEGMENT_MIN_SECS)))
+
+
+def get_segment_starts(
+    keyframes: List[float], duration: float, segment_count: int
+) -> List[float]:
+    """start secs of each segment: the keyframes closest to an even split"""
+    starts = [0.0]
+    for i in range(1, segment_count):
+        target = duration * i / segment_count
+        keyframe = min(keyframes, key=lambda k: abs(k - target))
+        if keyframe > starts[-1] + KEYFRAME_TOLERANCE_SECS:
+            starts.append(keyframe)
+    return starts
+
+
+@dataclass
+class FFmpegProgress:
+    """One -progress report of a running ffmpeg (see ffmpeg_run)"""
+
+    frame: int = 0
+    fps: float = 0.0
+    speed: float = 0.0  # x realtime
+    out_time_secs: float = 0.0
+    total_size: int = 0
+    done: bool = False
+
+
+def _progress_value(values: Dict[str, str], key: str, cast, default):
+    # values are N/A until ffmpeg knows them, speed has an x suffix
+    try:
+        return cast(values.get(key, "").strip().rstrip("x"))
+    except ValueError:
+        return default
+
+
+def parse_ffmpeg_progress(lines: Iterable[str]) -> Iterator[FFmpegProgress]:
+    """ffmpeg -progress writes key=value lines,
+    every report ends with progress=continue (or progress=end for the last one)"""
+    values: Dict[str, str] = {}
+    for line in lines:
+        key, _, value = line.strip().partition("=")
+        if key != "progress":
+            values[key] = value
+            continue
+        yield FFmpegProgress(
+            frame=_progress_value(values, "frame", int, 0),
+            fps=_progress_value(values, "fps", float, 0.0),
+            speed=_progress_value(values, "speed", float, 0.0),
+            out_time_secs=max(0, _progress_value(values, "out_time_us", int, 0))
+            / 1000000,
+            total_size=_progress_value(values, "total_size", int, 0),
+            done=value == "end",
+        )
+        values = {}
+
+
+def sum_ffmpeg_progress(progress: List[FFmpegProgress]) -> FFmpegProgress:
+    """progress of ffmpegs running in parallel on parts of the same source"""
+    return FFmpegProgress(
+        frame=sum(p.frame for p in progress),
+        fps=sum(p.fps for p in progress),
+        speed=sum(p.speed for p in progress),
+        out_time_secs=sum(p.out_time_secs for p in progress),
+        total_size=sum(p.total_size for p in progress),
+        done=all(p.done for p in progress),
+    )
+
+
+def throttle_progress(
+    on_progress: Callable[[FFmpegProgress], None], interval_secs: float
+) -> Callable[[FFmpegProgress], None]:
+    """forwards the first report and then at most one every interval_secs"""
+    lock = threading.Lock()
+    last_report: List[float] = []
+
+    def report(progress: FFmpegProgress) -> None:
+        with lock:
+            now = time.monotonic()
+            if last_report and now - last_report[0] < interval_secs:
+                return
+            last_report[:] = [now]
+        on_progress(progress)
+
+    return report
+
+
+class BackgroundProgress:
+    """Hands reports to on_progress on its own thread, so a slow callback
+    (a graphql update) never holds up the -progress pipe and trips the stall
+    check. Only the latest report waits while one is being handled, failures
+    are only logged. Use as a context manager, once closed the waiting report
+    is dropped and the running one finished, so no update lands after the
+    caller's own final one"""
+
+    def __init__(self, on_progress: Callable[[FFmpegProgress], None]):
+        self.on_progress = on_progress
+        self.lock = threading.Lock()
+        self.latest: List[FFmpegProgress] = []
+        self.busy = False
+        self.closed = False
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="progress")
+
+    def __enter__(self) -> "BackgroundProgress":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __call__(self, progress: FFmpegProgress) -> None:
+        with self.lock:
+            if self.closed:
+                return
+            self.latest[:] = [progress]
+            if self.busy:
+                return
+            self.busy = True
+        self.executor.submit(self._drain)
+
+    def _drain(self) -> None:
+        while True:
+            with self.lock:
+                if not self.latest:
+                    self.busy = False
+                    return
+                progress = self.latest.pop()
+            try:
+                self.on_progress(progress)
+            except Exception as e:
+                log.warning("progress report failed: %s", e)
+
+    def close(self) -> None:
+        with self.lock:
+            self.closed = True
+            self.latest.clear()
+        self.executor.shutdown(wait=True)
+
+
+def read_ffmpeg_progress(
+    lines: TextIO,
+    last_progress: List[float],
+    on_progress: Optional[Callable[[FFmpegProgress], None]],
+) -> None:
+    """reads -progress until ffmpeg exits, last_progress[0] is the
+    time.monotonic() when frames, out_time or size last moved"""
+    position = None
+    with lines:
+        for progress in parse_ffmpeg_progress(lines):
+            moved = (progress.frame, progress.out_time_secs, progress.total_size)
+            if moved != position:
+                position = moved
+                last_progress[0] = time.monotonic()
+            if on_progress:
+                try:
+                    on_progress(progress)
+                except Exception as e:
+                    log.warning("ffmpeg progress callback failed: %s", e)
+
+
+def wait_ffmpeg(
+    process: subprocess.Popen, last_progress: List[float], stall_secs: float
+) -> Tuple[int, bool]:
+    """waits for ffmpeg to exit, kills it once last_progress[0]
+    is more than stall_secs ago. Returns the exit code and if it stalled"""
+    stalled = False
+    while True:
+        try:
+            return process.wait(timeout=FFMPEG_STALL_CHECK_SECS), stalled
+        except subprocess.TimeoutExpired:
+            if stall_secs and time.monotonic() - last_progress[0] > stall_secs:
+                log.error("ffmpeg made no progress for %ss, killing it", stall_secs)
+                stalled = True
+                process.kill()
+
+
+def ffmpeg_run(
+    global_args: Tuple[str, ...],
+    inputs: Dict[str, Optional[Tuple[str, ...]]],
+    outputs: Dict[str, Tuple[str, ...]],
+    streams: Optional[Dict[str, Callable[[BinaryIO], None]]] = None,
+    on_progress: Optional[Callable[[FFmpegProgress], None]] = None,
+    stall_secs: float = FFMPEG_STALL_SECS,
+) -> None:
+    """Runs ffmpeg with -progress written to a pipe, every report goes to
+    on_progress (from another thread, failures are only logged).
+    ffmpeg is killed when frames, out_time and size don't move for stall_secs.
+    Every output in streams is written to a pipe instead of its file,
+    each stream consumer reads its pipe in a thread while ffmpeg runs.
+    The output args must already pick a format (see STREAM_FORMAT_ARGS).
+    Raises if ffmpeg or any consumer fails, consumers only see EOF either way
+    so they must not treat it as success (see S3StreamUpload.complete)"""
+    streams = streams or {}
+    pipes = {target: os.pipe() for target in streams}
+    progress_read_fd, progress_write_fd = os.pipe()
+    # the argv is assembled here rather than by ffmpy, which only exposes
+    # a printable command line and always inherits stdin
+    cmd = [
+        FFMPEG_EXECUTABLE,
+        "-nostdin",
+        *global_args,
+        "-nostats",
+        "-progress",
+        f"pipe:{progress_write_fd}",
+    ]
+    for source, args in inputs.items():
+        cmd += [*(args or ()), "-i", source]
+    for target, args in outputs.items():
+        cmd += [
+            *(args or ()),
+            f"pipe:{pipes[target][1]}" if target in pipes else target,
+        ]
+    log.debug(shlex.join(cmd))
+    write_fds = [progress_write_fd, *(write_fd for _, write_fd in pipes.values())]
+    try:
+        process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, pass_fds=write_fds)
+    finally:
+        # ffmpeg has its own copies, the readers only see EOF once those close
+        for write_fd in write_fds:
+            os.close(write_fd)
+    errors = []
+    last_progress = [time.monotonic()]
+
+    def consume(target: str) -> None:
+        with os.fdopen(pipes[target][0], "rb") as stream:
+            try:
+                streams[target](stream)
+            except Exception as e:
+                errors.append(e)
+                # nobody reads this pipe anymore, ffmpeg would block on it
+                process.kill()
+
+    with ThreadPoolExecutor(max_workers=len(streams) + 1) as executor:
+        readers = [
+            executor.submit(
+                read_ffmpeg_progress,
+                os.fdopen(progress_read_fd, "r"),
+                last_progress,
+                on_progress,
+            ),
+            *(executor.submit(consume, target) for target in streams),
+        ]
+        returncode, stalled = wait_ffmpeg(process, last_progress, stall_secs)
+        for reader in readers:
+            reader.result()
+    if errors:
+        raise errors[0]
+    if stalled:
+        raise Exception(f"ffmpeg made no progress for {stall_secs}s: {shlex.join(cmd)}")
+    if returncode != 0:
+        raise ffmpy.FFRuntimeError(shlex.join(cmd), returncode, b"", b"")
+
+
+def with_stream_format_args(
+    renditions: List[Rendition],
+    output_args: Dict[str, Tuple[str, ...]],
+    streams: Dict[str, Callable[[BinaryIO], None]],
+) -> Dict[str, Tuple[str, ...]]:
+    # a later -movflags replaces the +faststart of the codec args,
+    # outputs that aren't renditions (the thumbnail) already pick their format
+    mime_types = {r.target_file: r.video_mime_type for r in renditions}
+    return {
+        target: (
+            (*args, *STREAM_FORMAT_ARGS[mime_types[target]])
+            if target in streams and target in mime_types
+            else args
+        )
+        for target, args in output_args.items()
+    }
+
+
+def video_encode_renditions(
+    src_file: str,
+    renditions: List[Rendition],
+    segment_count: Optional[int] = None,
+    streams: Optional[Dict[str, Callable[[BinaryIO], None]]] = None,
+    thumbnail_file: Optional[str] = None,
+    on_progress: Optional[Callable[[FFmpegProgress], None]] = None,
+) -> None:
+    """Produces all renditions, the source is only decoded once.
+    With more than one segment (default: see get_segment_count) the source is
+    split at keyframes and the segments are encoded in parallel,
+    falls back to a single process if that fails.
+    streams maps target files to consumers that get the output as a pipe
+    instead (see ffmpeg_run), those files are never written.
+    thumbnail_file (which can be streamed too) is a jpeg of the source at
+    THUMBNAIL_SECS, taken from the same decode.
+    on_progress gets the encode progress, out_time_secs runs up to the duration"""
+    streams = streams or {}
+    log.info("%s, %s", src_file, [r.target_file for r in renditions])
+    for r in renditions:
+        os.makedirs(os.path.dirname(r.target_file), exist_ok=True)
+    if segment_count is None:
+        segment_count = get_segment_count(src_file)
+    if segment_count > 1:
+        try:
+            video_encode_renditions_segmented(
+                src_file,
+                renditions,
+                segment_count,
+                streams=streams,
+                thumbnail_file=thumbnail_file,
+                on_progress=on_progress,
+            )
+            return
+        except Exception as e:
+            log.warning("segmented encode failed (%s), using one process", e)
+    input_args, global_args, output_args = get_args_video_encode_renditions(
+        renditions, thumbnail_file=thumbnail_file
+    )
+    ffmpeg_run(
+        global_args,
+        {str(src_file): input_args},
+        with_stream_format_args(renditions, output_args, streams),
+        streams=streams,
+        on_progress=on_progress,
+    )
+
+
+def video_encode_renditions_segmented(
+    src_file: str,
+    renditions: List[Rendition],
+    segment_count: int,
+    streams: Optional[Dict[str, Callable[[BinaryIO], None]]] = None,
+    thumbnail_file: Optional[str] = None,
+    on_progress: Optional[Callable[[FFmpegProgress], None]] = None,
+) -> None:
+    """Splits the source at keyframes and encodes the video of every segment
+    in its own ffmpeg process, as many in parallel as there are cpus
+    (threads running ffmpeg, lambda has no /dev/shm for multiprocessing).
+    The segments are joined with a stream copy and the audio is encoded once.
+    The thumbnail comes out of the first segment.
+    on_progress gets the sum of the segment encodes (see sum_ffmpeg_progress),
+    the join is too quick to report"""
+    streams = streams or {}
+    starts = get_segment_starts(
+        find_keyframes(src_file), find_duration(src_file), segment_count
+    )
+    if len(starts) < 2:
+        raise Exception("not enough keyframes to split the source")
+    cpus = os.cpu_count() or 1
+    workers = min(len(starts), cpus)
+    threads = max(1, cpus // workers)
+    log.info("encoding %s segments starting at %s", len(starts), starts)
+    with tempfile.TemporaryDirectory() as work_dir:
+        segments = [
+            [
+                replace(
+                    r,
+                    target_file=os.path.join(
+                        work_dir, f"{i}-{os.path.basename(r.target_file)}"
+                    ),
+                    profile=replace(
+                        r.profile or get_encoding_profile(), threads=threads
+                    ),
+                )
+                for r in renditions
+            ]
+            for i in range(len(starts))
+        ]
+
+        segment_progress = [FFmpegProgress() for _ in starts]
+        progress_lock = threading.Lock()
+
+        def report_segment_progress(i: int, progress: FFmpegProgress) -> None:
+            with progress_lock:
+                segment_progress[i] = progress
+                total = sum_ffmpeg_progress(segment_progress)
+            on_progress(total)
+
+        def encode_segment(i: int) -> None:
+            segment_thumbnail_file = thumbnail_file if i == 0 else None
+            input_args, global_args, output_args = get_args_video_encode_renditions(
+                segments[i],
+                include_audio=False,
+                thumbnail_file=segment_thumbnail_file,
+            )
+            duration_args = (
+                ("-t", format_secs(starts[i + 1] - starts[i]))
+                if i + 1 < len(starts)
+                else ()
+            )
+            inputs = {str(src_file): (*input_args, "-ss", format_secs(starts[i]))}
+            outputs = {f: (*duration_args, *a) for f, a in output_args.items()}
+            ffmpeg_run(
+                global_args,
+                inputs,
+                outputs,
+                streams={
+                    target: stream
+                    for target, stream in streams.items()
+                    if target == segment_thumbnail_file
+                },
+                on_progress=(
+                    (lambda progress: report_segment_progress(i, progress))
+                    if on_progress
+                    else None
+                ),
+            )
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(encode_segment, range(len(starts))))
+
+        inputs = {str(src_file): None}
+        outputs = {}
+        for j, r in enumerate(renditions):
+            concat_file = os.path.join(work_dir, f"concat-{j}.txt")
+            with open(concat_file, "w") as f:
+                f.writelines(
+                    f"file '{segment[j].target_file}'\n" for segment in segments
+                )
+            inputs[concat_file] = ("-f", "concat", "-safe", "0")
+            outputs[r.target_file] = (
+                "-map",
+                f"{j + 1}:v:0",
+                "-map",
+                "0:a:0?",
+                "-c:v",
+                "copy",
+                *ffmpeg_audio_codec_args(r.video_mime_type, r.profile),
+                "-movflags",
+                "+faststart",
+                *(
+                    ("-metadata:s:v:0", "alpha_mode=1")
+                    if r.video_mime_type == "video/webm"
+                    else ()
+                ),
+            )
+        global_args = ("-y", "-loglevel", "info")
+        rendition_streams = {
+            target: stream for target, stream in streams.items() if target in outputs
+        }
+        ffmpeg_run(
+            global_args,
+            inputs,
+            with_stream_format_args(renditions, outputs, rendition_streams),
+            streams=rendition_streams,
+        )
+
+
+def video_encode_renditions_to_s3(
+    src_file: str,
+    renditions: List[Rendition],
+    s3_path: str,
+    with_thumbnail=False,
+    on_progress: Optional[Callable[[FFmpegProgress], None]] = None,
+) -> Optional[bytes]:
+    """Encodes the renditions and uploads them to s3_path/<target file name>.
+    By default they are written to /tmp (mp4 with +faststart) and uploaded after.
+    With STREAM_RENDITION_UPLOADS the STREAM_UPLOAD_MIME_TYPES renditions go
+    straight from ffmpeg into a multipart upload while they encode as fragmented
+    mp4, webm always needs a seekable output for its cues.
+    with_thumbnail returns the jpeg thumbnail produced by the same ffmpeg
+    (None if the video is too short to have one)"""
+    thumbnail = {}
+
+    def read_thumbnail(stream: BinaryIO) -> None:
+        thumbnail["jpeg"] = stream.read()
+
+    thumbnail_file = (
+        os.path.join(os.path.dirname(renditions[0].target_file), "thumbnail.jpg")
+        if with_thumbnail
+        else None
+    )
+    uploads = {
+        r.target_file: S3StreamUpload(
+            s3_client,
+            s3_bucket,
+            f"{s3_path}/{os.path.basename(r.target_file)}",
+            r.video_mime_type,
+        )
+        for r in renditions
+        if r.video_mime_type in STREAM_UPLOAD_MIME_TYPES
+    }
+    rendition_names = ",".join(os.path.basename(r.target_file) for r in renditions)
+    try:
+        # the streamed renditions upload while they encode
+        with span("encode", Renditions=rendition_names) as encode_span:
+            video_encode_renditions(
+                src_file,
+                renditions,
+                streams={
+                    **{target: u.upload_from for target, u in uploads.items()},
+                    **({thumbnail_file: read_thumbnail} if thumbnail_file else {}),
+                },
+                thumbnail_file=thumbnail_file,
+                on_progress=on_progress,
+            )
+            for upload in uploads.values():
+                upload.complete()
+                encode_span.add_bytes(upload.bytes_uploaded)
+    except Exception:
+        for upload in uploads.values():
+            try:
+                upload.abort()
+            except Exception as e:
+                log.warning("failed to abort upload of %s: %s", upload.key, e)
+        raise
+    for r in renditions:
+        if r.target_file in uploads:
+            continue
+        target_key = f"{s3_path}/{os.path.basename(r.target_file)}"
+        log.info("uploading %s to %s/%s", r.target_file, s3_bucket, target_key)
+        with span("upload") as upload_span:
+            s3_client.upload_file(
+                r.target_file,
+                s3_bucket,
+                target_key,
+                ExtraArgs={"ContentType": r.video_mime_type},
+            )
+            upload_span.add_bytes(os.path.getsize(r.target_file))
+    return thumbnail.get("jpeg") or None
+
+
 def output_args_video_to_audio() -> Tuple[str, ...]:
     return ("-loglevel", "info", "-y")
 
@@ -328,6 +1328,8 @@ def video_encode_for_mobile(
     video_mime_type: str,
     target_height=480,
     maintain_original_aspect_ratio=False,
+    profile: Optional[EncodingProfile] = None,
+    on_progress: Optional[Callable[[FFmpegProgress], None]] = None,
 ) -> None:
     log.info("%s, %s, %s", src_file, tgt_file, target_height)
 
@@ -336,80 +1338,36 @@ def video_encode_for_mobile(
         video_mime_type,
         target_height=target_height,
         maintain_original_aspect_ratio=maintain_original_aspect_ratio,
+        profile=profile,
     )
 
-    ff = ffmpy.FFmpeg(
-        inputs={str(src_file): input_args},
-        outputs={str(tgt_file): output_args},
-        executable=FFMPEG_EXECUTABLE,
-    )
-    ff.run()
-    log.debug(ff)
-
-
-# ffmpeg can transcode from one file type to another simply by extension name
-# i.e. if input is video.webm and target file is video.mp4, it will transcode from webm --> mp4
-def ffmpeg_barebones_transcode(src_file: str, tgt_file: str):
-    log.info("starting webm to mp4 transcode")
-    ff = ffmpy.FFmpeg(
-        inputs={str(src_file): None},
-        outputs={str(tgt_file): None},
-        executable=FFMPEG_EXECUTABLE,
-    )
-    ff.run()
-    log.debug(ff)
-
-
-def ffmpeg_extract_frame(video_file, target_file_path):
-    log.info("starting ffmpeg extract frame")
-    ff = ffmpy.FFmpeg(
-        inputs={str(video_file): None},
-        outputs={
-            str(target_file_path): (
-                "-ss",
-                "00:00:01",
-                "-vframes",
-                "1",
-                "-q:v",
-                "2",
-            )
-        },
-        executable=FFMPEG_EXECUTABLE,
+    ffmpeg_run(
+        (),
+        {str(src_file): input_args},
+        {str(tgt_file): output_args},
+        on_progress=on_progress,
     )
-    ff.run()
-    log.debug(ff)
-
-
-def extract_frame_from_video(temp_path, video_file_path):
-    target_file = "frame.jpg"
-    target_file_path = os.path.join(temp_path, target_file)
-
-    log.info("extracting frame from %s", video_file_path)
-    ffmpeg_extract_frame(video_file_path, target_file_path)
-
-    return target_file_path
 
 
 aws_region = require_env("REGION")
 s3_client = boto3.client("s3", region_name=aws_region)
 
 
-def upload_thumbnail(
-    s3_target_upload_path, thumbnail_local_file_path, mentor_id, auth_headers
-):
-    with open(thumbnail_local_file_path, "rb") as f:
-        s3_client.upload_fileobj(
-            f,
-            s3_bucket,
-            s3_target_upload_path,
-            ExtraArgs={"ContentType": "image/png"},
-        )
-        mentor_thumbnail_update(
-            MentorThumbnailUpdateRequest(
-                mentor=mentor_id, thumbnail=s3_target_upload_path
-            ),
-            auth_headers,
-        )
+def put_thumbnail(s3_target_upload_path, thumbnail: bytes) -> None:
+    s3_client.put_object(
+        Body=thumbnail,
+        Bucket=s3_bucket,
+        Key=s3_target_upload_path,
+        ContentType="image/jpeg",
+    )
+
+
+def upload_thumbnail(s3_target_upload_path, thumbnail: bytes, mentor_id, auth_headers):
+    put_thumbnail(s3_target_upload_path, thumbnail)
+    mentor_thumbnail_update(
+        MentorThumbnailUpdateRequest(mentor=mentor_id, thumbnail=s3_target_upload_path),
+        auth_headers,
+    )
 
 
 def video_encode_for_web(
@@ -419,6 +1377,8 @@ def video_encode_for_web(
     max_height=720,
     target_aspect=1.77777777778,
     maintain_original_aspect_ratio=False,
+    profile: Optional[EncodingProfile] = None,
+    on_progress: Optional[Callable[[FFmpegProgress], None]] = None,
 ) -> None:
     log.info("%s, %s, %s, %s", src_file, tgt_file, max_height, target_aspect)
     os.makedirs(os.path.dirname(tgt_file), exist_ok=True)
@@ -429,19 +1389,22 @@ def video_encode_for_web(
         max_height=max_height,
         target_aspect=target_aspect,
         maintain_original_aspect_ratio=maintain_original_aspect_ratio,
+        profile=profile,
     )
 
-    ff = ffmpy.FFmpeg(
-        inputs={str(src_file): input_args},
-        outputs={str(tgt_file): output_args},
-        executable=FFMPEG_EXECUTABLE,
+    ffmpeg_run(
+        (),
+        {str(src_file): input_args},
+        {str(tgt_file): output_args},
+        on_progress=on_progress,
     )
-    ff.run()
-    log.debug(ff)
 
 
 def video_to_audio(
-    input_file: str, output_file: str = "", output_audio_encoding="mp3"
+    input_file: str,
+    output_file: str = "",
+    output_audio_encoding="mp3",
+    on_progress: Optional[Callable[[FFmpegProgress], None]] = None,
 ) -> str:
     """
     Converts the .mp4 file to an audio file (.mp3 by default).
@@ -458,36 +1421,367 @@ def video_to_audio(
     output_file = (
         output_file or f"{os.path.splitext(input_file)[0]}.{output_audio_encoding}"
     )
-    ff = ffmpy.FFmpeg(
-        inputs={str(input_file): None},
-        outputs={str(output_file): output_args_video_to_audio()},
-        executable=FFMPEG_EXECUTABLE,
+    ffmpeg_run(
+        (),
+        {str(input_file): None},
+        {str(output_file): output_args_video_to_audio()},
+        on_progress=on_progress,
     )
-    ff.run()
-    # log.debug(ff)
     return output_file
 
 
+def output_args_audio_for_transcribe() -> Tuple[str, ...]:
+    """speech recognition doesn't need more than mono 16kHz
+    (transcribe resamples anything else to 16kHz anyway)"""
+    return (
+        "-vn",
+        "-ac",
+        "1",
+        "-ar",
+        "16000",
+        "-c:a",
+        "libmp3lame",
+        "-b:a",
+        "32k",
+        "-f",
+        "mp3",
+    )
+
+
+# (container, audio codec) as reported by mediainfo -> transcribe MediaFormat
+TRANSCRIBE_MEDIA_FORMATS = {
+    ("MPEG-4", "AAC"): "mp4",
+    ("WebM", "Opus"): "webm",
+}
+
+
+def get_transcribe_media_format(probe: MediaProbe) -> Optional[str]:
+    """the MediaFormat to transcribe the file as is,
+    None if it has to be converted first (see video_to_audio_for_transcribe_s3)"""
+    return TRANSCRIBE_MEDIA_FORMATS.get((probe.container, probe.audio_codec))
+
+
+def video_to_audio_for_transcribe_s3(input_file: str, bucket: str, key: str) -> int:
+    """Extracts the audio as a small mp3 (see output_args_audio_for_transcribe)
+    and streams it from ffmpeg straight into s3, nothing is written to disk.
+    Returns the bytes uploaded"""
+    log.info("%s, s3://%s/%s", input_file, bucket, key)
+    output_file = f"{os.path.splitext(input_file)[0]}.mp3"
+    upload = S3StreamUpload(s3_client, bucket, key, "audio/mp3")
+    try:
+        with span("transcribe_audio") as audio_span:
+            ffmpeg_run(
+                ("-loglevel", "info", "-y"),
+                {str(input_file): None},
+                {output_file: output_args_audio_for_transcribe()},
+                streams={output_file: upload.upload_from},
+            )
+            upload.complete()
+            audio_span.add_bytes(upload.bytes_uploaded)
+    except Exception:
+        upload.abort()
+        raise
+    return upload.bytes_uploaded
+
+
+TRIM_MODES = ["auto", "copy", "smart", "reencode"]
+# cut points this close to a keyframe count as on the keyframe (under 1 frame at 30fps)
+KEYFRAME_TOLERANCE_SECS = 0.02
+# codec the re-encode produces for each container, only these can be stream copied
+TRIM_COPY_CODECS = {MP4.mime: "h264", WEBM_VP9.mime: "vp9"}
+
+
+def find_keyframes(video_file: str) -> List[float]:
+    """pts (secs) of the keyframes of the first video stream.
+    Read from the packet flags with ffprobe (no decoding),
+    falls back to decoding only the keyframes with ffmpeg"""
+    try:
+        stdout, _ = ffmpy.FFprobe(
+            executable=FFPROBE_EXECUTABLE,
+            global_options=(
+                "-v",
+                "error",
+                "-select_streams",
+                "v:0",
+                "-show_entries",
+                "packet=pts_time,flags",
+                "-of",
+                "csv=p=0",
+            ),
+            inputs={str(video_file): None},
+        ).run(stdout=subprocess.PIPE)
+        keyframes = []
+        for line in stdout.decode().splitlines():
+            pts_time, _, flags = line.partition(",")
+            if "K" in flags and pts_time not in ["", "N/A"]:
+                keyframes.append(float(pts_time))
+        return sorted(keyframes)
+    except Exception as e:
+        log.info("ffprobe keyframes failed (%s), using ffmpeg", e)
+    _, stderr = ffmpy.FFmpeg(
+        executable=FFMPEG_EXECUTABLE,
+        global_options=("-hide_banner", "-nostats"),
+        inputs={str(video_file): ("-skip_frame", "nokey")},
+        outputs={"-": ("-map", "0:v:0", "-vf", "showinfo", "-f", "null")},
+    ).run(stderr=subprocess.PIPE)
+    return sorted(
+        float(pts_time)
+        for pts_time in re.findall(r"pts_time:\s*([0-9.]+)", stderr.decode())
+    )
+
+
+def get_trim_mode(
+    src_file: str,
+    start_secs: float,
+    end_secs: float,
+    video_file_type: Supported_Video_Type,
+    keyframes: List[float],
+) -> str:
+    """copy if the cut starts on a keyframe, smart if the source can be
+    stream copied from the first keyframe after the start, reencode otherwise"""
+    if get_file_mime(src_file) != video_file_type.mime:
+        return "reencode"
+    if get_video_encoding_type(src_file) != TRIM_COPY_CODECS.get(video_file_type.mime):
+        return "reencode"
+    if not keyframes:
+        return "reencode"
+    if start_secs <= KEYFRAME_TOLERANCE_SECS or any(
+        abs(k - start_secs) <= KEYFRAME_TOLERANCE_SECS for k in keyframes
+    ):
+        return "copy"
+    next_keyframe = next(
+        (k for k in keyframes if k > start_secs + KEYFRAME_TOLERANCE_SECS), None
+    )
+    if next_keyframe is None or next_keyframe >= end_secs - KEYFRAME_TOLERANCE_SECS:
+        # the whole cut is within one gop, nothing to copy
+        return "reencode"
+    return "smart"
+
+
 def video_trim(
     input_file: str,
     output_file: str,
     start_secs: float,
     end_secs: float,
     desired_video_file_type: Supported_Video_Type,
+    profile: Optional[EncodingProfile] = None,
+    mode: str = "auto",
+    on_progress: Optional[Callable[[FFmpegProgress], None]] = None,
+) -> str:
+    """Trims input_file to [start_secs, end_secs] and returns the mode used:
+    copy: stream copy, the start has to be on a keyframe,
+    smart: re-encodes from the start to the next keyframe and stream copies the rest,
+    reencode: re-encodes everything.
+    auto picks the fastest mode that works for the source,
+    smart falls back to reencode if it fails"""
+    log.info("%s, %s, %s-%s %s", input_file, output_file, start_secs, end_secs, mode)
+    if mode not in TRIM_MODES:
+        raise Exception(f"Unsupported trim mode: {mode}")
+    keyframes = []
+    if mode in ["auto", "smart"]:
+        try:
+            keyframes = find_keyframes(input_file)
+        except Exception as e:
+            log.warning("failed to find keyframes (%s), re-encoding", e)
+    if mode == "auto":
+        mode = get_trim_mode(
+            input_file, start_secs, end_secs, desired_video_file_type, keyframes
+        )
+    log.info("trim mode %s", mode)
+    if mode == "copy":
+        with span("trim", Mode=mode):
+            video_trim_copy(input_file, output_file, start_secs, end_secs, on_progress)
+        return mode
+    if mode == "smart":
+        try:
+            with span("trim", Mode=mode):
+                video_trim_smart(
+                    input_file,
+                    output_file,
+                    start_secs,
+                    end_secs,
+                    desired_video_file_type,
+                    next(
+                        k for k in keyframes if k > start_secs + KEYFRAME_TOLERANCE_SECS
+                    ),
+                    profile,
+                    on_progress,
+                )
+            return mode
+        except Exception as e:
+            log.warning("smart trim failed (%s), re-encoding", e)
+            mode = "reencode"
+    with span("trim", Mode=mode):
+        video_trim_reencode(
+            input_file,
+            output_file,
+            start_secs,
+            end_secs,
+            desired_video_file_type,
+            profile,
+            on_progress,
+        )
+    return mode
+
+
+def video_trim_reencode(
+    input_file: str,
+    output_file: str,
+    start_secs: float,
+    end_secs: float,
+    desired_video_file_type: Supported_Video_Type,
+    profile: Optional[EncodingProfile] = None,
+    on_progress: Optional[Callable[[FFmpegProgress], None]] = None,
 ) -> None:
-    log.info("%s, %s, %s-%s", input_file, output_file, start_secs, end_secs)
-    # couldnt get to output to stdout like here
-    # https://aws.amazon.com/blogs/media/processing-user-generated-content-using-aws-lambda-and-ffmpeg/
+    # written to a file rather than streamed (see ffmpeg_run):
+    # the trimmed original is probed and transcoded again, it keeps a faststart index
     input_args, output_args = input_output_args_trim_video(
-        start_secs, end_secs, input_file, desired_video_file_type.mime
+        start_secs, end_secs, input_file, desired_video_file_type.mime, profile
     )
-    ff = ffmpy.FFmpeg(
-        inputs={str(input_file): input_args},
-        outputs={str(output_file): output_args},
-        executable=FFMPEG_EXECUTABLE,
+    ffmpeg_run(
+        (),
+        {str(input_file): input_args},
+        {str(output_file): output_args},
+        on_progress=on_progress,
     )
-    ff.run()
-    log.debug(ff)
+
+
+def video_trim_copy(
+    input_file: str,
+    output_file: str,
+    start_secs: float,
+    end_secs: float,
+    on_progress: Optional[Callable[[FFmpegProgress], None]] = None,
+) -> None:
+    """stream copy, input seeking snaps to the keyframe at or before start_secs"""
+    ffmpeg_run(
+        (),
+        {str(input_file): ("-ss", format_secs(start_secs))},
+        {
+            str(output_file): (
+                "-y",
+                "-t",
+                format_secs(end_secs - start_secs),
+                "-map",
+                "0:v:0",
+                "-map",
+                "0:a:0?",
+                "-c",
+                "copy",
+                "-avoid_negative_ts",
+                "make_zero",
+                "-movflags",
+                "+faststart",
+                "-loglevel",
+                "info",
+            )
+        },
+        on_progress=on_progress,
+    )
+
+
+def video_trim_smart(
+    input_file: str,
+    output_file: str,
+    start_secs: float,
+    end_secs: float,
+    video_file_type: Supported_Video_Type,
+    keyframe_secs: float,
+    profile: Optional[EncodingProfile] = None,
+    on_progress: Optional[Callable[[FFmpegProgress], None]] = None,
+) -> None:
+    """Re-encodes the video from start_secs up to keyframe_secs,
+    stream copies it from keyframe_secs to end_secs and joins both.
+    The audio is re-encoded for the whole cut (cheap) so it stays in sync"""
+    profile = profile or get_encoding_profile()
+    is_webm = video_file_type.mime == "video/webm"
+    probe = probe_media(input_file)
+    input_args = ("-c:v", "libvpx-vp9") if is_webm else ()
+    video_args = (
+        *(profile.vp9_args() if is_webm else profile.x264_args()),
+        "-pix_fmt",
+        probe.pix_fmt or ("yuva420p" if is_webm else "yuv420p"),
+    )
+    # the copied h264 part keeps the source sps/pps in-band,
+    # the container only has the ones of the re-encoded head
+    part_ext = "webm" if is_webm else "mp4"
+    copy_args = () if is_webm else ("-bsf:v", "h264_mp4toannexb")
+    with tempfile.TemporaryDirectory() as work_dir:
+        head_file = os.path.join(work_dir, f"head.{part_ext}")
+        tail_file = os.path.join(work_dir, f"tail.{part_ext}")
+        video_file = os.path.join(work_dir, f"video.{part_ext}")
+        concat_file = os.path.join(work_dir, "concat.txt")
+        ffmpeg_run(
+            (),
+            {str(input_file): (*input_args, "-ss", format_secs(start_secs))},
+            {
+                head_file: (
+                    "-y",
+                    # stop just before the keyframe, it is the first frame of the tail
+                    "-t",
+                    format_secs(keyframe_secs - start_secs - 0.001),
+                    "-map",
+                    "0:v:0",
+                    *video_args,
+                    "-loglevel",
+                    "info",
+                )
+            },
+            on_progress=on_progress,
+        )
+        ffmpeg_run(
+            (),
+            {str(input_file): ("-ss", format_secs(keyframe_secs))},
+            {
+                tail_file: (
+                    "-y",
+                    "-t",
+                    format_secs(end_secs - keyframe_secs),
+                    "-map",
+                    "0:v:0",
+                    "-c:v",
+                    "copy",
+                    *copy_args,
+                    "-loglevel",
+                    "info",
+                )
+            },
+            on_progress=on_progress,
+        )
+        with open(concat_file, "w") as f:
+            f.write(f"file '{head_file}'\nfile '{tail_file}'\n")
+        ffmpeg_run(
+            (),
+            {concat_file: ("-f", "concat", "-safe", "0")},
+            {video_file: ("-y", "-c", "copy", "-loglevel", "info")},
+            on_progress=on_progress,
+        )
+        ffmpeg_run(
+            (),
+            {
+                video_file: None,
+                str(input_file): ("-ss", format_secs(start_secs)),
+            },
+            {
+                str(output_file): (
+                    "-y",
+                    "-map",
+                    "0:v:0",
+                    "-map",
+                    "1:a:0?",
+                    "-t",
+                    format_secs(end_secs - start_secs),
+                    "-c:v",
+                    "copy",
+                    *profile.audio_args("libopus" if is_webm else "aac"),
+                    "-movflags",
+                    "+faststart",
+                    "-loglevel",
+                    "info",
+                )
+            },
+            on_progress=on_progress,
+        )
 
 
 def find(
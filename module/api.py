@@ -5,11 +5,15 @@
 #
 #
 from dataclasses import dataclass
+import inspect
+import hashlib
 import json
+import re
 from os import environ
-from typing import TypedDict, List, Dict
-import requests
-from module.logger import get_logger
+from typing import Any, Callable, Optional, Tuple, TypedDict, List, Dict
+from module import http_client
+from module.logger import Span, get_logger, span
+from module.ttl_cache import TTLCache
 import jsonschema
 
 
@@ -22,6 +26,12 @@ def get_graphql_endpoint() -> str:
 
 SECRET_HEADER_NAME = environ.get("SECRET_HEADER_NAME")
 SECRET_HEADER_VALUE = environ.get("SECRET_HEADER_VALUE")
+# mentorCanEdit per authorization and mentor, 0 disables caching
+CAN_EDIT_CACHE_TTL_SECS = float(environ.get("CAN_EDIT_CACHE_TTL_SECS", "60"))
+CAN_EDIT_CACHE_DENIED_TTL_SECS = float(
+    environ.get("CAN_EDIT_CACHE_DENIED_TTL_SECS", "5")
+)
+can_edit_cache = TTLCache(max_size=1024)
 
 
 class ExternalVideoIds:
@@ -292,70 +302,291 @@ class ImportTaskUpdateGQLRequest:
     s3_video_migration: ImportTaskCreateS3VideoMigration = None
 
 
-def fetch_question_name_gql(question_id: str) -> GQLQueryBody:
+@dataclass
+class GQLRead:
+    """A query field that batch_gql can merge with other reads into one
+    document. field uses $variables, variables maps their names to
+    (graphql type, value) and parse turns the field's data into the result.
+    An optional read that comes back null or with errors is None
+    instead of failing the batch"""
+
+    name: str
+    field: str
+    variables: Dict[str, Tuple[str, Any]]
+    parse: Callable[[Any], Any] = lambda data: data
+    optional: bool = False
+
+
+def gql_read_query(read: GQLRead) -> GQLQueryBody:
+    declarations = ", ".join(f"${n}: {t}" for n, (t, _) in read.variables.items())
     return {
-        "query": """query Question($id: ID!) {
-            question(id: $id){
-                name
-            }
-        }""",
-        "variables": {
-            "id": question_id,
-        },
+        "query": f"query {read.name}({declarations}) {{\n    {read.field}\n}}",
+        "variables": {n: v for n, (_, v) in read.variables.items()},
     }
 
 
-def fetch_task_gql(mentor_id: str, question_id) -> GQLQueryBody:
+def batch_gql_query(reads: List[GQLRead]) -> GQLQueryBody:
+    """one query with every read aliased as r<index>,
+    their variables are prefixed the same way so they can't collide"""
+    declarations = []
+    fields = []
+    variables = {}
+    for i, read in enumerate(reads):
+        field = read.field
+        for n, (t, v) in read.variables.items():
+            field = re.sub(rf"\${n}\b", f"$r{i}_{n}", field)
+            declarations.append(f"$r{i}_{n}: {t}")
+            variables[f"r{i}_{n}"] = v
+        fields.append(f"r{i}: {field}")
+    name = "_".join(read.name for read in reads)
     return {
-        "query": """query UploadTask($mentorId: ID!, $questionId: ID!) {
-            uploadTask(mentorId: $mentorId, questionId: $questionId){
-                transcodeWebTask {
-                    task_id
-                    status
-                }
-                transcodeMobileTask {
-                    task_id
-                    status
-                }
-                transcribeTask{
-                    task_id
-                    status
-                    payload
-                }
-                trimUploadTask{
-                    task_id
-                    status
-                }
+        "query": f"query {name}({', '.join(declarations)}) {{\n    "
+        + "\n    ".join(fields)
+        + "\n}",
+        "variables": variables,
+    }
+
+
+def batch_gql(reads: List[GQLRead], headers: Dict[str, str] = {}) -> List[Any]:
+    """Runs independent reads in one round trip,
+    returns their parsed results in the order of reads"""
+    tdjson = __auth_gql(batch_gql_query(reads), headers)
+    optional = {f"r{i}" for i, read in enumerate(reads) if read.optional}
+    errors = [
+        error
+        for error in tdjson.get("errors") or []
+        if (error.get("path") or [None])[0] not in optional
+    ]
+    if errors or ("errors" in tdjson and not tdjson.get("data")):
+        raise Exception(json.dumps(tdjson.get("errors")))
+    results = []
+    for i, read in enumerate(reads):
+        data = tdjson["data"].get(f"r{i}")
+        results.append(None if read.optional and data is None else read.parse(data))
+    return results
+
+
+def parse_question_name(question: Optional[Dict]) -> str:
+    if not question or "name" not in question:
+        raise Exception(f"question did not return proper data format: {question}")
+    return question["name"]
+
+
+def question_name_read(question_id: str, optional: bool = False) -> GQLRead:
+    return GQLRead(
+        "Question",
+        """question(id: $id){
+            name
+        }""",
+        {"id": ("ID!", question_id)},
+        parse_question_name,
+        optional,
+    )
+
+
+def upload_task_read(mentor_id: str, question_id: str) -> GQLRead:
+    return GQLRead(
+        "UploadTask",
+        """uploadTask(mentorId: $mentorId, questionId: $questionId){
+            transcodeWebTask {
+                task_id
+                status
+            }
+            transcodeMobileTask {
+                task_id
+                status
+            }
+            transcribeTask{
+                task_id
+                status
+                payload
+            }
+            trimUploadTask{
+                task_id
+                status
             }
         }""",
-        "variables": {
-            "mentorId": mentor_id,
-            "questionId": question_id,
-        },
-    }
+        {"mentorId": ("ID!", mentor_id), "questionId": ("ID!", question_id)},
+    )
 
 
-GQL_QUERY_USER_CAN_EDIT_MENTOR = """
-query MentorCanEdit($mentor: ID!){
-        mentorCanEdit(mentor: $mentor)
-} """
+def upload_in_progress_read(req: FetchUploadTaskReq) -> GQLRead:
+    return GQLRead(
+        "UploadTask",
+        """uploadTask(mentorId: $mentorId, questionId: $questionId){
+            transcript
+        }""",
+        {"mentorId": ("ID!", req.mentor), "questionId": ("ID!", req.question)},
+        bool,
+    )
+
+
+def user_can_edit_mentor_read(mentor: str) -> GQLRead:
+    return GQLRead(
+        "MentorCanEdit", "mentorCanEdit(mentor: $mentor)", {"mentor": ("ID!", mentor)}
+    )
+
+
+def fetch_question_name_gql(question_id: str) -> GQLQueryBody:
+    return gql_read_query(question_name_read(question_id))
+
+
+def fetch_task_gql(mentor_id: str, question_id) -> GQLQueryBody:
+    return gql_read_query(upload_task_read(mentor_id, question_id))
 
 
 def query_user_can_edit_mentor(mentor: str) -> GQLQueryBody:
-    return {"query": GQL_QUERY_USER_CAN_EDIT_MENTOR, "variables": {"mentor": mentor}}
+    return gql_read_query(user_can_edit_mentor_read(mentor))
+
+
+def can_edit_cache_key(mentor: str, headers: Dict[str, str]) -> str:
+    # the token itself is not kept in memory
+    authorization = headers.get("Authorization", "")
+    return hashlib.sha256(f"{authorization}\n{mentor}".encode()).hexdigest()
+
+
+def cached_user_can_edit_mentor(
+    mentor: str, headers: Dict[str, str] = {}
+) -> Optional[bool]:
+    """the cached mentorCanEdit, None if it has to be fetched"""
+    with span("auth_cache") as s:
+        found, allowed = can_edit_cache.get(can_edit_cache_key(mentor, headers))
+        s.add_metric("Hits", int(found))
+        s.add_metric("Misses", int(not found))
+    return allowed if found else None
+
+
+def cache_user_can_edit_mentor(
+    mentor: str, headers: Dict[str, str], allowed: bool
+) -> None:
+    # a denied mentor may just have been shared, don't keep that for long
+    can_edit_cache.put(
+        can_edit_cache_key(mentor, headers),
+        allowed,
+        CAN_EDIT_CACHE_TTL_SECS if allowed else CAN_EDIT_CACHE_DENIED_TTL_SECS,
+    )
+
+
+def invalidate_user_can_edit_mentor(
+    mentor: Optional[str] = None, headers: Dict[str, str] = {}
+) -> None:
+    """forgets mentor for these headers, or everything without a mentor"""
+    can_edit_cache.invalidate(
+        can_edit_cache_key(mentor, headers) if mentor is not None else None
+    )
 
 
 def user_can_edit_mentor(mentor: str, headers: Dict[str, str] = {}) -> bool:
+    allowed = cached_user_can_edit_mentor(mentor, headers)
+    if allowed is not None:
+        return allowed
     tdjson = __auth_gql(query_user_can_edit_mentor(mentor), headers=headers)
-    return tdjson.get("data")["mentorCanEdit"]
+    allowed = tdjson.get("data")["mentorCanEdit"]
+    cache_user_can_edit_mentor(mentor, headers, allowed)
+    return allowed
+
+
+def persisted_queries_enabled() -> bool:
+    return environ.get("GRAPHQL_PERSISTED_QUERIES", "").lower() in ("1", "true")
+
+
+# False once graphql said it doesn't support persisted queries
+persisted_queries_supported = True
+
+
+# query text -> sha256, filled with every query this module sends when it is
+# imported (see the end of the module), so warm and cold requests only look up
+persisted_query_hashes: Dict[str, str] = {}
+
 
+def persisted_query_hash(query: str) -> str:
+    query_hash = persisted_query_hashes.get(query)
+    if query_hash is None:
+        # a batch of reads that wasn't precomputed
+        query_hash = hashlib.sha256(query.encode()).hexdigest()
+        persisted_query_hashes[query] = query_hash
+    return query_hash
 
-def __auth_gql(query: GQLQueryBody, headers: Dict[str, str] = {}) -> dict:
+
+def persisted_query_extensions(query: GQLQueryBody) -> Dict:
+    return {
+        "persistedQuery": {
+            "version": 1,
+            "sha256Hash": persisted_query_hash(query["query"]),
+        }
+    }
+
+
+def persisted_query_error(tdjson: Dict) -> Optional[str]:
+    """PERSISTED_QUERY_NOT_FOUND / PERSISTED_QUERY_NOT_SUPPORTED, or None"""
+    for error in tdjson.get("errors") or []:
+        code = (error.get("extensions") or {}).get("code")
+        if code in ("PERSISTED_QUERY_NOT_FOUND", "PERSISTED_QUERY_NOT_SUPPORTED"):
+            return code
+        if error.get("message") == "PersistedQueryNotFound":
+            return "PERSISTED_QUERY_NOT_FOUND"
+        if error.get("message") == "PersistedQueryNotSupported":
+            return "PERSISTED_QUERY_NOT_SUPPORTED"
+    return None
+
+
+def __post_gql(
+    body: Dict,
+    headers: Dict[str, str],
+    idempotent: bool,
+    s: Span,
+    read_timeout_secs: Optional[float],
+):
+    res = http_client.post(
+        get_graphql_endpoint(),
+        json=body,
+        headers=headers,
+        idempotent=idempotent,
+        span=s,
+        read_timeout_secs=read_timeout_secs,
+    )
+    s.add_bytes(len(res.content))
+    return res
+
+
+def __auth_gql(
+    query: GQLQueryBody,
+    headers: Dict[str, str] = {},
+    read_timeout_secs: Optional[float] = None,
+) -> dict:
+    global persisted_queries_supported
     final_headers = {**headers, f"{SECRET_HEADER_NAME}": f"{SECRET_HEADER_VALUE}"}
-    # SSL is not valid for alb so have to turn off validation
-    res = requests.post(get_graphql_endpoint(), json=query, headers=final_headers)
-    res.raise_for_status()
-    return res.json()
+    operation = re.search(r"(?:query|mutation)\s+(\w+)", query["query"])
+    idempotent = query["query"].lstrip().startswith("query")
+    with span("graphql", Operation=operation.group(1) if operation else "unnamed") as s:
+        if persisted_queries_enabled() and persisted_queries_supported:
+            # automatic persisted queries (apollo): just the hash,
+            # the full text only when graphql doesn't know it yet
+            extensions = persisted_query_extensions(query)
+            res = __post_gql(
+                {"variables": query["variables"], "extensions": extensions},
+                final_headers,
+                idempotent,
+                s,
+                read_timeout_secs,
+            )
+            try:
+                error = persisted_query_error(res.json())
+            except ValueError:
+                error = None
+            if not error:
+                s.add_metric("PersistedQueryHits", 1)
+                res.raise_for_status()
+                return res.json()
+            s.add_metric("PersistedQueryMisses", 1)
+            if error == "PERSISTED_QUERY_NOT_SUPPORTED":
+                log.warning("graphql does not support persisted queries")
+                persisted_queries_supported = False
+            else:
+                query = {**query, "extensions": extensions}
+        res = __post_gql(query, final_headers, idempotent, s, read_timeout_secs)
+        res.raise_for_status()
+        return res.json()
 
 
 def fetch_task(mentor_id: str, question_id, headers: Dict[str, str] = {}) -> dict:
@@ -486,14 +717,7 @@ def upload_task_status_update(
 
 
 def fetch_upload_task_gql(req: FetchUploadTaskReq) -> GQLQueryBody:
-    return {
-        "query": """query UploadTask($mentorId: ID!, $questionId: ID!) {
-            uploadTask(mentorId: $mentorId, questionId: $questionId){
-                transcript
-            }
-            }""",
-        "variables": {"mentorId": req.mentor, "questionId": req.question},
-    }
+    return gql_read_query(upload_in_progress_read(req))
 
 
 def is_upload_in_progress(
@@ -892,7 +1116,7 @@ def update_answers_gql(
     req: UpdateAnswersGQLRequest, headers: Dict[str, str] = {}
 ) -> None:
     body = update_answers_gql_query(req)
-    tdjson = __auth_gql(body, headers)
+    tdjson = __auth_gql(body, headers, http_client.BULK_READ_TIMEOUT_SECS)
 
     if "errors" in tdjson:
         raise Exception(json.dumps(tdjson.get("errors")))
@@ -926,9 +1150,12 @@ def validate_json(json_data, json_schema):
 
 
 def exec_graphql_with_json_validation(
-    request_query, json_schema, headers: Dict[str, str]
+    request_query,
+    json_schema,
+    headers: Dict[str, str],
+    read_timeout_secs: Optional[float] = None,
 ):
-    tdjson = __auth_gql(request_query, headers)
+    tdjson = __auth_gql(request_query, headers, read_timeout_secs)
     if "errors" in tdjson:
         raise Exception(json.dumps(tdjson.get("errors")))
     validate_json(tdjson, json_schema)
@@ -972,7 +1199,10 @@ def import_mentor_gql(
 ) -> MentorImportGQLResponse:
     query = import_mentor_gql_query(req)
     res = exec_graphql_with_json_validation(
-        query, import_mentor_gql_response_schema, headers=headers
+        query,
+        import_mentor_gql_response_schema,
+        headers=headers,
+        read_timeout_secs=http_client.BULK_READ_TIMEOUT_SECS,
     )
     res_data = res["data"]["api"]["mentorImport"]
     import_response_data = {
@@ -1178,3 +1408,34 @@ def does_mentor_have_thumbnail(mentor: str, auth_headers: Dict[str, str] = {}):
     tdjson = __auth_gql(gql_query, auth_headers)
     mentor_data = tdjson["data"]["mentor"]
     return mentor_data["thumbnail"] is not None and mentor_data["thumbnail"] != ""
+
+
+def known_queries() -> List[str]:
+    """the text of every query and mutation sent by this module: the literals of
+    the *_gql/*_req/*_query builders (only their variables depend on the request),
+    the single reads and the batches the handlers send"""
+    queries = []
+    for fn in list(globals().values()):
+        if not inspect.isfunction(fn) or fn.__module__ != __name__:
+            continue
+        queries.extend(
+            const
+            for const in fn.__code__.co_consts
+            if isinstance(const, str) and re.match(r"(query|mutation)\s", const)
+        )
+    reads = [
+        question_name_read(""),
+        upload_task_read("", ""),
+        upload_in_progress_read(FetchUploadTaskReq("", "")),
+        user_can_edit_mentor_read(""),
+    ]
+    queries.extend(gql_read_query(read)["query"] for read in reads)
+    # answer-upload and step-transcribe-start
+    queries.append(batch_gql_query([reads[3], reads[2]])["query"])
+    queries.append(batch_gql_query([reads[1], reads[0]])["query"])
+    return queries
+
+
+persisted_query_hashes.update(
+    (query, hashlib.sha256(query.encode()).hexdigest()) for query in known_queries()
+)
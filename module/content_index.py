@@ -0,0 +1,140 @@
+# This software is Copyright ©️ 2020 The University of Southern California. All Rights Reserved.
+# Permission to use, copy, modify, and distribute this software and its documentation for educational, research and non-profit purposes, without fee, and without a written agreement is hereby granted, provided that the above copyright notice and subject to the full license file found in the root of this software deliverable. Permission to make commercial use of this software may be obtained by contacting:  USC Stevens Center for Innovation University of Southern California 1150 S. Olive Street, Suite 2300, Los Angeles, CA 90115, USA Email: accounting@stevens.usc.edu
+#
+# The full terms of this copyright and license should always be found in the root directory of this software deliverable as "license.txt" and if these terms are not found with this software, please contact the USC Stevens Center for the full license.
+#
+#
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, Union
+
+import boto3
+
+from module.encoding_profiles import get_stage_encoding_profile
+from module.logger import get_logger
+from module.s3_utils import get_unchanged_objects
+
+log = get_logger("content-index")
+# entries point at artifacts that can be overwritten any time, they are
+# checked before use (see find_current_entry), the ttl only keeps the table small
+CONTENT_INDEX_TTL_SEC = int(
+    os.environ.get("CONTENT_INDEX_TTL_SEC", (60 * 60 * 24) * 180)
+)  # 180 days
+
+
+def content_index_key(video_hash: str, options: Dict) -> str:
+    """the SHA-1 of the upload (see get_video_metadata) and a digest
+    of every processing option that changes the outputs"""
+    options_digest = hashlib.sha1(
+        json.dumps(options, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    return f"{video_hash}-{options_digest}"
+
+
+def content_index_options(request: Dict) -> Optional[Dict]:
+    """The options of a step function request that change its outputs,
+    None if the outputs are not all reusable: an edited transcript
+    (no transcribe task) and the thumbnail are not part of an entry"""
+    if request.get("generate_thumbnail") or not request.get("transcribeTask"):
+        return None
+    return {
+        "maintain_original_aspect_ratio": request["maintain_original_aspect_ratio"],
+        "trim": request.get("trim"),
+        "isVbgVideo": request.get("isVbgVideo", False),
+        # resolved names: entries made under another default profile never match
+        "encodingProfile": {
+            stage: get_stage_encoding_profile(request, stage).name
+            for stage in ["trim", "web", "mobile"]
+        },
+    }
+
+
+class DynamoContentIndex:
+    def __init__(self, table_name: str, region: str):
+        dynamodb = boto3.resource("dynamodb", region_name=region)
+        self.table = dynamodb.Table(table_name)
+
+    def get(self, key: str) -> Optional[Dict]:
+        item = self.table.get_item(Key={"id": key}).get("Item")
+        # stored as a json string, dynamo would turn floats into Decimals
+        return json.loads(item["entry"]) if item else None
+
+    def put(self, key: str, entry: Dict) -> None:
+        self.table.put_item(
+            Item={
+                "id": key,
+                "entry": json.dumps(entry),
+                "ttl": int(time.time()) + CONTENT_INDEX_TTL_SEC,
+            }
+        )
+
+
+class LocalContentIndex:
+    """Stand-in for the dynamo table: a json file, for running offline and tests"""
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Dict]:
+        if not os.path.exists(self.file_path):
+            return {}
+        with open(self.file_path) as f:
+            return json.load(f)
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self.lock:
+            return self._load().get(key)
+
+    def put(self, key: str, entry: Dict) -> None:
+        with self.lock:
+            entries = self._load()
+            entries[key] = entry
+            with open(self.file_path, "w") as f:
+                json.dump(entries, f)
+
+
+ContentIndex = Union[DynamoContentIndex, LocalContentIndex]
+
+
+def get_content_index() -> Optional[ContentIndex]:
+    """CONTENT_INDEX_TABLE_NAME for dynamo, CONTENT_INDEX_FILE for the local
+    stand-in, neither turns deduplication off"""
+    table_name = os.environ.get("CONTENT_INDEX_TABLE_NAME")
+    if table_name:
+        return DynamoContentIndex(table_name, os.environ.get("REGION"))
+    file_path = os.environ.get("CONTENT_INDEX_FILE")
+    if file_path:
+        return LocalContentIndex(file_path)
+    return None
+
+
+def get_artifacts(s3_client, bucket: str, s3_path: str) -> Dict[str, str]:
+    """key -> etag of everything stored for an answer"""
+    artifacts = {}
+    kwargs = {"Bucket": bucket, "Prefix": f"{s3_path}/"}
+    while True:
+        response = s3_client.list_objects_v2(**kwargs)
+        artifacts.update({o["Key"]: o["ETag"] for o in response.get("Contents", [])})
+        if not response.get("IsTruncated"):
+            return artifacts
+        kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+
+def find_current_entry(
+    s3_client, bucket: str, index: ContentIndex, key: str
+) -> Optional[Dict]:
+    """The entry for key if all of its artifacts are still the ones
+    it was recorded with (answers get re-uploaded and deleted).
+    Adds their content type and size as entry["objects"]"""
+    entry = index.get(key)
+    if not entry:
+        return None
+    objects = get_unchanged_objects(s3_client, bucket, entry["artifacts"])
+    if objects is None:
+        log.info("artifacts of %s changed, not reusing it", key)
+        return None
+    return {**entry, "objects": objects}
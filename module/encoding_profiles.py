@@ -0,0 +1,152 @@
+# This software is Copyright ©️ 2020 The University of Southern California. All Rights Reserved.
+# Permission to use, copy, modify, and distribute this software and its documentation for educational, research and non-profit purposes, without fee, and without a written agreement is hereby granted, provided that the above copyright notice and subject to the full license file found in the root of this software deliverable. Permission to make commercial use of this software may be obtained by contacting:  USC Stevens Center for Innovation University of Southern California 1150 S. Olive Street, Suite 2300, Los Angeles, CA 90115, USA Email: accounting@stevens.usc.edu
+#
+# The full terms of this copyright and license should always be found in the root directory of this software deliverable as "license.txt" and if these terms are not found with this software, please contact the USC Stevens Center for the full license.
+#
+#
+import os
+from dataclasses import dataclass, replace
+from typing import Dict, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class EncodingProfile:
+    """Speed/quality settings for the x264 (mp4) and libvpx-vp9 (webm) encoders.
+    None (and False for the vp9 flags) leaves the encoder default in place"""
+
+    name: str
+    x264_crf: int
+    x264_preset: Optional[str]
+    vp9_crf: int
+    vp9_deadline: Optional[str]
+    vp9_cpu_used: Optional[int]
+    vp9_tile_columns: Optional[int]
+    audio_bitrate: str
+    # 0 is one thread per cpu
+    threads: Optional[int] = 0
+    # -b:v 0 makes -crf constant quality, without it libvpx runs
+    # constrained quality (crf capped by its default target bitrate)
+    vp9_constant_quality: bool = True
+    vp9_row_mt: bool = True
+    # crf of the mp4 fallback next to webm renditions, None is x264_crf
+    mp4_fallback_x264_crf: Optional[int] = None
+
+    def audio_args(self, codec: str) -> Tuple[str, ...]:
+        bitrate = self.audio_bitrate
+        # opus allows up to 256k per channel, more fails for mono sources
+        if codec == "libopus" and int(bitrate.rstrip("k")) > 256:
+            bitrate = "256k"
+        return ("-c:a", codec, "-b:a", bitrate)
+
+    def mp4_fallback(self) -> "EncodingProfile":
+        """the profile of the mp4 that webm (vbg) renditions get for browsers
+        without webm support"""
+        if self.mp4_fallback_x264_crf is None:
+            return self
+        return replace(self, x264_crf=self.mp4_fallback_x264_crf)
+
+    def thread_count(self) -> int:
+        return self.threads or os.cpu_count() or 1
+
+    def thread_args(self) -> Tuple[str, ...]:
+        return () if self.threads is None else ("-threads", str(self.thread_count()))
+
+    def x264_args(self) -> Tuple[str, ...]:
+        return (
+            "-c:v",
+            "libx264",
+            "-crf",
+            str(self.x264_crf),
+            *(("-preset", self.x264_preset) if self.x264_preset else ()),
+            *self.thread_args(),
+        )
+
+    def vp9_args(self) -> Tuple[str, ...]:
+        # libvpx only uses more than one thread with row-mt and/or tiles
+        return (
+            "-c:v",
+            "libvpx-vp9",
+            "-crf",
+            str(self.vp9_crf),
+            *(("-b:v", "0") if self.vp9_constant_quality else ()),
+            *(("-deadline", self.vp9_deadline) if self.vp9_deadline else ()),
+            *(
+                ("-cpu-used", str(self.vp9_cpu_used))
+                if self.vp9_cpu_used is not None
+                else ()
+            ),
+            *(("-row-mt", "1") if self.vp9_row_mt else ()),
+            *(
+                ("-tile-columns", str(self.vp9_tile_columns))
+                if self.vp9_tile_columns is not None
+                else ()
+            ),
+            *self.thread_args(),
+        )
+
+
+# the original settings, exactly: crf 10 with every other encoder
+# setting (speed, threads, vp9 rate control and tiles) left at its default,
+# the mp4 fallback of webm renditions was always encoded at the x264 default crf 23
+ARCHIVAL = EncodingProfile(
+    name="archival",
+    x264_crf=10,
+    x264_preset=None,
+    vp9_crf=10,
+    vp9_deadline=None,
+    vp9_cpu_used=None,
+    vp9_tile_columns=None,
+    audio_bitrate="320k",
+    threads=None,
+    vp9_constant_quality=False,
+    vp9_row_mt=False,
+    mp4_fallback_x264_crf=23,
+)
+BALANCED = EncodingProfile(
+    name="balanced",
+    x264_crf=18,
+    x264_preset="medium",
+    vp9_crf=24,
+    vp9_deadline="good",
+    vp9_cpu_used=2,
+    vp9_tile_columns=2,
+    audio_bitrate="192k",
+)
+FAST = EncodingProfile(
+    name="fast",
+    x264_crf=23,
+    x264_preset="veryfast",
+    vp9_crf=32,
+    vp9_deadline="realtime",
+    vp9_cpu_used=8,
+    vp9_tile_columns=2,
+    audio_bitrate="128k",
+)
+encoding_profiles: Dict[str, EncodingProfile] = {
+    p.name: p for p in [ARCHIVAL, BALANCED, FAST]
+}
+DEFAULT_ENCODING_PROFILE = os.environ.get("ENCODING_PROFILE", ARCHIVAL.name)
+
+
+def get_encoding_profile(name: Optional[str] = None) -> EncodingProfile:
+    name = name or DEFAULT_ENCODING_PROFILE
+    if name not in encoding_profiles:
+        raise Exception(f"Unknown encoding profile: {name}")
+    return encoding_profiles[name]
+
+
+def get_stage_encoding_profile(request: Dict, stage: str) -> EncodingProfile:
+    """request["encodingProfile"] is either a profile name used for every stage
+    or a dict of stage ("trim", "web", "mobile") -> profile name,
+    stages that are not listed get the default profile"""
+    selected = request.get("encodingProfile")
+    if isinstance(selected, dict):
+        selected = selected.get(stage)
+    return get_encoding_profile(selected)
+
+
+def is_valid_encoding_profile_selection(selected) -> bool:
+    if selected is None:
+        return True
+    names = selected.values() if isinstance(selected, dict) else [selected]
+    return all(name in encoding_profiles for name in names)
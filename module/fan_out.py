@@ -0,0 +1,83 @@
+#
+# This software is Copyright ©️ 2020 The University of Southern California. All Rights Reserved.
+# Permission to use, copy, modify, and distribute this software and its documentation for educational, research and non-profit purposes, without fee, and without a written agreement is hereby granted, provided that the above copyright notice and subject to the full license file found in the root of this software deliverable. Permission to make commercial use of this software may be obtained by contacting:  USC Stevens Center for Innovation University of Southern California 1150 S. Olive Street, Suite 2300, Los Angeles, CA 90115, USA Email: accounting@stevens.usc.edu
+#
+# The full terms of this copyright and license should always be found in the root directory of this software deliverable as "license.txt" and if these terms are not found with this software, please contact the USC Stevens Center for the full license.
+#
+#
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from os import environ
+from typing import Any, Callable, Generic, Iterable, List, TypeVar
+
+from module.logger import get_logger
+
+log = get_logger("fan-out")
+FAN_OUT_CONCURRENCY = int(environ.get("FAN_OUT_CONCURRENCY", "32"))
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+@dataclass
+class FanOutResult(Generic[R]):
+    """results of the calls that succeeded (in order), errors of the others"""
+
+    results: List[R] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+
+
+class FanOutExecutor:
+    """Runs blocking calls (the pooled graphql session of module/http_client.py,
+    boto3, urllib) on a thread pool of `concurrency` workers and lets asyncio
+    await them. It is not non-blocking i/o: every call in flight holds a thread,
+    `concurrency` is the limit on what's in flight:
+
+        with FanOutExecutor() as executor:
+            result = asyncio.run(executor.fan_out(upload, files, str))
+
+    boto3 clients keep max_pool_connections (10) connections per host,
+    create them with botocore Config(max_pool_connections=concurrency)"""
+
+    def __init__(self, concurrency: int = FAN_OUT_CONCURRENCY):
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="fan-out"
+        )
+
+    def __enter__(self) -> "FanOutExecutor":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+
+    async def run(self, fn: Callable[..., R], *args, **kwargs) -> R:
+        """awaits fn(*args, **kwargs), e.g. an api.*_gql call or an s3 client method"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(fn, *args, **kwargs))
+
+    async def fan_out(
+        self,
+        fn: Callable[[T], R],
+        items: Iterable[T],
+        describe: Callable[[T], Any] = str,
+    ) -> FanOutResult[R]:
+        """runs fn on every item, a failed item is an error
+        (f"{describe(item)}: {exception}") and doesn't stop the others"""
+        items = list(items)
+        outcomes = await asyncio.gather(
+            *(self.run(fn, item) for item in items), return_exceptions=True
+        )
+        result: FanOutResult[R] = FanOutResult()
+        for item, outcome in zip(items, outcomes):
+            if isinstance(outcome, BaseException):
+                log.error("%s failed: %s", describe(item), outcome)
+                result.errors.append(f"{describe(item)}: {outcome}")
+            else:
+                result.results.append(outcome)
+        return result
@@ -0,0 +1,133 @@
+#
+# This software is Copyright ©️ 2020 The University of Southern California. All Rights Reserved.
+# Permission to use, copy, modify, and distribute this software and its documentation for educational, research and non-profit purposes, without fee, and without a written agreement is hereby granted, provided that the above copyright notice and subject to the full license file found in the root of this software deliverable. Permission to make commercial use of this software may be obtained by contacting:  USC Stevens Center for Innovation University of Southern California 1150 S. Olive Street, Suite 2300, Los Angeles, CA 90115, USA Email: accounting@stevens.usc.edu
+#
+# The full terms of this copyright and license should always be found in the root directory of this software deliverable as "license.txt" and if these terms are not found with this software, please contact the USC Stevens Center for the full license.
+#
+#
+import random
+import threading
+import time
+from os import environ
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from module.logger import Span, get_logger
+
+
+log = get_logger("http-client")
+CONNECT_TIMEOUT_SECS = float(environ.get("HTTP_CONNECT_TIMEOUT_SECS", "5"))
+READ_TIMEOUT_SECS = float(environ.get("HTTP_READ_TIMEOUT_SECS", "60"))
+# for the big mutations (mentor import, update answers) that ran without a timeout
+BULK_READ_TIMEOUT_SECS = float(environ.get("HTTP_BULK_READ_TIMEOUT_SECS", "600"))
+RETRIES = int(environ.get("HTTP_RETRIES", "3"))
+RETRY_BACKOFF_SECS = 0.5
+RETRY_STATUS = {502, 503, 504}
+# connections kept per host, enough for the threads of module/fan_out.py
+POOL_MAXSIZE = int(environ.get("HTTP_POOL_MAXSIZE", "32"))
+
+
+class _ConnectionCounter(threading.local):
+    new = 0
+
+
+_thread_connections = _ConnectionCounter()
+_stats_lock = threading.Lock()
+connection_stats = {"new": 0, "reused": 0}
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _thread_connections.new += 1
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _thread_connections.new += 1
+        return super()._new_conn()
+
+
+class _CountingAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+
+def create_session() -> requests.Session:
+    s = requests.Session()
+    adapter = _CountingAdapter(pool_maxsize=POOL_MAXSIZE)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+
+# module level so warm lambda invocations keep their connections,
+# sessions are safe to share between threads for plain posts
+session = create_session()
+
+
+def _was_sent(e: requests.exceptions.RequestException) -> bool:
+    """False if the connection could not be made (timed out, refused, dns failed),
+    so the server never saw the request"""
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+    return not isinstance(reason, (ConnectTimeoutError, NewConnectionError))
+
+
+def _backoff(attempt: int) -> float:
+    # full jitter, so the transfer threads don't retry in lockstep
+    return random.uniform(0, RETRY_BACKOFF_SECS * 2**attempt)
+
+
+def post(
+    url: str,
+    json: Dict,
+    headers: Dict[str, str],
+    idempotent: bool,
+    span: Optional[Span] = None,
+    read_timeout_secs: Optional[float] = None,
+) -> requests.Response:
+    """Posts with the pooled session and connect/read timeouts
+    (read_timeout_secs, READ_TIMEOUT_SECS by default).
+    Failed connections are always retried, idempotent requests also
+    on read errors, timeouts and 502/503/504.
+    NewConnections and Retries are added to span"""
+    attempt = 0
+    while True:
+        before = _thread_connections.new
+        res = None
+        try:
+            res = session.post(
+                url,
+                json=json,
+                headers=headers,
+                timeout=(CONNECT_TIMEOUT_SECS, read_timeout_secs or READ_TIMEOUT_SECS),
+            )
+            retry = idempotent and res.status_code in RETRY_STATUS
+            error = f"status {res.status_code}"
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            retry = idempotent or not _was_sent(e)
+            error = str(e)
+            if not retry or attempt >= RETRIES:
+                raise
+        finally:
+            with _stats_lock:
+                new = _thread_connections.new - before
+                connection_stats["new"] += new
+                connection_stats["reused"] += 1 if res is not None and not new else 0
+            if span:
+                span.add_metric("NewConnections", new)
+        if not retry or attempt >= RETRIES:
+            return res
+        delay = _backoff(attempt)
+        log.warning("%s failed (%s), retrying in %.1fs", url, error, delay)
+        time.sleep(delay)
+        attempt += 1
+        if span:
+            span.add_metric("Retries", 1)
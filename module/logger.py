@@ -3,10 +3,14 @@
 #
 # The full terms of this copyright and license should always be found in the root directory of this software deliverable as "license.txt" and if these terms are not found with this software, please contact the USC Stevens Center for the full license.
 import logging
+from contextlib import contextmanager
+from functools import wraps
 from logging.config import dictConfig
 import os
 import json
 import copy
+import time
+from typing import Dict, Iterator, Optional, Union
 
 
 class JSONFormatter(logging.Formatter):
@@ -30,6 +34,9 @@ class JSONFormatter(logging.Formatter):
         del payload["levelname"]
         payload["logger"] = payload["name"]
         del payload["name"]
+        if not isinstance(record.msg, dict):
+            payload["message"] = record.getMessage()
+            return payload
         # need a copy of the record to avoid mutating the original:
         msg = copy.deepcopy(record.msg)
         if "isBase64Encoded" in msg and msg["isBase64Encoded"]:
@@ -47,6 +54,11 @@ class JSONFormatter(logging.Formatter):
 
     def format(self, record):
         payload = self.to_payload(record)
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        # cloudwatch extracts the metrics of embedded metric format
+        # documents, they have to be top level keys of the log line
+        payload.update(getattr(record, "emf", {}))
         return json.dumps(payload, default=str)
 
 
@@ -79,3 +91,110 @@ dictConfig(
 
 def get_logger(name="root"):
     return logging.getLogger(name)
+
+
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "mentor-upload-processor")
+metrics_log = get_logger("metrics")
+# dimensions of every span until the next handler invocation, see metrics_handler
+metric_dimensions: Dict[str, str] = {}
+
+
+def set_metric_dimensions(**dimensions: str) -> None:
+    """adds dimensions (e.g. video_metric_dimensions) to the following spans"""
+    metric_dimensions.update(dimensions)
+
+
+def video_metric_dimensions(duration_secs: float, width: int, height: int):
+    """duration is bucketed, every distinct dimension value is a separate metric"""
+    if duration_secs < 60:
+        duration = "<1m"
+    elif duration_secs < 300:
+        duration = "1-5m"
+    elif duration_secs < 900:
+        duration = "5-15m"
+    else:
+        duration = ">15m"
+    return {"VideoDuration": duration, "Resolution": f"{width}x{height}"}
+
+
+class Span:
+    """One timed stage, see span()"""
+
+    def __init__(self, stage: str, dimensions: Dict[str, str]):
+        self.stage = stage
+        self.dimensions = dimensions
+        self.metrics: Dict[str, Union[int, float]] = {}
+        self.units: Dict[str, str] = {}
+
+    def add_metric(self, name: str, value: Union[int, float], unit="Count") -> None:
+        self.metrics[name] = self.metrics.get(name, 0) + value
+        self.units[name] = unit
+
+    def add_bytes(self, value: int) -> None:
+        self.add_metric("Bytes", value, "Bytes")
+
+    def to_emf(self) -> Dict:
+        dimensions = {**metric_dimensions, **self.dimensions, "Stage": self.stage}
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": METRICS_NAMESPACE,
+                        # per stage and per stage for every combination
+                        # of handler, video and outcome
+                        "Dimensions": [["Stage"], sorted(dimensions)],
+                        "Metrics": [
+                            {"Name": name, "Unit": self.units[name]}
+                            for name in self.metrics
+                        ],
+                    }
+                ],
+            },
+            **dimensions,
+            **self.metrics,
+        }
+
+
+@contextmanager
+def span(stage: str, **dimensions: str) -> Iterator[Span]:
+    """Times the block and logs its Duration (and whatever the block adds
+    with add_metric/add_bytes) as an embedded metric format document:
+
+        with span("download") as s:
+            s.add_bytes(download(...))
+
+    Failed blocks get an Outcome=error dimension"""
+    s = Span(stage, {**dimensions, "Outcome": "ok"})
+    start = time.perf_counter()
+    try:
+        yield s
+    except BaseException:
+        s.dimensions["Outcome"] = "error"
+        raise
+    finally:
+        s.add_metric("Duration", (time.perf_counter() - start) * 1000, "Milliseconds")
+        metrics_log.info(
+            "%s took %.0fms %s",
+            stage,
+            s.metrics["Duration"],
+            " ".join(f"{k}={v}" for k, v in s.metrics.items() if k != "Duration"),
+            extra={"emf": s.to_emf()},
+        )
+
+
+def metrics_handler(name: Optional[str] = None):
+    """Decorates a lambda handler: spans get a Handler dimension
+    and the whole invocation is a "handler" span"""
+
+    def decorate(handler):
+        @wraps(handler)
+        def wrapper(event, context):
+            metric_dimensions.clear()
+            metric_dimensions["Handler"] = name or handler.__module__
+            with span("handler"):
+                return handler(event, context)
+
+        return wrapper
+
+    return decorate
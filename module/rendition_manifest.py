@@ -0,0 +1,71 @@
+# This software is Copyright ©️ 2020 The University of Southern California. All Rights Reserved.
+# Permission to use, copy, modify, and distribute this software and its documentation for educational, research and non-profit purposes, without fee, and without a written agreement is hereby granted, provided that the above copyright notice and subject to the full license file found in the root of this software deliverable. Permission to make commercial use of this software may be obtained by contacting:  USC Stevens Center for Innovation University of Southern California 1150 S. Olive Street, Suite 2300, Los Angeles, CA 90115, USA Email: accounting@stevens.usc.edu
+#
+# The full terms of this copyright and license should always be found in the root directory of this software deliverable as "license.txt" and if these terms are not found with this software, please contact the USC Stevens Center for the full license.
+#
+#
+import hashlib
+import json
+from typing import Dict, Optional
+
+from botocore.exceptions import ClientError
+
+from module.logger import get_logger
+from module.s3_utils import get_unchanged_objects
+
+log = get_logger("rendition-manifest")
+RENDITION_MANIFEST_PREFIX = "rendition-manifests"
+
+
+def rendition_manifest_key(
+    s3_client, bucket: str, video_key: str, encode_options: Dict
+) -> str:
+    """Identifies one encode: the source object version (etag, a trim or a
+    re-upload changes it) and everything that changes the encoder arguments"""
+    source_etag = s3_client.head_object(Bucket=bucket, Key=video_key)["ETag"].strip('"')
+    options_digest = hashlib.sha1(
+        json.dumps(encode_options, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    return (
+        f"{RENDITION_MANIFEST_PREFIX}/{video_key}/{source_etag}-{options_digest}.json"
+    )
+
+
+def load_rendition_manifest(
+    s3_client, manifest_bucket: str, manifest_key: str, media_bucket: str
+) -> Optional[Dict]:
+    """The manifest of an encode that already completed,
+    None if there is none or its renditions were overwritten since"""
+    try:
+        body = s3_client.get_object(Bucket=manifest_bucket, Key=manifest_key)["Body"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ["NoSuchKey", "404"]:
+            return None
+        raise e
+    manifest = json.loads(body.read())
+    if get_unchanged_objects(s3_client, media_bucket, manifest["renditions"]) is None:
+        log.info("renditions of %s changed, encoding again", manifest_key)
+        return None
+    return manifest
+
+
+def save_rendition_manifest(
+    s3_client,
+    manifest_bucket: str,
+    manifest_key: str,
+    media_bucket: str,
+    rendition_keys,
+    **fields,
+) -> None:
+    """Records the uploaded renditions (with their etags) and any other fields
+    needed to finish the stage without encoding again"""
+    renditions = {
+        key: s3_client.head_object(Bucket=media_bucket, Key=key)["ETag"]
+        for key in rendition_keys
+    }
+    s3_client.put_object(
+        Bucket=manifest_bucket,
+        Key=manifest_key,
+        Body=json.dumps({"renditions": renditions, **fields}),
+        ContentType="application/json",
+    )
@@ -0,0 +1,332 @@
+# This software is Copyright ©️ 2020 The University of Southern California. All Rights Reserved.
+# Permission to use, copy, modify, and distribute this software and its documentation for educational, research and non-profit purposes, without fee, and without a written agreement is hereby granted, provided that the above copyright notice and subject to the full license file found in the root of this software deliverable. Permission to make commercial use of this software may be obtained by contacting:  USC Stevens Center for Innovation University of Southern California 1150 S. Olive Street, Suite 2300, Los Angeles, CA 90115, USA Email: accounting@stevens.usc.edu
+#
+# The full terms of this copyright and license should always be found in the root directory of this software deliverable as "license.txt" and if these terms are not found with this software, please contact the USC Stevens Center for the full license.
+#
+#
+import hashlib
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, List, Optional
+from botocore.exceptions import ClientError
+from module.logger import get_logger, span
+
+
+log = get_logger("s3-utils")
+DOWNLOAD_BUFFER_SIZE = 8 * 1024 * 1024
+RANGE_BLOCK_SIZE = 256 * 1024
+# copy_object is a single request up to 5GB, but one request copies
+# at a fraction of the speed of parallel part copies for large objects
+COPY_MULTIPART_THRESHOLD = 64 * 1024 * 1024
+COPY_PART_SIZE = 32 * 1024 * 1024
+COPY_MAX_WORKERS = 8
+# s3 parts must be at least 5MB (except the last one)
+STREAM_PART_SIZE = 8 * 1024 * 1024
+STREAM_MAX_PARTS_IN_FLIGHT = 4
+
+
+def download_file_with_hash(s3_client, bucket: str, key: str, file_path: str) -> str:
+    """Streams an s3 object to file_path and returns its SHA-1 hex digest,
+    so the file doesn't have to be read again just to hash it"""
+    h = hashlib.sha1()
+    buffer = bytearray(DOWNLOAD_BUFFER_SIZE)
+    view = memoryview(buffer)
+    total = 0
+    with span("download") as download_span:
+        body = s3_client.get_object(Bucket=bucket, Key=key)["Body"]
+        with open(file_path, "wb") as f:
+            while True:
+                n = body.readinto(buffer)
+                if not n:
+                    break
+                h.update(view[:n])
+                f.write(view[:n])
+                total += n
+        body.close()
+        download_span.add_bytes(total)
+    log.info("downloaded %s bytes from s3://%s/%s", total, bucket, key)
+    return h.hexdigest()
+
+
+def get_unchanged_objects(
+    s3_client, bucket: str, etags: Dict[str, str]
+) -> Optional[Dict[str, Dict]]:
+    """key -> {contentType, size} if every key still has the recorded etag,
+    None as soon as one is gone or was overwritten"""
+    objects = {}
+    for key, etag in etags.items():
+        try:
+            head = s3_client.head_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            log.info("%s is gone (%s)", key, e)
+            return None
+        if head["ETag"] != etag:
+            log.info("%s has changed", key)
+            return None
+        objects[key] = {
+            "contentType": head["ContentType"],
+            "size": head["ContentLength"],
+        }
+    return objects
+
+
+def copy_s3_object(
+    s3_client,
+    src_bucket: str,
+    src_key: str,
+    bucket: str,
+    key: str,
+    content_type: str,
+    size: Optional[int] = None,
+) -> None:
+    """Server-side copy, the bytes never pass through the lambda.
+    Small objects are one copy_object, large ones a multipart upload
+    with the parts copied in parallel (upload_part_copy)"""
+    if size is None:
+        size = s3_client.head_object(Bucket=src_bucket, Key=src_key)["ContentLength"]
+    copy_source = {"Bucket": src_bucket, "Key": src_key}
+    log.info(
+        "copying %s bytes from s3://%s/%s to s3://%s/%s",
+        size,
+        src_bucket,
+        src_key,
+        bucket,
+        key,
+    )
+    if size <= COPY_MULTIPART_THRESHOLD:
+        s3_client.copy_object(
+            CopySource=copy_source,
+            Bucket=bucket,
+            Key=key,
+            ContentType=content_type,
+            MetadataDirective="REPLACE",
+        )
+        return
+
+    upload_id = s3_client.create_multipart_upload(
+        Bucket=bucket, Key=key, ContentType=content_type
+    )["UploadId"]
+
+    def copy_part(part_number: int) -> Dict:
+        start = (part_number - 1) * COPY_PART_SIZE
+        end = min(start + COPY_PART_SIZE, size) - 1
+        result = s3_client.upload_part_copy(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            CopySource=copy_source,
+            CopySourceRange=f"bytes={start}-{end}",
+        )
+        return {"PartNumber": part_number, "ETag": result["CopyPartResult"]["ETag"]}
+
+    part_count = (size + COPY_PART_SIZE - 1) // COPY_PART_SIZE
+    try:
+        with ThreadPoolExecutor(max_workers=COPY_MAX_WORKERS) as executor:
+            parts = list(executor.map(copy_part, range(1, part_count + 1)))
+        s3_client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+    except Exception:
+        s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+
+
+class S3StreamUpload:
+    """Multipart upload fed from a stream (e.g. an ffmpeg pipe),
+    every part is uploaded as soon as it fills, so the upload overlaps
+    with whatever produces the stream and nothing is buffered on disk.
+    Nothing shows up in s3 until complete(), abort() discards the parts."""
+
+    def __init__(
+        self,
+        s3_client,
+        bucket: str,
+        key: str,
+        content_type: str,
+        part_size: int = STREAM_PART_SIZE,
+    ):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.upload_id = s3_client.create_multipart_upload(
+            Bucket=bucket, Key=key, ContentType=content_type
+        )["UploadId"]
+        self.parts: List[Dict] = []
+        self.bytes_uploaded = 0
+
+    def _upload_part(self, part_number: int, data: bytes) -> Dict:
+        result = self.s3_client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+        return {"PartNumber": part_number, "ETag": result["ETag"]}
+
+    def upload_from(self, stream: BinaryIO) -> None:
+        """reads stream until EOF, at most STREAM_MAX_PARTS_IN_FLIGHT parts
+        are buffered in memory while they upload"""
+        in_flight = threading.BoundedSemaphore(STREAM_MAX_PARTS_IN_FLIGHT)
+        # a retry re-uploads from part 1, s3 keeps the last upload of a part number
+        self.bytes_uploaded = 0
+
+        def upload_part(part_number: int, data: bytes) -> Dict:
+            try:
+                return self._upload_part(part_number, data)
+            finally:
+                in_flight.release()
+
+        futures = []
+        with ThreadPoolExecutor(max_workers=STREAM_MAX_PARTS_IN_FLIGHT) as executor:
+            while True:
+                data = read_full(stream, self.part_size)
+                # an empty object still needs one (empty) part
+                if not data and futures:
+                    break
+                in_flight.acquire()
+                # stop reading as soon as a part fails, result() raises below
+                if any(f.done() and f.exception() for f in futures):
+                    break
+                futures.append(executor.submit(upload_part, len(futures) + 1, data))
+                self.bytes_uploaded += len(data)
+                if len(data) < self.part_size:
+                    break
+            self.parts = [f.result() for f in futures]
+        log.info(
+            "uploaded %s bytes to s3://%s/%s in %s parts",
+            self.bytes_uploaded,
+            self.bucket,
+            self.key,
+            len(self.parts),
+        )
+
+    def complete(self) -> None:
+        self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts},
+        )
+
+    def abort(self) -> None:
+        self.s3_client.abort_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+        )
+
+
+def read_full(stream: BinaryIO, size: int) -> bytes:
+    """reads size bytes, pipes return short reads before EOF"""
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+class S3ReadLimitExceeded(Exception):
+    pass
+
+
+class S3RangeReader(io.RawIOBase):
+    """Read-only, seekable file object over an s3 object.
+    Reads are served from block_size aligned ranged GETs that are cached,
+    so parsers that jump around (mp4 moov atom at the end, webm Cues)
+    only transfer the blocks they actually touch.
+    Raises S3ReadLimitExceeded once more than max_bytes would be fetched."""
+
+    def __init__(
+        self,
+        s3_client,
+        bucket: str,
+        key: str,
+        block_size: int = RANGE_BLOCK_SIZE,
+        max_bytes: Optional[int] = None,
+    ):
+        super().__init__()
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self.size = s3_client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+        self.bytes_fetched = 0
+        self.requests = 0
+        self._blocks: Dict[int, bytes] = {}
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self.size + offset
+        else:
+            raise ValueError(f"invalid whence {whence}")
+        self._pos = max(0, self._pos)
+        return self._pos
+
+    def _fetch(self, first_block: int, last_block: int) -> None:
+        start = first_block * self.block_size
+        end = min((last_block + 1) * self.block_size, self.size) - 1
+        if self.max_bytes is not None and (
+            self.bytes_fetched + end - start + 1 > self.max_bytes
+        ):
+            raise S3ReadLimitExceeded(
+                f"reading s3://{self.bucket}/{self.key} needs more than {self.max_bytes} bytes"
+            )
+        body = self.s3_client.get_object(
+            Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{end}"
+        )["Body"]
+        data = body.read()
+        body.close()
+        self.requests += 1
+        self.bytes_fetched += len(data)
+        for block in range(first_block, last_block + 1):
+            offset = (block - first_block) * self.block_size
+            self._blocks[block] = data[offset : offset + self.block_size]
+
+    def readinto(self, b) -> int:
+        n = min(len(b), self.size - self._pos)
+        if n <= 0:
+            return 0
+        first_block = self._pos // self.block_size
+        last_block = (self._pos + n - 1) // self.block_size
+        # one ranged GET per run of consecutive blocks not fetched yet
+        missing_start = None
+        for block in range(first_block, last_block + 2):
+            missing = block <= last_block and block not in self._blocks
+            if missing and missing_start is None:
+                missing_start = block
+            elif not missing and missing_start is not None:
+                self._fetch(missing_start, block - 1)
+                missing_start = None
+        view = memoryview(b)
+        copied = 0
+        while copied < n:
+            block, offset = divmod(self._pos, self.block_size)
+            chunk = self._blocks[block][offset : offset + n - copied]
+            view[copied : copied + len(chunk)] = chunk
+            copied += len(chunk)
+            self._pos += len(chunk)
+        return copied
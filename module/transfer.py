@@ -2,13 +2,13 @@
 # Permission to use, copy, modify, and distribute this software and its documentation for educational, research and non-profit purposes, without fee, and without a written agreement is hereby granted, provided that the above copyright notice and subject to the full license file found in the root of this software deliverable. Permission to make commercial use of this software may be obtained by contacting:  USC Stevens Center for Innovation University of Southern California 1150 S. Olive Street, Suite 2300, Los Angeles, CA 90115, USA Email: accounting@stevens.usc.edu
 #
 # The full terms of this copyright and license should always be found in the root directory of this software deliverable as "license.txt" and if these terms are not found with this software, please contact the USC Stevens Center for the full license.
+import asyncio
 from dataclasses import dataclass
 import logging
-import queue
-from threading import Thread
 import urllib.request
-from os import remove
+from os import environ, remove
 
+from .fan_out import FanOutExecutor, FanOutResult
 from .api import (
     ImportMentorGQLRequest,
     UpdateAnswersGQLRequest,
@@ -19,6 +19,10 @@ from .api import (
 )
 from typing import Dict, List, TypedDict
 
+# every transfer downloads a video to /tmp first, so this (not the threads)
+# is what bounds it: 12 is what the thread workers used before
+TRANSFER_CONCURRENCY = int(environ.get("TRANSFER_CONCURRENCY", "12"))
+
 
 class Media:
     type: str
@@ -167,57 +171,37 @@ class ProcessTransferMentor(TypedDict):
 
 @dataclass
 class WorkerResult:
-    update: Dict
+    update: List[Dict]
     errors: List[str]
 
 
-def thread_video_uploads(
-    answer_list, mentor, s3_client, s3_bucket, no_workers
-) -> List[WorkerResult]:
-    class Worker(Thread):
-        def __init__(self, request_queue):
-            Thread.__init__(self)
-            self.queue = request_queue
-            self.results = []
-
-        def run(self):
-            while True:
-                answer = self.queue.get()
-                if answer == "":
-                    break
-
-                update, errors = transfer_mentor_videos_in_parellel(
-                    answer, mentor, s3_client, s3_bucket
-                )
-
-                self.results.append(WorkerResult(update, errors))
-                self.queue.task_done()
-
-    # Create queue and add req params
-    q = queue.Queue()
-    for r in answer_list:
-        q.put(r)
-
-    # Workers keep working till they receive an empty string
-    for _ in range(no_workers):
-        q.put("")
-
-    # Create workers and add to the queue
-    workers = []
-    for _ in range(no_workers):
-        worker = Worker(q)
-        worker.start()
-        workers.append(worker)
-    # Join workers to wait till they finished
-    for worker in workers:
-        worker.join()
-
-    # Combine results from all workers
-    r = []
-    for worker in workers:
-        r.extend(worker.results)
-
-    return r
+async def transfer_answers(
+    answer_list, mentor, s3_client, s3_bucket, auth_headers, executor: FanOutExecutor
+) -> FanOutResult[WorkerResult]:
+    """transfers the media of every answer, then updates the answers in
+    chunks of 100, all of it up to executor.concurrency at a time.
+    A failed transfer is an error of the result, a failed answer update
+    raises (once every chunk was tried): those answers still point at the old media"""
+    transfers = await executor.fan_out(
+        lambda answer: WorkerResult(
+            *transfer_mentor_videos_in_parellel(answer, mentor, s3_client, s3_bucket)
+        ),
+        answer_list,
+        describe=lambda answer: f"Failed to transfer answer {answer['question']['_id']}",
+    )
+    answer_updates = [u for r in transfers.results for u in r.update]
+    errors = transfers.errors + [e for r in transfers.results for e in r.errors]
+    chunks = [answer_updates[x : x + 100] for x in range(0, len(answer_updates), 100)]
+    updates = await executor.fan_out(
+        lambda chunk: update_answers_gql(
+            UpdateAnswersGQLRequest(mentorId=mentor, answers=chunk), auth_headers
+        ),
+        chunks,
+        describe=lambda chunk: f"Failed to update {len(chunk)} answers",
+    )
+    if updates.errors:
+        raise Exception(f"Failed to update answers: {updates.errors}")
+    return FanOutResult(transfers.results, errors)
 
 
 def transfer_mentor_videos_in_parellel(answer, mentor, s3_client, s3_bucket):
@@ -299,18 +283,31 @@ def process_transfer_mentor(
         auth_headers,
     )
 
-    answer_args_results = thread_video_uploads(
-        answers_with_media_transfers, mentor, s3_client, s3_bucket, 12
-    )
-    answer_updates_unflat = list(map(lambda r: r.update, answer_args_results))
-    answer_updates = [item for sublist in answer_updates_unflat for item in sublist]
-    errors_unflat = list(map(lambda r: r.errors, answer_args_results))
-    errors = [item for sublist in errors_unflat for item in sublist]
-    chunks = [answer_updates[x : x + 100] for x in range(0, len(answer_updates), 100)]
-    for answer_chunk in chunks:
-        update_answers_gql(
-            UpdateAnswersGQLRequest(mentorId=mentor, answers=answer_chunk), auth_headers
+    try:
+        with FanOutExecutor(TRANSFER_CONCURRENCY) as executor:
+            result = asyncio.run(
+                transfer_answers(
+                    answers_with_media_transfers,
+                    mentor,
+                    s3_client,
+                    s3_bucket,
+                    auth_headers,
+                    executor,
+                )
+            )
+    except Exception as e:
+        logging.error("Failed to update answers")
+        logging.error(e)
+        import_task_update_gql(
+            ImportTaskUpdateGQLRequest(
+                mentor=mentor,
+                s3_video_migration={"status": "FAILED"},
+                migration_errors=[str(e)],
+            ),
+            auth_headers,
         )
+        raise e
+    errors = result.errors
 
     s3_video_migration_update = {"status": "DONE"}
     import_task_update_gql(
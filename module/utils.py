@@ -130,7 +130,11 @@ def get_auth_headers(event) -> Dict[str, str]:
 
 
 def fetch_from_graphql(mentor, question, task_name, headers):
-    upload_task = fetch_task(mentor, question, headers)
+    return find_stored_task(fetch_task(mentor, question, headers), task_name)
+
+
+def find_stored_task(upload_task, task_name):
+    """task_name of an upload task (fetch_task or upload_task_read)"""
     if not upload_task:
         # this can happen if any task status is failed and client deletes the task
         return None
@@ -10,7 +10,7 @@ from module.api import (
 )
 from media_tools import transcript_to_vtt
 import boto3
-from module.logger import get_logger
+from module.logger import get_logger, metrics_handler
 from module.utils import (
     create_json_response,
     require_env,
@@ -25,6 +25,7 @@ load_sentry()
 log = get_logger("regen-vtt")
 
 
+@metrics_handler()
 def handler(event, context):
     log.info(event)
     if "body" not in event:
@@ -0,0 +1,122 @@
+#
+# This software is Copyright ©️ 2020 The University of Southern California. All Rights Reserved.
+# Permission to use, copy, modify, and distribute this software and its documentation for educational, research and non-profit purposes, without fee, and without a written agreement is hereby granted, provided that the above copyright notice and subject to the full license file found in the root of this software deliverable. Permission to make commercial use of this software may be obtained by contacting:  USC Stevens Center for Innovation University of Southern California 1150 S. Olive Street, Suite 2300, Los Angeles, CA 90115, USA Email: accounting@stevens.usc.edu
+#
+# The full terms of this copyright and license should always be found in the root directory of this software deliverable as "license.txt" and if these terms are not found with this software, please contact the USC Stevens Center for the full license.
+#
+import boto3
+import os
+import tempfile
+from typing import Dict, Optional
+from module.logger import get_logger, metrics_handler
+from module.utils import s3_bucket, load_sentry
+from module.api import (
+    AnswerUpdateRequest,
+    UpdateTaskStatusRequest,
+    upload_answer_and_task_status_update,
+)
+from module.content_index import (
+    content_index_key,
+    content_index_options,
+    find_current_entry,
+    get_content_index,
+)
+from module.s3_utils import copy_s3_object, download_file_with_hash
+
+load_sentry()
+log = get_logger("answer-find-content-handler")
+s3 = boto3.client("s3")
+content_index = get_content_index()
+
+# task in the step function request -> its field in the task status update
+TASK_STATUS_FIELDS = {
+    "trimUploadTask": "trim_upload_task",
+    "transcodeWebTask": "transcode_web_task",
+    "transcodeMobileTask": "transcode_mobile_task",
+    "transcribeTask": "transcribe_task",
+}
+
+
+def reuse_processed_upload(request: Dict, entry: Dict) -> None:
+    """The same file was already processed with the same options:
+    copies its artifacts (server side) and marks every task done"""
+    s3_path = os.path.dirname(request["video"])
+    source_path = entry["s3Path"]
+    log.info("copying processed media from %s to %s", source_path, s3_path)
+    for key, obj in entry["objects"].items():
+        copy_s3_object(
+            s3,
+            s3_bucket,
+            key,
+            s3_bucket,
+            f"{s3_path}/{os.path.basename(key)}",
+            obj["contentType"],
+            size=obj["size"],
+        )
+
+    def moved(media: Optional[Dict]) -> Optional[Dict]:
+        if not media:
+            return media
+        return {
+            **media,
+            **{
+                field: media[field].replace(source_path, s3_path, 1)
+                # stringMetadata has the key of the mediainfo sidecar
+                for field in ["url", "transparentVideoUrl", "stringMetadata"]
+                if media.get(field)
+            },
+        }
+
+    transcript = entry.get("transcript") or ""
+    media = {field: moved(m) for field, m in entry["media"].items()}
+    vtt_media = moved(entry.get("vttMedia"))
+    upload_answer_and_task_status_update(
+        AnswerUpdateRequest(
+            mentor=request["mentor"],
+            question=request["question"],
+            transcript=transcript,
+            vtt_media=vtt_media,
+            has_edited_transcript=False,
+            **media,
+        ),
+        UpdateTaskStatusRequest(
+            mentor=request["mentor"],
+            question=request["question"],
+            transcript=transcript,
+            vtt_media=vtt_media,
+            **{
+                field: {**request[name], "status": "DONE"}
+                for name, field in TASK_STATUS_FIELDS.items()
+                if request.get(name)
+            },
+            **media,
+        ),
+        request["authHeaders"],
+    )
+
+
+@metrics_handler()
+def handler(event, context):
+    """First state of the step function: hashes the upload while downloading it
+    (the same SHA-1 as the answer hash) and looks it up in the content index
+    together with the processing options (see content_index_options).
+    When an identical upload was processed the same way and its artifacts
+    are unchanged, they are reused and the rest of the step function is skipped.
+    Returns {"reused": bool, "contentIndexKey": ...} for step-index-content"""
+    log.info(event)
+    request = event["request"]
+    options = content_index_options(request)
+    if content_index is None or options is None:
+        log.info("content index not enabled for this upload")
+        return {"reused": False}
+    with tempfile.TemporaryDirectory() as work_dir:
+        video_hash = download_file_with_hash(
+            s3, s3_bucket, request["video"], os.path.join(work_dir, "original_video")
+        )
+    key = content_index_key(video_hash, options)
+    entry = find_current_entry(s3, s3_bucket, content_index, key)
+    if not entry:
+        return {"reused": False, "contentIndexKey": key}
+    log.info("%s was already processed (%s), reusing it", request["video"], key)
+    reuse_processed_upload(request, entry)
+    return {"reused": True, "contentIndexKey": key}
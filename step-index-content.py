@@ -0,0 +1,49 @@
+#
+# This software is Copyright ©️ 2020 The University of Southern California. All Rights Reserved.
+# Permission to use, copy, modify, and distribute this software and its documentation for educational, research and non-profit purposes, without fee, and without a written agreement is hereby granted, provided that the above copyright notice and subject to the full license file found in the root of this software deliverable. Permission to make commercial use of this software may be obtained by contacting:  USC Stevens Center for Innovation University of Southern California 1150 S. Olive Street, Suite 2300, Los Angeles, CA 90115, USA Email: accounting@stevens.usc.edu
+#
+# The full terms of this copyright and license should always be found in the root directory of this software deliverable as "license.txt" and if these terms are not found with this software, please contact the USC Stevens Center for the full license.
+#
+import boto3
+import os
+from module.logger import get_logger, metrics_handler
+from module.utils import s3_bucket, load_sentry
+from module.content_index import get_artifacts, get_content_index
+
+load_sentry()
+log = get_logger("answer-index-content-handler")
+s3 = boto3.client("s3")
+content_index = get_content_index()
+
+
+@metrics_handler()
+def handler(event, context):
+    """Records what the pipeline produced for an upload in the content index,
+    so the same file uploaded again with the same options can reuse it
+    (see step-find-content, which made event["contentIndexKey"]).
+    Runs after transcode and transcribe are both done,
+    event["results"] are their outputs"""
+    log.info(event)
+    request = event["request"]
+    if content_index is None or not event.get("contentIndexKey"):
+        log.info("content index not enabled")
+        return
+    transcode_result, transcribe_result = event["results"]
+    media = (transcode_result or {}).get("media") or {}
+    if not (media.get("web_media") and media.get("mobile_media")):
+        # cancelled or skipped tasks, nothing complete to reuse
+        log.info("transcode incomplete, not indexing %s", request["video"])
+        return
+    transcribe_result = transcribe_result or {}
+    s3_path = os.path.dirname(request["video"])
+    content_index.put(
+        event["contentIndexKey"],
+        {
+            "s3Path": s3_path,
+            "artifacts": get_artifacts(s3, s3_bucket, s3_path),
+            "media": media,
+            "transcript": transcribe_result.get("transcript", ""),
+            "vttMedia": transcribe_result.get("vttMedia"),
+        },
+    )
+    log.info("indexed %s as %s", request["video"], event["contentIndexKey"])
@@ -5,7 +5,7 @@
 # The full terms of this copyright and license should always be found in the root directory of this software deliverable as "license.txt" and if these terms are not found with this software, please contact the USC Stevens Center for the full license.
 #
 
-from module.logger import get_logger
+from module.logger import get_logger, metrics_handler
 from module.api import (
     UpdateTaskStatusRequest,
     upload_task_status_update,
@@ -16,6 +16,7 @@ load_sentry()
 log = get_logger("answer-transcribe-start-handler")
 
 
+@metrics_handler()
 def handler(event, context):
     log.info(event)
     request = event["request"]
@@ -7,13 +7,16 @@
 import boto3
 import tempfile
 import os
-from module.logger import get_logger
+from module.logger import get_logger, metrics_handler
 from media_tools import (
-    get_file_mime,
+    probe_media,
+    set_video_metric_dimensions,
+    store_mediainfo_sidecar,
+    get_desired_video_file_type,
     get_video_metadata,
-    video_encode_for_mobile,
-    ffmpeg_barebones_transcode,
-    get_video_encoding_type,
+    mediainfo_sidecar_key,
+    get_renditions,
+    video_encode_renditions_to_s3,
 )
 from module.api import (
     UpdateTaskStatusRequest,
@@ -22,7 +25,9 @@ from module.api import (
     upload_answer_and_task_status_update,
 )
 from module.utils import s3_bucket, load_sentry, fetch_from_graphql
-from module.constants import Supported_Video_Type, MP4, WEBM_VP9
+from module.s3_utils import download_file_with_hash
+from module.encoding_profiles import EncodingProfile, get_stage_encoding_profile
+from module.constants import Supported_Video_Type
 
 load_sentry()
 log = get_logger("answer-transcode-mobile-handler")
@@ -34,38 +39,19 @@ def transcode_mobile(
     video_file_type: Supported_Video_Type,
     s3_path,
     maintain_original_aspect_ratio,
+    profile: EncodingProfile,
 ):
     work_dir = os.path.dirname(video_file)
-    target_file = f"mobile.{video_file_type.extension}"
-    target_file_path = os.path.join(work_dir, target_file)
-
-    video_encode_for_mobile(
+    # webm renditions come with an mp4 fallback encoded from the same decoded frames
+    renditions = get_renditions(
         video_file,
-        target_file_path,
-        video_file_type.mime,
+        work_dir,
+        ["mobile"],
+        video_file_type,
         maintain_original_aspect_ratio=maintain_original_aspect_ratio,
+        profiles={"mobile": profile},
     )
-
-    log.info("uploading %s to %s/%s", target_file_path, s3_bucket, s3_path)
-    s3.upload_file(
-        target_file_path,
-        s3_bucket,
-        f"{s3_path}/{target_file}",
-        ExtraArgs={"ContentType": video_file_type.mime},
-    )
-
-    # webm are also transcoded to mp4 for browsers that do not support webm
-    if video_file_type.mime == "video/webm":
-        mp4_target_file = "mobile.mp4"
-        mp4_target_file_path = os.path.join(work_dir, mp4_target_file)
-        ffmpeg_barebones_transcode(target_file_path, mp4_target_file_path)
-        log.info("uploading %s to %s/%s", mp4_target_file_path, s3_bucket, s3_path)
-        s3.upload_file(
-            mp4_target_file_path,
-            s3_bucket,
-            f"{s3_path}/{mp4_target_file}",
-            ExtraArgs={"ContentType": "video/mp4"},
-        )
+    video_encode_renditions_to_s3(video_file, renditions, s3_path)
 
 
 def process_task(request):
@@ -85,25 +71,11 @@ def process_task(request):
 
     with tempfile.TemporaryDirectory() as work_dir:
         work_file = os.path.join(work_dir, "original_video")
-        s3.download_file(s3_bucket, request["video"], work_file)
+        video_hash = download_file_with_hash(s3, s3_bucket, request["video"], work_file)
+        set_video_metric_dimensions(probe_media(work_file))
 
         is_vbg_video = request["isVbgVideo"] if "isVbgVideo" in request else False
-        if is_vbg_video:
-            try:
-                file_mime_type = get_file_mime(work_file)
-                file_encoding = get_video_encoding_type(work_file)
-                if file_mime_type == "video/webm" and file_encoding == "vp9":
-                    desired_video_file_type = WEBM_VP9
-                else:
-                    desired_video_file_type = MP4
-            except Exception as e:
-                log.info(
-                    f"Failed to determine mime and encoding type for {work_file}, defaulting to mp4"
-                )
-                log.info(e)
-                desired_video_file_type = MP4
-        else:
-            desired_video_file_type = MP4
+        desired_video_file_type = get_desired_video_file_type(work_file, is_vbg_video)
 
         s3_path = os.path.dirname(request["video"])  # same 'folder' as original file
         log.info("%s downloaded to %s", request["video"], work_dir)
@@ -118,10 +90,19 @@ def process_task(request):
         )
 
         transcode_mobile(
-            work_file, desired_video_file_type, s3_path, maintain_original_aspect_ratio
+            work_file,
+            desired_video_file_type,
+            s3_path,
+            maintain_original_aspect_ratio,
+            get_stage_encoding_profile(request, "mobile"),
         )
 
-        video_metadata_string, duration, video_hash = get_video_metadata(work_file)
+        # the full mediainfo dump is stored once, media only references it
+        mediainfo_key = mediainfo_sidecar_key(request["video"])
+        store_mediainfo_sidecar(s3, s3_bucket, mediainfo_key, work_file)
+        video_metadata_string, duration, video_hash = get_video_metadata(
+            work_file, video_hash, mediainfo_key
+        )
         mobile_media = {
             "duration": duration,
             "hash": video_hash,
@@ -150,6 +131,7 @@ def process_task(request):
         )
 
 
+@metrics_handler()
 def handler(event, context):
     log.info(event)
     request = event["request"]
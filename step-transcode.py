@@ -0,0 +1,274 @@
+#
+# This software is Copyright ©️ 2020 The University of Southern California. All Rights Reserved.
+# Permission to use, copy, modify, and distribute this software and its documentation for educational, research and non-profit purposes, without fee, and without a written agreement is hereby granted, provided that the above copyright notice and subject to the full license file found in the root of this software deliverable. Permission to make commercial use of this software may be obtained by contacting:  USC Stevens Center for Innovation University of Southern California 1150 S. Olive Street, Suite 2300, Los Angeles, CA 90115, USA Email: accounting@stevens.usc.edu
+#
+# The full terms of this copyright and license should always be found in the root directory of this software deliverable as "license.txt" and if these terms are not found with this software, please contact the USC Stevens Center for the full license.
+#
+
+import boto3
+import json
+import tempfile
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from module.logger import get_logger, metrics_handler
+from media_tools import (
+    BackgroundProgress,
+    FFmpegProgress,
+    find_duration,
+    get_desired_video_file_type,
+    get_renditions,
+    get_video_metadata,
+    mediainfo_sidecar_key,
+    probe_media,
+    put_thumbnail,
+    set_video_metric_dimensions,
+    store_mediainfo_sidecar,
+    throttle_progress,
+    video_encode_renditions_to_s3,
+)
+from module.api import (
+    UpdateTaskStatusRequest,
+    AnswerUpdateRequest,
+    MentorThumbnailUpdateRequest,
+    fetch_task,
+    mentor_thumbnail_update,
+    upload_task_status_update,
+    upload_answer_and_task_status_update,
+)
+from module.utils import s3_bucket, load_sentry, require_env
+from module.s3_utils import download_file_with_hash
+from module.encoding_profiles import EncodingProfile, get_stage_encoding_profile
+from module.rendition_manifest import (
+    load_rendition_manifest,
+    rendition_manifest_key,
+    save_rendition_manifest,
+)
+
+load_sentry()
+log = get_logger("answer-transcode-handler")
+s3 = boto3.client("s3")
+# private, and expires everything after 30 days: good for rendition manifests
+upload_bucket = require_env("SIGNED_UPLOAD_BUCKET")
+
+# rendition tag -> name of its task in the step function request and graphql
+TASK_NAMES = {"web": "transcodeWebTask", "mobile": "transcodeMobileTask"}
+TASK_STATUS_FIELDS = {"web": "transcode_web_task", "mobile": "transcode_mobile_task"}
+MEDIA_FIELDS = {"web": "web_media", "mobile": "mobile_media"}
+# at most one task status update with the encode progress this often
+TASK_PROGRESS_INTERVAL_SECS = float(os.environ.get("TASK_PROGRESS_INTERVAL_SECS", "15"))
+
+
+def get_tags_to_process(request) -> List[str]:
+    requested = [tag for tag, name in TASK_NAMES.items() if request.get(name)]
+    if not requested:
+        return []
+    upload_task = fetch_task(
+        request["mentor"], request["question"], request["authHeaders"]
+    )
+    if not upload_task:
+        # this can happen if any task status is failed and client deletes the task
+        log.warning("upload task not found, skipping transcode")
+        return []
+    tags = []
+    for tag in requested:
+        stored_task = upload_task.get(TASK_NAMES[tag])
+        if stored_task is None:
+            log.error("task does not exist in upload task %s", upload_task)
+            raise Exception("task does not exist in upload task %s", upload_task)
+        if stored_task["status"].startswith("CANCEL"):
+            log.info("%s task cancelled, skipping transcode", tag)
+            continue
+        tags.append(tag)
+    return tags
+
+
+def task_status_update(tags: List[str], status: Dict) -> Dict:
+    return {TASK_STATUS_FIELDS[tag]: status for tag in tags}
+
+
+def task_progress_reporter(
+    request, tags: List[str], duration: float
+) -> BackgroundProgress:
+    """puts the encode progress in the payload of the IN_PROGRESS tasks,
+    at most every TASK_PROGRESS_INTERVAL_SECS. The updates are posted from
+    a worker thread, close it before the final task status update"""
+
+    def report(progress: FFmpegProgress) -> None:
+        percent = (
+            min(99, int(100 * progress.out_time_secs / duration)) if duration > 0 else 0
+        )
+        log.info(
+            "encoded %s%%: %s frames, %s fps, speed %sx",
+            percent,
+            progress.frame,
+            progress.fps,
+            progress.speed,
+        )
+        payload = {
+            "percent": percent,
+            "frame": progress.frame,
+            "fps": progress.fps,
+            "speed": progress.speed,
+        }
+        upload_task_status_update(
+            UpdateTaskStatusRequest(
+                mentor=request["mentor"],
+                question=request["question"],
+                **task_status_update(
+                    tags, {"status": "IN_PROGRESS", "payload": json.dumps(payload)}
+                ),
+            ),
+            request["authHeaders"],
+        )
+
+    return BackgroundProgress(throttle_progress(report, TASK_PROGRESS_INTERVAL_SECS))
+
+
+def transcode(
+    request, tags: List[str], s3_path: str, profiles: Dict[str, EncodingProfile]
+) -> Tuple[Dict, Optional[str], List[str]]:
+    """Encodes and uploads the renditions, returns the media fields,
+    the thumbnail s3 key (if one was made) and the rendition s3 keys"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_file = os.path.join(work_dir, "original_video")
+        video_hash = download_file_with_hash(s3, s3_bucket, request["video"], work_file)
+        set_video_metric_dimensions(probe_media(work_file))
+        is_vbg_video = request["isVbgVideo"] if "isVbgVideo" in request else False
+        desired_video_file_type = get_desired_video_file_type(work_file, is_vbg_video)
+        log.info("%s downloaded to %s", request["video"], work_dir)
+
+        renditions = get_renditions(
+            work_file,
+            os.path.join(work_dir, "renditions"),
+            tags,
+            desired_video_file_type,
+            maintain_original_aspect_ratio=request["maintain_original_aspect_ratio"],
+            profiles=profiles,
+        )
+        # the thumbnail is one more output of the same encode
+        with task_progress_reporter(
+            request, tags, find_duration(work_file)
+        ) as on_progress:
+            thumbnail = video_encode_renditions_to_s3(
+                work_file,
+                renditions,
+                s3_path,
+                with_thumbnail=request["generate_thumbnail"] and "web" in tags,
+                on_progress=on_progress,
+            )
+        thumbnail_path = None
+        if thumbnail:
+            thumbnail_path = f"mentor/thumbnails/{request['mentor']}/{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}/thumbnail.jpg"
+            put_thumbnail(thumbnail_path, thumbnail)
+
+        # the full mediainfo dump is stored once, media only references it
+        mediainfo_key = mediainfo_sidecar_key(request["video"])
+        store_mediainfo_sidecar(s3, s3_bucket, mediainfo_key, work_file)
+        video_metadata_string, duration, video_hash = get_video_metadata(
+            work_file, video_hash, mediainfo_key
+        )
+        media = {
+            MEDIA_FIELDS[tag]: {
+                "duration": duration,
+                "hash": video_hash,
+                "stringMetadata": video_metadata_string,
+                "type": "video",
+                "tag": tag,
+                "url": f"{s3_path}/{tag}.mp4",  # mp4's are always created
+                "transparentVideoUrl": f"{s3_path}/{tag}.webm"
+                if desired_video_file_type.mime == "video/webm"
+                else "",  # webms are also created if the mime type is webm
+            }
+            for tag in tags
+        }
+        rendition_keys = [
+            f"{s3_path}/{os.path.basename(r.target_file)}" for r in renditions
+        ]
+        return media, thumbnail_path, rendition_keys
+
+
+def process_task(request) -> Optional[Dict]:
+    """Returns the media fields it stored, None if there was nothing to do.
+    A completed encode is recorded in a rendition manifest, so when a later
+    step fails (e.g. graphql) the step function's retry doesn't encode again"""
+    auth_headers = request["authHeaders"]
+    log.info("video to process %s", request["video"])
+    question_id = request["question"]
+    mentor_id = request["mentor"]
+    tags = get_tags_to_process(request)
+    if not tags:
+        log.warning("no transcode tasks to process")
+        return
+
+    s3_path = os.path.dirname(request["video"])
+    profiles = {tag: get_stage_encoding_profile(request, tag) for tag in tags}
+    manifest_key = rendition_manifest_key(
+        s3,
+        s3_bucket,
+        request["video"],
+        {
+            "tags": tags,
+            "maintain_original_aspect_ratio": request["maintain_original_aspect_ratio"],
+            "isVbgVideo": request.get("isVbgVideo", False),
+            "generate_thumbnail": request["generate_thumbnail"],
+            "profiles": {tag: repr(profile) for tag, profile in profiles.items()},
+        },
+    )
+    upload_task_status_update(
+        UpdateTaskStatusRequest(
+            mentor=mentor_id,
+            question=question_id,
+            **task_status_update(tags, {"status": "IN_PROGRESS"}),
+        ),
+        auth_headers,
+    )
+
+    manifest = load_rendition_manifest(s3, upload_bucket, manifest_key, s3_bucket)
+    if manifest:
+        log.info("renditions already encoded (%s), skipping the encode", manifest_key)
+        media, thumbnail_path = manifest["media"], manifest["thumbnail"]
+    else:
+        media, thumbnail_path, rendition_keys = transcode(
+            request, tags, s3_path, profiles
+        )
+        save_rendition_manifest(
+            s3,
+            upload_bucket,
+            manifest_key,
+            s3_bucket,
+            rendition_keys,
+            media=media,
+            thumbnail=thumbnail_path,
+        )
+
+    if thumbnail_path:
+        mentor_thumbnail_update(
+            MentorThumbnailUpdateRequest(mentor=mentor_id, thumbnail=thumbnail_path),
+            auth_headers,
+        )
+    upload_answer_and_task_status_update(
+        AnswerUpdateRequest(mentor=mentor_id, question=question_id, **media),
+        UpdateTaskStatusRequest(
+            mentor=mentor_id,
+            question=question_id,
+            **task_status_update(tags, {"status": "DONE"}),
+            **media,
+        ),
+        auth_headers,
+    )
+    return media
+
+
+@metrics_handler()
+def handler(event, context):
+    """Transcodes web and mobile renditions with one download and one decode"""
+    log.info(event)
+    request = event["request"]
+
+    if not any(request.get(name) for name in TASK_NAMES.values()):
+        log.warning("no transcoding task requested")
+        return
+
+    # the media is the step's output, see step-index-content
+    return {"media": process_task(request)}
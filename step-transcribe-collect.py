@@ -10,7 +10,7 @@ import botocore
 import tempfile
 import os
 from typing import Dict
-from module.logger import get_logger
+from module.logger import get_logger, metrics_handler
 from module.api import (
     AnswerUpdateRequest,
     UpdateTaskStatusRequest,
@@ -77,7 +77,10 @@ def process_event(
                 ),
                 auth_headers,
             )
-            sfn_client.send_task_success(taskToken=stored_task["payload"], output="{}")
+            sfn_client.send_task_success(
+                taskToken=stored_task["payload"],
+                output=json.dumps({"transcript": transcript}),
+            )
 
         try:
             vtt_file = os.path.join(work_dir, "transcribe.vtt")
@@ -124,9 +127,14 @@ def process_event(
             ),
             auth_headers,
         )
-        sfn_client.send_task_success(taskToken=stored_task["payload"], output="{}")
+        # the step's output, see step-index-content
+        sfn_client.send_task_success(
+            taskToken=stored_task["payload"],
+            output=json.dumps({"transcript": transcript, "vttMedia": vtt_media}),
+        )
 
 
+@metrics_handler()
 def handler(event, context):
     """This lambda is triggered with an S3 event - when the transcribe job is done,
     and NOT by the Step Function. Therefore it must in all scenarios report
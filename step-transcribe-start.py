@@ -7,22 +7,29 @@
 import boto3
 import tempfile
 import os
-from module.logger import get_logger
+from module.logger import get_logger, metrics_handler, span
 import uuid
 import json
-from media_tools import video_to_audio, has_audio
+from media_tools import (
+    get_transcribe_media_format,
+    has_audio,
+    probe_media_s3,
+    set_video_metric_dimensions,
+    video_to_audio_for_transcribe_s3,
+)
 from module.utils import (
     s3_bucket,
     load_sentry,
     require_env,
-    fetch_from_graphql,
+    find_stored_task,
 )
 from module.api import (
     UpdateTaskStatusRequest,
-    fetch_question_name,
+    batch_gql,
+    question_name_read,
+    upload_task_read,
     upload_task_status_update,
 )
-from typing import Dict
 
 load_sentry()
 log = get_logger("answer-transcribe-start-handler")
@@ -35,9 +42,38 @@ transcribe = boto3.client("transcribe", region_name=aws_region)
 sfn_client = boto3.client("stepfunctions", region_name=aws_region)
 
 
-def is_idle_question(question_id: str, headers: Dict[str, str] = {}) -> bool:
-    name = fetch_question_name(question_id, headers)
-    return name == "_IDLE_"
+def start_transcription_job(
+    mentor, question, task_id, media_bucket, media_key, media_format, auth_headers
+):
+    # Add auth header file to output bucket
+    auth_header_file = tempfile.NamedTemporaryFile(mode="w+")
+    json.dump(auth_headers, auth_header_file)
+    auth_header_file.flush()
+    s3.upload_file(
+        auth_header_file.name,
+        output_bucket,
+        f"{mentor}/{question}/{task_id}/auth_headers.json",
+        ExtraArgs={"ContentType": "application/json"},
+    )
+
+    # Start transcription job
+    job = transcribe.start_transcription_job(
+        TranscriptionJobName=f"{mentor}_{question}_{task_id}_{uuid.uuid4()}",  # make sure job id is unique
+        LanguageCode="en-US",
+        Media={
+            "MediaFileUri": f"https://s3.{aws_region}.amazonaws.com/{media_bucket}/{media_key}"
+        },
+        MediaFormat=media_format,
+        OutputBucketName=output_bucket,
+        OutputKey=f"{mentor}/{question}/{task_id}/transcribe.json",
+        Subtitles={"Formats": ["vtt"]},
+        Settings={
+            "ShowSpeakerLabels": False,
+            "ChannelIdentification": False,  # process only one audio channel
+            "ShowAlternatives": False,
+        },
+    )
+    log.info(job)
 
 
 def transcribe_video(mentor, question, task_id, video_file, task_token, auth_headers):
@@ -46,53 +82,70 @@ def transcribe_video(mentor, question, task_id, video_file, task_token, auth_hea
         sfn_client.send_task_success(taskToken=task_token, output="{}")
         # continue to overwrite any existing previous transcript
     else:
-        audio_file = video_to_audio(video_file)  # fails if no audio stream exists
-        log.info("transcribing %s", audio_file)
-
         input_s3_path = f"{mentor}/{question}/${task_id}/answer.mp3"
-        s3.upload_file(
-            audio_file,
+        # fails if no audio stream exists
+        audio_bytes = video_to_audio_for_transcribe_s3(
+            video_file, input_bucket, input_s3_path
+        )
+        log.info("transcribing %s (%s bytes)", input_s3_path, audio_bytes)
+        start_transcription_job(
+            mentor,
+            question,
+            task_id,
             input_bucket,
             input_s3_path,
-            ExtraArgs={"ContentType": "audio/mp3"},
+            "mp3",
+            auth_headers,
         )
 
-        # Add auth header file to output bucket
-        auth_header_file = tempfile.NamedTemporaryFile(mode="w+")
-        json.dump(auth_headers, auth_header_file)
-        auth_header_file.flush()
-        s3.upload_file(
-            auth_header_file.name,
-            output_bucket,
-            f"{mentor}/{question}/{task_id}/auth_headers.json",
-            ExtraArgs={"ContentType": "application/json"},
-        )
 
-        # Start transcription job
-        job = transcribe.start_transcription_job(
-            TranscriptionJobName=f"{mentor}_{question}_{task_id}_{uuid.uuid4()}",  # make sure job id is unique
-            LanguageCode="en-US",
-            Media={
-                "MediaFileUri": f"https://s3.{aws_region}.amazonaws.com/{input_bucket}/{input_s3_path}"
-            },
-            MediaFormat="mp3",
-            OutputBucketName=output_bucket,
-            OutputKey=f"{mentor}/{question}/{task_id}/transcribe.json",
-            Subtitles={"Formats": ["vtt"]},
-            Settings={
-                "ShowSpeakerLabels": False,
-                "ChannelIdentification": False,  # process only one audio channel
-                "ShowAlternatives": False,
-            },
+def transcribe_original(request, task, task_token) -> bool:
+    """Points transcribe at the stored original when it can read it as is,
+    only the container header is read (ranged GETs), nothing is downloaded.
+    Returns False if the original has to be converted to mp3 first"""
+    try:
+        probe, _ = probe_media_s3(s3, s3_bucket, request["video"])
+    except Exception as e:
+        log.warning("could not probe %s: %s", request["video"], e)
+        return False
+    set_video_metric_dimensions(probe)
+    if not probe.has_audio:
+        log.warning("video file does not contain any audio streams")
+        sfn_client.send_task_success(taskToken=task_token, output="{}")
+        return True
+    media_format = get_transcribe_media_format(probe)
+    if not media_format:
+        log.info(
+            "transcribe can't read %s/%s as is, converting to mp3",
+            probe.container,
+            probe.audio_codec,
         )
-        log.info(job)
+        return False
+    log.info("transcribing %s as %s", request["video"], media_format)
+    start_transcription_job(
+        request["mentor"],
+        request["question"],
+        task["task_id"],
+        s3_bucket,
+        request["video"],
+        media_format,
+        request["authHeaders"],
+    )
+    return True
 
 
 def process_task(request, task, task_token):
     auth_headers = request["authHeaders"]
-    stored_task = fetch_from_graphql(
-        request["mentor"], request["question"], "transcribeTask", auth_headers
+    # one round trip for both, a deleted question must not fail
+    # the batch before we know the task is still wanted
+    upload_task, question_name = batch_gql(
+        [
+            upload_task_read(request["mentor"], request["question"]),
+            question_name_read(request["question"], optional=True),
+        ],
+        auth_headers,
     )
+    stored_task = find_stored_task(upload_task, "transcribeTask")
     if not stored_task:
         log.warning("task not found, skipping transcription")
         sfn_client.send_task_success(taskToken=task_token, output="{}")
@@ -101,9 +154,10 @@ def process_task(request, task, task_token):
         log.info("task cancelled, skipping transcription")
         sfn_client.send_task_success(taskToken=task_token, output="{}")
         return
+    if question_name is None:
+        raise Exception(f"question {request['question']} not found")
 
-    is_idle = is_idle_question(request["question"], auth_headers)
-    if is_idle:
+    if question_name == "_IDLE_":
         log.info("question is idle, nothing to transcribe")
         upload_task_status_update(
             UpdateTaskStatusRequest(
@@ -129,10 +183,14 @@ def process_task(request, task, task_token):
     )
 
     log.info("video to process %s", request["video"])
+    if transcribe_original(request, task, task_token):
+        return
 
     with tempfile.TemporaryDirectory() as work_dir:
         work_file = os.path.join(work_dir, "original_video")
-        s3.download_file(s3_bucket, request["video"], work_file)
+        with span("download") as download_span:
+            s3.download_file(s3_bucket, request["video"], work_file)
+            download_span.add_bytes(os.path.getsize(work_file))
         log.info("%s downloaded to %s", request["video"], work_dir)
 
         transcribe_video(
@@ -145,6 +203,7 @@ def process_task(request, task, task_token):
         )
 
 
+@metrics_handler()
 def handler(event, context):
     """For AWS Transcribe service integration, we use Task Token
     https://docs.aws.amazon.com/step-functions/latest/dg/connect-to-resource.html#connect-wait-token
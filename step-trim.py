@@ -7,7 +7,13 @@
 import boto3
 import tempfile
 import os
-from media_tools import get_file_mime, video_trim, get_video_encoding_type
+from media_tools import (
+    get_desired_video_file_type,
+    probe_media,
+    set_video_metric_dimensions,
+    video_trim,
+)
+from module.encoding_profiles import get_stage_encoding_profile
 
 from module.utils import (
     s3_bucket,
@@ -15,12 +21,12 @@ from module.utils import (
     require_env,
     fetch_from_graphql,
 )
-from module.constants import MP4, WEBM_VP9, Supported_Video_Type
+from module.constants import Supported_Video_Type
 from module.api import (
     UpdateTaskStatusRequest,
     upload_task_status_update,
 )
-from module.logger import get_logger
+from module.logger import get_logger, metrics_handler, span
 
 
 load_sentry()
@@ -53,7 +59,10 @@ def process_task(request):
 
     with tempfile.TemporaryDirectory() as work_dir:
         work_file = os.path.join(work_dir, "original_video")  # don't assume file type
-        s3_client.download_file(s3_bucket, request["video"], work_file)
+        with span("download") as download_span:
+            s3_client.download_file(s3_bucket, request["video"], work_file)
+            download_span.add_bytes(os.path.getsize(work_file))
+        set_video_metric_dimensions(probe_media(work_file))
         s3_path = os.path.dirname(request["video"])
         log.info("%s downloaded to %s", request["video"], work_dir)
         upload_task_status_update(
@@ -66,40 +75,30 @@ def process_task(request):
         )
 
         is_vbg_video = request["isVbgVideo"] if "isVbgVideo" in request else False
-        if is_vbg_video:
-            try:
-                file_mime_type = get_file_mime(work_file)
-                file_encoding = get_video_encoding_type(work_file)
-                if file_mime_type == "video/webm" and file_encoding == "vp9":
-                    desired_video_file_type = WEBM_VP9
-                else:
-                    desired_video_file_type = MP4
-            except Exception as e:
-                log.info(
-                    f"Failed to determine mime and encoding type for {work_file}, defaulting to mp4"
-                )
-                log.info(e)
-                desired_video_file_type = MP4
-        else:
-            desired_video_file_type = MP4
+        desired_video_file_type = get_desired_video_file_type(work_file, is_vbg_video)
 
         log.info("trimming file %s", work_file)
         trim_file = f"{work_file}-trim.{desired_video_file_type.extension}"
-        video_trim(
+        trim_mode = video_trim(
             work_file,
             trim_file,
             request["trim"]["start"],
             request["trim"]["end"],
             desired_video_file_type,
+            get_stage_encoding_profile(request, "trim"),
+            # auto, copy, smart or reencode, see media_tools.video_trim
+            mode=request["trim"].get("mode", "auto"),
         )
-        log.info("trim completed")
+        log.info("trim completed (%s)", trim_mode)
         s3_path = f"videos/{request['mentor']}/{request['question']}"
-        s3_client.upload_file(
-            trim_file,
-            s3_bucket,
-            f"{s3_path}/original.{desired_video_file_type.extension}",
-            ExtraArgs={"ContentType": desired_video_file_type.mime},
-        )
+        with span("upload") as upload_span:
+            s3_client.upload_file(
+                trim_file,
+                s3_bucket,
+                f"{s3_path}/original.{desired_video_file_type.extension}",
+                ExtraArgs={"ContentType": desired_video_file_type.mime},
+            )
+            upload_span.add_bytes(os.path.getsize(trim_file))
         log.info("trimmed video uploaded")
 
         upload_task_status_update(
@@ -112,6 +111,7 @@ def process_task(request):
         )
 
 
+@metrics_handler()
 def handler(event, context):
     log.info(event)
     request = event["request"]
@@ -0,0 +1,210 @@
+import json
+import os
+import resource
+import shutil
+import subprocess
+import time
+
+import pytest
+
+# same envvars the unit tests get from the Makefile, so media_tools can be imported
+os.environ.setdefault("S3_STATIC_ARN", "arn:aws:s3:::bucket-name")
+os.environ.setdefault("REGION", "us-east-1")
+os.environ.setdefault("LOG_LEVEL", "INFO")
+
+# outside of lambda the /opt layer does not exist, use local binaries instead
+if not os.path.exists(
+    os.environ.get(
+        "MEDIAINFO_LIB", "/opt/MediaInfo_DLL_21.09_Lambda/lib/libmediainfo.so"
+    )
+):
+    import pymediainfo
+
+    bundled = os.path.join(os.path.dirname(pymediainfo.__file__), "libmediainfo.so.0")
+    if os.path.exists(bundled):
+        os.environ["MEDIAINFO_LIB"] = bundled
+for name, default in [
+    ("FFMPEG_EXECUTABLE", "ffmpeg"),
+    ("FFPROBE_EXECUTABLE", "ffprobe"),
+]:
+    if not os.path.exists(os.environ.get(name, f"/opt/ffmpeg/{default}")):
+        os.environ[name] = shutil.which(default) or default
+
+FIXTURE_VIDEO = "test/integration/fixtures/celery-short.mp4"
+
+
+@pytest.fixture
+def fixture_video():
+    if not os.path.exists(os.environ.get("MEDIAINFO_LIB", "")):
+        pytest.skip("mediainfo library not available")
+    return FIXTURE_VIDEO
+
+
+@pytest.fixture
+def ffmpeg():
+    if not shutil.which(os.environ["FFMPEG_EXECUTABLE"]):
+        pytest.skip("ffmpeg not available")
+    return os.environ["FFMPEG_EXECUTABLE"]
+
+
+def children_cpu_secs() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+@pytest.fixture
+def measure():
+    """runs fn and returns the (cpu-secs, wall secs) it took,
+    cpu time is that of the ffmpeg child processes"""
+
+    def _measure(fn):
+        cpu, wall = children_cpu_secs(), time.perf_counter()
+        fn()
+        return children_cpu_secs() - cpu, time.perf_counter() - wall
+
+    return _measure
+
+
+@pytest.fixture
+def vbg_video(fixture_video, ffmpeg, tmp_path):
+    """a short vp9 webm with an alpha channel, like the ones vbg uploads produce"""
+    vbg_file = str(tmp_path / "vbg.webm")
+    subprocess.run(
+        [
+            ffmpeg,
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc2=size=1280x720:rate=30:duration=5,format=yuva420p",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=frequency=440:duration=5",
+            "-c:v",
+            "libvpx-vp9",
+            "-pix_fmt",
+            "yuva420p",
+            "-b:v",
+            "2M",
+            "-c:a",
+            "libvorbis",
+            vbg_file,
+        ],
+        check=True,
+    )
+    return vbg_file
+
+
+SYNTHETIC_CODEC_ARGS = {
+    "h264": ("mp4", "yuv420p", ["-c:v", "libx264", "-c:a", "aac"]),
+    # like the webms vbg uploads produce
+    "vp9-alpha": (
+        "webm",
+        "yuva420p",
+        [
+            "-c:v",
+            "libvpx-vp9",
+            "-b:v",
+            "2M",
+            "-deadline",
+            "realtime",
+            "-c:a",
+            "libopus",
+        ],
+    ),
+}
+
+
+@pytest.fixture(scope="session")
+def synthetic_clip(tmp_path_factory):
+    """makes (once per session) a clip of lavfi testsrc2 video and sine audio,
+    codec is one of SYNTHETIC_CODEC_ARGS"""
+    clips_dir = tmp_path_factory.mktemp("clips")
+    clips = {}
+
+    def _synthetic_clip(size: str, secs: int, codec: str) -> str:
+        if not os.path.exists(os.environ.get("MEDIAINFO_LIB", "")):
+            pytest.skip("mediainfo library not available")
+        ffmpeg = os.environ["FFMPEG_EXECUTABLE"]
+        if not shutil.which(ffmpeg):
+            pytest.skip("ffmpeg not available")
+        name = f"{codec}-{size}-{secs}s"
+        if name not in clips:
+            extension, pix_fmt, codec_args = SYNTHETIC_CODEC_ARGS[codec]
+            clip = str(clips_dir / f"{name}.{extension}")
+            subprocess.run(
+                [
+                    ffmpeg,
+                    "-loglevel",
+                    "error",
+                    "-f",
+                    "lavfi",
+                    "-i",
+                    f"testsrc2=size={size}:rate=30:duration={secs},format={pix_fmt}",
+                    "-f",
+                    "lavfi",
+                    "-i",
+                    f"sine=frequency=440:duration={secs}",
+                    "-pix_fmt",
+                    pix_fmt,
+                    *codec_args,
+                    clip,
+                ],
+                check=True,
+            )
+            clips[name] = clip
+        return clips[name]
+
+    return _synthetic_clip
+
+
+# timings depend on the machine, so the baseline is recorded where the
+# benchmarks run (make benchmark-baseline) and never committed
+BASELINE_FILE = os.environ.get("BENCHMARK_BASELINE")
+# a stage regresses when it takes this much longer than its baseline ...
+REGRESSION_THRESHOLD = float(os.environ.get("BENCHMARK_THRESHOLD", "0.25"))
+# ... and at least this many secs more (timer noise of quick stages)
+REGRESSION_MIN_SECS = float(os.environ.get("BENCHMARK_MIN_SECS", "0.2"))
+
+
+class Baseline:
+    """BENCHMARK_BASELINE entries and the results of this run"""
+
+    def __init__(self, entries: dict, results: dict):
+        self.entries = entries
+        self.results = results
+
+    def check(self, key: str, cpu: float, wall: float) -> None:
+        """records the result and fails if wall time regressed past the threshold"""
+        self.results[key] = {"cpu": round(cpu, 3), "wall": round(wall, 3)}
+        expected = self.entries.get(key)
+        if os.environ.get("BENCHMARK_UPDATE_BASELINE") or not expected:
+            return
+        limit = max(
+            expected["wall"] * (1 + REGRESSION_THRESHOLD),
+            expected["wall"] + REGRESSION_MIN_SECS,
+        )
+        assert wall <= limit, (
+            f"{key} took {wall:.2f}s, baseline {expected['wall']:.2f}s"
+            f" (limit {limit:.2f}s)"
+        )
+
+
+@pytest.fixture(scope="session")
+def baseline():
+    """stage key -> {"wall": secs, "cpu": secs} from the BENCHMARK_BASELINE file,
+    nothing is compared without one. With BENCHMARK_UPDATE_BASELINE=1 the results
+    of this run are written to it (merged with the stages that did not run)
+    instead of compared"""
+    entries = {}
+    if BASELINE_FILE and os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            entries = json.load(f)
+    results = {}
+    yield Baseline(entries, results)
+    if BASELINE_FILE and results and os.environ.get("BENCHMARK_UPDATE_BASELINE"):
+        with open(BASELINE_FILE, "w") as f:
+            json.dump({**entries, **results}, f, indent=2, sort_keys=True)
+            f.write("\n")
@@ -0,0 +1,67 @@
+import os
+import re
+import subprocess
+
+import pytest
+
+import media_tools
+from module.constants import MP4, WEBM_VP9
+from module.encoding_profiles import encoding_profiles
+
+
+def ssim(ffmpeg, distorted: str, reference: str, reference_filter: str) -> float:
+    """SSIM of distorted against the reference put through the same filter"""
+    result = subprocess.run(
+        [
+            ffmpeg,
+            "-i",
+            distorted,
+            "-i",
+            reference,
+            "-lavfi",
+            f"[1:v]{reference_filter}[ref];[0:v][ref]ssim",
+            "-f",
+            "null",
+            "-",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(re.findall(r"All:([0-9.]+)", result.stderr)[-1])
+
+
+@pytest.mark.parametrize("profile_name", list(encoding_profiles))
+@pytest.mark.parametrize("video_file_type", [MP4, WEBM_VP9], ids=["mp4", "webm"])
+def test_encoding_profile(
+    request, ffmpeg, measure, tmp_path, profile_name, video_file_type
+):
+    # webm renditions are only made from vp9 (vbg) sources
+    fixture_video = request.getfixturevalue(
+        "vbg_video" if video_file_type == WEBM_VP9 else "fixture_video"
+    )
+    renditions = media_tools.get_renditions(
+        fixture_video,
+        str(tmp_path),
+        ["web"],
+        video_file_type,
+        profiles={"web": encoding_profiles[profile_name]},
+    )
+    # the mp4 fallback of webm renditions is covered by the mp4 runs
+    renditions = [r for r in renditions if r.video_mime_type == video_file_type.mime]
+    cpu, wall = measure(
+        lambda: media_tools.video_encode_renditions(fixture_video, renditions)
+    )
+    rendition = renditions[0]
+    size = os.path.getsize(rendition.target_file)
+    score = ssim(
+        ffmpeg,
+        rendition.target_file,
+        fixture_video,
+        media_tools.video_filter_crop_scale(*rendition.crop_scale),
+    )
+    print(
+        f"\n{profile_name} {video_file_type.extension}: {wall:.2f}s wall"
+        f" {cpu:.2f} cpu-secs {size} bytes ssim {score:.4f}"
+    )
+    assert score > 0.9
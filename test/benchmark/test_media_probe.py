@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+import media_tools
+from module.constants import MP4
+
+# the probe-reading helpers each stage calls on the original video, in order
+STAGES = {
+    "answer-upload": lambda f: [
+        media_tools.assert_video_duration(f, 1000),
+    ],
+    "step-trim": lambda f: [
+        media_tools.get_desired_video_file_type(f, True),
+        media_tools.input_output_args_trim_video(0, 5, f, MP4.mime),
+    ],
+    "step-transcode-web": lambda f: [
+        media_tools.get_desired_video_file_type(f, True),
+        media_tools.get_args_video_encode_for_web(f, MP4.mime),
+        media_tools.get_video_metadata(f),
+    ],
+    "step-transcode-mobile": lambda f: [
+        media_tools.get_desired_video_file_type(f, True),
+        media_tools.get_args_video_encode_for_mobile(f, MP4.mime),
+        media_tools.get_video_metadata(f),
+    ],
+    "step-transcribe-start": lambda f: [
+        media_tools.has_audio(f),
+    ],
+}
+
+
+@pytest.mark.parametrize("stage", STAGES.keys())
+def test_probe_parses_per_stage(stage, fixture_video):
+    # every stage is a separate lambda so it starts with a cold cache
+    media_tools.probe_media_cache_clear()
+    start = time.perf_counter()
+    STAGES[stage](fixture_video)
+    elapsed = time.perf_counter() - start
+    info = media_tools.probe_media_cache_info()
+    calls = info.hits + info.misses
+    print(
+        f"\n{stage}: {calls} probes, {info.misses} mediainfo parses, "
+        f"{info.hits} parses saved, {elapsed * 1000:.1f}ms"
+    )
+    assert info.misses == 1
+
+
+def test_probe_invalidated_on_change(fixture_video, tmp_path):
+    copy = tmp_path / "video.mp4"
+    copy.write_bytes(open(fixture_video, "rb").read())
+    first = media_tools.probe_media(str(copy))
+    copy.write_bytes(b"not a video anymore")
+    second = media_tools.probe_media(str(copy))
+    assert first.has_video
+    assert not second.has_video
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+import media_tools
+from module.encoding_profiles import get_encoding_profile
+
+# name -> (size, secs, codec), see the synthetic_clip fixture
+SYNTHETIC_CLIPS = {
+    "h264-360p-3s": ("640x360", 3, "h264"),
+    "h264-720p-3s": ("1280x720", 3, "h264"),
+    "h264-720p-10s": ("1280x720", 10, "h264"),
+    "h264-1080p-2s": ("1920x1080", 2, "h264"),
+    "vp9-alpha-720p-3s": ("1280x720", 3, "vp9-alpha"),
+}
+
+# the default encoder settings are too slow to benchmark every clip,
+# results are kept per profile in the baseline
+PROFILE = get_encoding_profile(os.environ.get("BENCHMARK_PROFILE", "fast"))
+TRANSCRIPT = " ".join(["the quick brown fox jumps over the lazy dog"] * 20)
+
+
+def video_type(clip: str):
+    return media_tools.get_desired_video_file_type(clip, is_vbg_video=True)
+
+
+# stage -> fn(source clip, output dir)
+STAGES = {
+    "video_encode_for_web": lambda clip, out: media_tools.video_encode_for_web(
+        clip,
+        os.path.join(out, f"web.{video_type(clip).extension}"),
+        video_type(clip).mime,
+        profile=PROFILE,
+    ),
+    "video_encode_for_mobile": lambda clip, out: media_tools.video_encode_for_mobile(
+        clip,
+        os.path.join(out, f"mobile.{video_type(clip).extension}"),
+        video_type(clip).mime,
+        profile=PROFILE,
+    ),
+    "video_trim": lambda clip, out: media_tools.video_trim(
+        clip,
+        os.path.join(out, f"trim.{video_type(clip).extension}"),
+        0.5,
+        media_tools.find_duration(clip) - 0.5,
+        video_type(clip),
+        profile=PROFILE,
+    ),
+    "video_to_audio": lambda clip, out: media_tools.video_to_audio(
+        clip, os.path.join(out, "audio.mp3")
+    ),
+    "get_video_metadata": lambda clip, out: media_tools.get_video_metadata(clip),
+    "transcript_to_vtt": lambda clip, out: media_tools.transcript_to_vtt(
+        clip, os.path.join(out, "en.vtt"), TRANSCRIPT
+    ),
+}
+
+
+@pytest.mark.parametrize("clip_name", list(SYNTHETIC_CLIPS))
+@pytest.mark.parametrize("stage", list(STAGES))
+def test_pipeline_stage(stage, clip_name, synthetic_clip, measure, baseline, tmp_path):
+    clip = synthetic_clip(*SYNTHETIC_CLIPS[clip_name])
+    # every stage is a separate lambda so it starts with a cold cache
+    media_tools.probe_media_cache_clear()
+    cpu, wall = measure(lambda: STAGES[stage](clip, str(tmp_path)))
+    key = f"{stage}[{clip_name}]/{PROFILE.name}"
+    print(f"\n{key}: {wall:.2f}s wall {cpu:.2f} cpu-secs")
+    baseline.check(key, cpu, wall)
@@ -0,0 +1,68 @@
+import os
+import subprocess
+
+import pytest
+
+import media_tools
+from module.constants import MP4
+from module.encoding_profiles import FAST
+
+
+@pytest.fixture(scope="module")
+def long_video(tmp_path_factory):
+    """a 60s 720p source with a keyframe every 2s, like phone recordings"""
+    ffmpeg = os.environ["FFMPEG_EXECUTABLE"]
+    video_file = str(tmp_path_factory.mktemp("long") / "long.mp4")
+    subprocess.run(
+        [
+            ffmpeg,
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc2=size=1280x720:rate=30:duration=60",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=frequency=440:duration=60",
+            "-c:v",
+            "libx264",
+            "-preset",
+            "ultrafast",
+            "-g",
+            "60",
+            "-c:a",
+            "aac",
+            video_file,
+        ],
+        check=True,
+    )
+    return video_file
+
+
+@pytest.mark.parametrize("segment_count", [1, 2, 4, 8])
+def test_segmented_encode(
+    fixture_video, ffmpeg, measure, long_video, tmp_path, segment_count
+):
+    renditions = media_tools.get_renditions(
+        long_video,
+        str(tmp_path),
+        ["web", "mobile"],
+        MP4,
+        profiles={"web": FAST, "mobile": FAST},
+    )
+    cpu, wall = measure(
+        lambda: media_tools.video_encode_renditions(
+            long_video, renditions, segment_count=segment_count
+        )
+    )
+    print(
+        f"\n{segment_count} segments on {os.cpu_count()} cpus:"
+        f" {wall:.2f}s wall {cpu:.2f} cpu-secs"
+    )
+    for r in renditions:
+        probe = media_tools.probe_media(r.target_file)
+        assert probe.video_codec == "h264"
+        assert probe.has_audio
+        assert abs(probe.video_duration - 60000) < 100
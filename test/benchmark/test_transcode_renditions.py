@@ -0,0 +1,31 @@
+import os
+
+import media_tools
+from module.constants import MP4
+
+
+def test_combined_vs_separate_encodes(fixture_video, ffmpeg, measure, tmp_path):
+    def separate():
+        media_tools.video_encode_for_web(
+            fixture_video, str(tmp_path / "separate" / "web.mp4"), MP4.mime
+        )
+        media_tools.video_encode_for_mobile(
+            fixture_video, str(tmp_path / "separate" / "mobile.mp4"), MP4.mime
+        )
+
+    renditions = media_tools.get_renditions(
+        fixture_video, str(tmp_path / "combined"), ["web", "mobile"], MP4
+    )
+    separate_cpu, separate_wall = measure(separate)
+    combined_cpu, combined_wall = measure(
+        lambda: media_tools.video_encode_renditions(fixture_video, renditions)
+    )
+    print(
+        f"\nseparate: {separate_cpu:.2f} cpu-secs {separate_wall:.2f}s wall"
+        f"\ncombined: {combined_cpu:.2f} cpu-secs {combined_wall:.2f}s wall"
+    )
+    for r in renditions:
+        separate_file = tmp_path / "separate" / os.path.basename(r.target_file)
+        assert media_tools.find_video_dims(
+            r.target_file
+        ) == media_tools.find_video_dims(str(separate_file))
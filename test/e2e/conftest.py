@@ -0,0 +1,64 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(__file__))
+from harness import ENV  # noqa: E402
+
+# the handlers read their envvars when they are imported
+os.environ.update(ENV)
+os.environ.setdefault("LOG_LEVEL", "INFO")
+
+# outside of lambda the /opt layer does not exist, use local binaries instead
+if not os.path.exists(
+    os.environ.get(
+        "MEDIAINFO_LIB", "/opt/MediaInfo_DLL_21.09_Lambda/lib/libmediainfo.so"
+    )
+):
+    import pymediainfo
+
+    bundled = os.path.join(os.path.dirname(pymediainfo.__file__), "libmediainfo.so.0")
+    if os.path.exists(bundled):
+        os.environ["MEDIAINFO_LIB"] = bundled
+for name, default in [
+    ("FFMPEG_EXECUTABLE", "ffmpeg"),
+    ("FFPROBE_EXECUTABLE", "ffprobe"),
+]:
+    if not os.path.exists(os.environ.get(name, f"/opt/ffmpeg/{default}")):
+        os.environ[name] = shutil.which(default) or default
+
+FIXTURE_VIDEO = "test/integration/fixtures/celery-short.mp4"
+
+
+@pytest.fixture
+def fixture_video():
+    if not os.path.exists(os.environ.get("MEDIAINFO_LIB", "")):
+        pytest.skip("mediainfo library not available")
+    if not shutil.which(os.environ["FFMPEG_EXECUTABLE"]):
+        pytest.skip("ffmpeg not available")
+    return FIXTURE_VIDEO
+
+
+@pytest.fixture
+def graphql(monkeypatch):
+    from harness import GraphQLStub
+
+    stub = GraphQLStub()
+    monkeypatch.setenv("GRAPHQL_ENDPOINT", stub.url)
+    yield stub
+    stub.close()
+
+
+@pytest.fixture
+def pipeline(graphql):
+    """a fresh moto account per test, the handlers are loaded once"""
+    moto = pytest.importorskip("moto")
+    from harness import Pipeline
+
+    with moto.mock_aws():
+        yield Pipeline(
+            graphql,
+            transcribe_job_secs=float(os.environ.get("E2E_TRANSCRIBE_SECS", "0")),
+        )
@@ -0,0 +1,620 @@
+"""Runs the answer upload pipeline in process, without aws or graphql:
+
+- s3 and dynamo are moto (started by conftest before the handlers are imported)
+- LocalStepFunctions runs resources/StepFunctions/AnswerUploadStepFunction.asl.json,
+  its tasks call the lambda handlers directly
+- FakeTranscribe drops a transcript json and vtt into the output bucket
+  and delivers the s3 notifications to step-transcribe-collect
+- GraphQLStub is an http server that keeps upload tasks and answers in memory
+
+Pipeline.upload_answer drives upload-url -> presigned post -> answer-upload
+-> the step function and reports how long every stage took"""
+import importlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import boto3
+import requests
+
+REGION = "us-east-1"
+STATIC_BUCKET = "e2e-static"
+UPLOAD_BUCKET = "e2e-signed-upload"
+TRANSCRIBE_INPUT_BUCKET = "e2e-transcribe-input"
+TRANSCRIBE_OUTPUT_BUCKET = "e2e-transcribe-output"
+CONTENT_INDEX_TABLE = "e2e-content-index"
+STATE_MACHINE_ARN = "arn:aws:states:us-east-1:123456789012:stateMachine:e2e"
+ASL_FILE = "resources/StepFunctions/AnswerUploadStepFunction.asl.json"
+# serverless function name -> handler module
+FUNCTIONS = {
+    "upload_url": "upload-url",
+    "http_answer_upload": "answer-upload",
+    "step_find_content": "step-find-content",
+    "step_trim": "step-trim",
+    "step_transcode": "step-transcode",
+    "step_transcribe_start": "step-transcribe-start",
+    "step_transcribe_collect": "step-transcribe-collect",
+    "step_index_content": "step-index-content",
+    "step_mark_failed": "step-mark-failed",
+}
+# env of the deployed lambdas (see serverless.yml), set before the handlers load
+ENV = {
+    "S3_STATIC_ARN": f"arn:aws:s3:::{STATIC_BUCKET}",
+    "SIGNED_UPLOAD_BUCKET": UPLOAD_BUCKET,
+    "TRANSCRIBE_INPUT_BUCKET": TRANSCRIBE_INPUT_BUCKET,
+    "TRANSCRIBE_OUTPUT_BUCKET": TRANSCRIBE_OUTPUT_BUCKET,
+    "CONTENT_INDEX_TABLE_NAME": CONTENT_INDEX_TABLE,
+    "ANSWER_UPLOAD_STEP_FUNCTION_ARN": STATE_MACHINE_ARN,
+    "REGION": REGION,
+    "AWS_DEFAULT_REGION": REGION,
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+    "STATIC_URL_BASE": "",
+}
+
+
+class GraphQLStub:
+    """The graphql operations the pipeline uses, answered from memory.
+    Operations are recognized by their fields, anything else is an error"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.upload_tasks: Dict[Tuple[str, str], Dict] = {}
+        self.answers: Dict[Tuple[str, str], Dict] = {}
+        self.thumbnails: Dict[str, str] = {}
+        self.question_names: Dict[str, str] = {}
+        self.operations: List[str] = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                result = json.dumps(stub.execute(body["query"], body["variables"]))
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(result.encode())
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/graphql"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def delete_upload_task(self, mentor: str, question: str) -> None:
+        """what the admin client does once every task is done"""
+        with self.lock:
+            self.upload_tasks.pop((mentor, question), None)
+
+    def read(self, field: str, variables: Dict):
+        if field == "mentorCanEdit":
+            return True
+        if field == "question":
+            return {"name": self.question_names.get(variables["id"], "e2e question")}
+        if field == "uploadTask":
+            return self.upload_tasks.get(
+                (variables["mentorId"], variables["questionId"])
+            )
+        raise Exception(f"unsupported query {field}")
+
+    def execute(self, query: str, variables: Dict) -> Dict:
+        operation = re.search(r"(?:query|mutation)\s+(\w+)", query)
+        with self.lock:
+            self.operations.append(operation.group(1) if operation else "")
+            try:
+                return {"data": self.resolve(query, variables)}
+            except Exception as e:
+                return {"errors": [{"message": str(e)}]}
+
+    def resolve(self, query: str, variables: Dict) -> Dict:
+        if query.lstrip().startswith("query"):
+            # batch_gql aliases every read as r<i> and prefixes its variables
+            aliased = re.findall(r"\b(r\d+): (\w+)\(", query)
+            if aliased:
+                return {
+                    alias: self.read(
+                        field,
+                        {
+                            name[len(alias) + 1 :]: value
+                            for name, value in variables.items()
+                            if name.startswith(f"{alias}_")
+                        },
+                    )
+                    for alias, field in aliased
+                }
+            field = re.search(r"\b(\w+)\(", query.split("{", 1)[1]).group(1)
+            return {field: self.read(field, variables)}
+        if "mentorThumbnailUpdate" in query:
+            self.thumbnails[variables["mentorId"]] = variables["thumbnail"]
+            return {"api": {"mentorThumbnailUpdate": True}}
+        key = (variables.get("mentorId"), variables.get("questionId"))
+        api = {}
+        if "uploadAnswer(" in query:
+            self.answers.setdefault(key, {}).update(variables["answer"])
+            api["uploadAnswer"] = True
+        if "uploadTaskUpdate(" in query:
+            self.upload_tasks[key] = {
+                name: value
+                for name, value in variables["status"].items()
+                if value is not None
+            }
+            api["uploadTaskUpdate"] = True
+        if "uploadTaskStatusUpdate(" in query:
+            task = self.upload_tasks.setdefault(key, {})
+            for name, value in variables["uploadTaskStatusInput"].items():
+                if isinstance(value, dict) and name.endswith("Task"):
+                    task.setdefault(name, {}).update(value)
+                else:
+                    task[name] = value
+            api["uploadTaskStatusUpdate"] = True
+        if not api:
+            raise Exception(f"unsupported operation: {query}")
+        return {"api": api}
+
+
+class TaskFailed(Exception):
+    def __init__(self, error: str, cause: str):
+        super().__init__(f"{error}: {cause}")
+        self.error = error
+        self.cause = cause
+
+
+class LocalStepFunctions:
+    """Stand-in for the stepfunctions client the handlers use (start_execution,
+    send_task_success, send_task_failure) that also runs the executions with the
+    parts of the states language the answer upload state machine uses.
+    Retries happen right away, their intervals are not waited"""
+
+    def __init__(
+        self,
+        definition: Dict,
+        invoke: Callable[[str, Any], Any],
+        record: Callable[[str, float, bool], None],
+        task_timeout_secs: float = 300,
+    ):
+        self.definition = definition
+        self.invoke = invoke
+        self.record = record
+        self.task_timeout_secs = task_timeout_secs
+        self.started: List[Dict] = []
+        self.sent_messages: List[Dict] = []
+        self.lock = threading.Lock()
+        self.tokens: Dict[str, Dict] = {}
+
+    def start_execution(self, stateMachineArn, name, input, **kwargs):  # noqa: N803
+        execution = {
+            "executionArn": f"{stateMachineArn.replace(':stateMachine:', ':execution:')}:{name}",
+            "input": json.loads(input),
+        }
+        self.started.append(execution)
+        return {"executionArn": execution["executionArn"], "startDate": time.time()}
+
+    def send_task_success(self, taskToken, output):  # noqa: N803
+        self.resolve_token(taskToken, {"output": json.loads(output)})
+        return {}
+
+    def send_task_failure(self, taskToken, error="", cause=""):  # noqa: N803
+        self.resolve_token(taskToken, {"error": error, "cause": cause})
+        return {}
+
+    def resolve_token(self, token: str, result: Dict) -> None:
+        with self.lock:
+            task = self.tokens.get(token)
+            if task is None or task["done"].is_set():
+                # what stepfunctions answers for a closed task
+                raise TaskFailed("TaskTimedOut", "Task does not exist anymore")
+            task["result"] = result
+            task["done"].set()
+
+    def run(self, execution: Dict) -> Dict:
+        """runs an execution of start_execution to its end,
+        returns its status and output"""
+        context = {"Execution": {"Id": execution["executionArn"]}}
+        try:
+            output = self.run_states(
+                self.definition, copy_json(execution["input"]), context
+            )
+            return {"status": "SUCCEEDED", "output": output}
+        except TaskFailed as e:
+            return {"status": "FAILED", "error": e.error, "cause": e.cause}
+
+    def run_states(self, machine: Dict, data: Any, context: Dict) -> Any:
+        name = machine["StartAt"]
+        while name:
+            state = machine["States"][name]
+            start = time.perf_counter()
+            try:
+                data, next_name = self.run_state(state, data, context)
+            except TaskFailed:
+                self.record(f"state {name}", elapsed(start), False)
+                raise
+            self.record(f"state {name}", elapsed(start), True)
+            name = next_name
+        return data
+
+    def run_state(
+        self, state: Dict, data: Any, context: Dict
+    ) -> Tuple[Any, Optional[str]]:
+        if state["Type"] == "Pass":
+            return data, state.get("Next")
+        if state["Type"] == "Choice":
+            for choice in state["Choices"]:
+                if choice_matches(choice, data):
+                    return data, choice["Next"]
+            return data, state["Default"]
+        try:
+            if state["Type"] == "Task":
+                result = self.with_retries(
+                    state, lambda: self.run_task(state, data, context)
+                )
+            elif state["Type"] == "Parallel":
+                result = self.with_retries(
+                    state, lambda: self.run_parallel(state, data, context)
+                )
+            else:
+                raise Exception(f"unsupported state type {state['Type']}")
+        except TaskFailed as e:
+            for catch in state.get("Catch", []):
+                if matches(catch["ErrorEquals"], e.error):
+                    error = {"Error": e.error, "Cause": e.cause}
+                    return (
+                        set_result(data, catch.get("ResultPath", "$"), error),
+                        catch["Next"],
+                    )
+            raise
+        return set_result(data, state.get("ResultPath", "$"), result), state.get("Next")
+
+    def with_retries(self, state: Dict, run: Callable[[], Any]) -> Any:
+        attempts = 0
+        while True:
+            try:
+                return run()
+            except TaskFailed as e:
+                retry = next(
+                    (
+                        r
+                        for r in state.get("Retry", [])
+                        if matches(r["ErrorEquals"], e.error)
+                    ),
+                    None,
+                )
+                attempts += 1
+                if retry is None or attempts > retry.get("MaxAttempts", 3):
+                    raise
+
+    def run_task(self, state: Dict, data: Any, context: Dict) -> Any:
+        resource = state["Resource"]
+        if resource == "arn:aws:states:::sqs:sendMessage":
+            self.sent_messages.append(parameters(state, data, context))
+            return {}
+        if resource == "arn:aws:states:::lambda:invoke.waitForTaskToken":
+            token = str(uuid.uuid4())
+            task = {"done": threading.Event()}
+            with self.lock:
+                self.tokens[token] = task
+            params = parameters(state, data, {**context, "Task": {"Token": token}})
+            self.call(function_name(params["FunctionName"]), params["Payload"])
+            if not task["done"].wait(
+                state.get("TimeoutSeconds", self.task_timeout_secs)
+            ):
+                raise TaskFailed("States.Timeout", f"no task token for {token}")
+            if "error" in task["result"]:
+                raise TaskFailed(task["result"]["error"], task["result"]["cause"])
+            return task["result"]["output"]
+        return self.call(function_name(resource), parameters(state, data, context))
+
+    def call(self, function: str, payload: Any) -> Any:
+        try:
+            return self.invoke(function, payload)
+        except Exception as e:
+            raise TaskFailed(type(e).__name__, json.dumps({"errorMessage": str(e)}))
+
+    def run_parallel(self, state: Dict, data: Any, context: Dict) -> List:
+        branch_input = parameters(state, data, context)
+        with ThreadPoolExecutor(max_workers=len(state["Branches"])) as executor:
+            futures = [
+                executor.submit(
+                    self.run_states, branch, copy_json(branch_input), context
+                )
+                for branch in state["Branches"]
+            ]
+            return [future.result() for future in futures]
+
+
+class FakeTranscribe:
+    """Stand-in for the transcribe client: start_transcription_job checks the
+    media exists and, in a thread like the real (asynchronous) job, writes
+    <OutputKey> and its vtt into the output bucket, then delivers their
+    s3 notifications (the .json and .vtt rules of step_transcribe_collect)"""
+
+    def __init__(
+        self,
+        s3,
+        notify: Callable[[str, str], None],
+        transcript: str = "this is the fake transcript of an answer",
+        job_secs: float = 0.0,
+    ):
+        self.s3 = s3
+        self.notify = notify
+        self.transcript = transcript
+        self.job_secs = job_secs
+        self.jobs: List[Dict] = []
+        self.threads: List[threading.Thread] = []
+
+    def start_transcription_job(self, **job):
+        self.jobs.append(job)
+        thread = threading.Thread(target=self.complete, args=(job,))
+        thread.start()
+        self.threads.append(thread)
+        return {
+            "TranscriptionJob": {
+                "TranscriptionJobName": job["TranscriptionJobName"],
+                "TranscriptionJobStatus": "IN_PROGRESS",
+            }
+        }
+
+    def complete(self, job: Dict) -> None:
+        # https://s3.<region>.amazonaws.com/<bucket>/<key>
+        bucket, key = job["Media"]["MediaFileUri"].split("/", 4)[3:]
+        self.s3.head_object(Bucket=bucket, Key=key)
+        time.sleep(self.job_secs)
+        json_key = job["OutputKey"]
+        vtt_key = f"{os.path.splitext(json_key)[0]}.vtt"
+        self.s3.put_object(
+            Bucket=job["OutputBucketName"],
+            Key=json_key,
+            Body=json.dumps(
+                {
+                    "jobName": job["TranscriptionJobName"],
+                    "status": "COMPLETED",
+                    "results": {"transcripts": [{"transcript": self.transcript}]},
+                }
+            ),
+        )
+        self.s3.put_object(
+            Bucket=job["OutputBucketName"],
+            Key=vtt_key,
+            Body=f"WEBVTT\n\n1\n00:00:00.000 --> 00:00:02.000\n{self.transcript}\n",
+        )
+        for created in [json_key, vtt_key]:
+            self.notify(job["OutputBucketName"], created)
+
+    def wait(self) -> None:
+        for thread in self.threads:
+            thread.join()
+
+
+@dataclass
+class Timing:
+    stage: str
+    secs: float
+    ok: bool
+
+
+@dataclass
+class Report:
+    e2e_secs: float = 0.0
+    status: str = ""
+    response: Dict = field(default_factory=dict)
+    timings: List[Timing] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+
+    def format(self) -> str:
+        lines = [f"end to end: {self.e2e_secs:.2f}s ({self.status})"]
+        lines.extend(
+            f"  {t.stage:<40} {t.secs:8.2f}s{'' if t.ok else ' FAILED'}"
+            for t in self.timings
+        )
+        lines.extend(f"  error: {e}" for e in self.errors)
+        return "\n".join(lines)
+
+
+class Pipeline:
+    """Creates the buckets and the content index table, loads the handlers
+    and replaces their stepfunctions and transcribe clients with the stand-ins"""
+
+    def __init__(self, graphql: GraphQLStub, transcribe_job_secs: float = 0.0):
+        self.graphql = graphql
+        self.s3 = boto3.client("s3", region_name=REGION)
+        for bucket in [
+            STATIC_BUCKET,
+            UPLOAD_BUCKET,
+            TRANSCRIBE_INPUT_BUCKET,
+            TRANSCRIBE_OUTPUT_BUCKET,
+        ]:
+            self.s3.create_bucket(Bucket=bucket)
+        boto3.client("dynamodb", region_name=REGION).create_table(
+            TableName=CONTENT_INDEX_TABLE,
+            KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "id", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        self.handlers = {
+            function: importlib.import_module(module)
+            for function, module in FUNCTIONS.items()
+        }
+        self.report = Report()
+        with open(ASL_FILE) as f:
+            definition = json.load(f)
+        self.sfn = LocalStepFunctions(definition, self.invoke, self.record)
+        self.transcribe = FakeTranscribe(
+            self.s3, self.notify, job_secs=transcribe_job_secs
+        )
+        for handler in self.handlers.values():
+            if hasattr(handler, "sfn_client"):
+                handler.sfn_client = self.sfn
+            if hasattr(handler, "transcribe"):
+                handler.transcribe = self.transcribe
+
+    def record(self, stage: str, secs: float, ok: bool) -> None:
+        self.report.timings.append(Timing(stage, secs, ok))
+
+    def invoke(self, function: str, event: Any) -> Any:
+        """a lambda invocation: json in, json out"""
+        start = time.perf_counter()
+        try:
+            result = self.handlers[function].handler(copy_json(event), None)
+            self.record(f"lambda {function}", elapsed(start), True)
+            return copy_json(result)
+        except Exception as e:
+            self.record(f"lambda {function}", elapsed(start), False)
+            self.report.errors.append(f"{function}: {e}")
+            raise
+
+    def notify(self, bucket: str, key: str) -> None:
+        """s3:ObjectCreated notifications of the transcribe output bucket"""
+        if bucket != TRANSCRIBE_OUTPUT_BUCKET or not key.endswith((".json", ".vtt")):
+            return
+        try:
+            self.invoke(
+                "step_transcribe_collect",
+                {
+                    "Records": [
+                        {"s3": {"bucket": {"name": bucket}, "object": {"key": key}}}
+                    ]
+                },
+            )
+        except Exception:
+            # an async invocation, the step function times out if nobody sends the token
+            pass
+
+    def upload_answer(
+        self, video_file: str, mentor: str, question: str, **options
+    ) -> Report:
+        """uploads video_file the way the admin client does and runs every
+        step function execution that started, options go to answer-upload"""
+        self.report = Report()
+        start = time.perf_counter()
+        token = {"id": mentor, "role": "ADMIN", "mentorIds": [mentor]}
+        presigned = json.loads(
+            self.invoke(
+                "upload_url",
+                {"requestContext": {"authorizer": {"token": json.dumps(token)}}},
+            )["body"]
+        )["data"]
+        upload_start = time.perf_counter()
+        with open(video_file, "rb") as f:
+            response = requests.post(
+                presigned["url"], data=presigned["fields"], files={"file": f}
+            )
+        response.raise_for_status()
+        self.record("presigned post", elapsed(upload_start), True)
+        self.report.response = self.invoke(
+            "http_answer_upload",
+            {
+                "headers": {"Authorization": "Bearer e2e"},
+                "isBase64Encoded": False,
+                "body": json.dumps(
+                    {
+                        "mentor": mentor,
+                        "question": question,
+                        "video": presigned["fields"]["key"],
+                        **options,
+                    }
+                ),
+            },
+        )
+        self.report.status = "NO EXECUTION"
+        while self.sfn.started:
+            result = self.sfn.run(self.sfn.started.pop(0))
+            self.report.status = result["status"]
+            if result["status"] != "SUCCEEDED":
+                self.report.errors.append(f"{result['error']}: {result['cause']}")
+        self.transcribe.wait()
+        self.report.e2e_secs = elapsed(start)
+        return self.report
+
+
+def copy_json(value: Any) -> Any:
+    return json.loads(json.dumps(value, default=str))
+
+
+def elapsed(start: float) -> float:
+    return time.perf_counter() - start
+
+
+def function_name(resource: str) -> str:
+    # arn:...:function:${self:service}-${self:provider.stage}-step_trim
+    return resource.rsplit("-", 1)[-1]
+
+
+def matches(error_equals: List[str], error: str) -> bool:
+    return (
+        "States.ALL" in error_equals
+        or error in error_equals
+        or ("States.TaskFailed" in error_equals and not error.startswith("States."))
+    )
+
+
+def path_keys(path: str) -> List[str]:
+    return [key for key in path.lstrip("$").split(".") if key]
+
+
+def has_path(data: Any, path: str) -> bool:
+    for key in path_keys(path):
+        if not isinstance(data, dict) or key not in data:
+            return False
+        data = data[key]
+    return True
+
+
+def choice_matches(choice: Dict, data: Any) -> bool:
+    if "BooleanEquals" in choice:
+        # like the real one, fails when the variable is missing
+        return get_path(data, choice["Variable"]) == choice["BooleanEquals"]
+    return has_path(data, choice["Variable"]) == choice["IsPresent"]
+
+
+def get_path(data: Any, path: str) -> Any:
+    for key in path_keys(path):
+        data = data[key]
+    return data
+
+
+def set_result(data: Any, result_path: Optional[str], result: Any) -> Any:
+    if result_path is None:
+        return data
+    keys = path_keys(result_path)
+    if not keys:
+        return result
+    target = data
+    for key in keys[:-1]:
+        target = target.setdefault(key, {})
+    target[keys[-1]] = result
+    return data
+
+
+def parameters(state: Dict, data: Any, context: Dict) -> Any:
+    """the state's Parameters with their .$ paths resolved
+    ($$. paths are in the context object), the input without Parameters"""
+    if "Parameters" not in state:
+        return data
+
+    def resolve(template: Any) -> Any:
+        if not isinstance(template, dict):
+            return template
+        resolved = {}
+        for key, value in template.items():
+            if key.endswith(".$"):
+                resolved[key[:-2]] = (
+                    get_path(context, value[1:])
+                    if value.startswith("$$")
+                    else get_path(data, value)
+                )
+            else:
+                resolved[key] = resolve(value)
+        return resolved
+
+    return resolve(state["Parameters"])
@@ -0,0 +1,97 @@
+import json
+import os
+import struct
+
+from harness import STATIC_BUCKET
+
+MENTOR = "e2e-mentor"
+QUESTION = "e2e-question"
+# the default profile takes minutes on a small machine
+OPTIONS = (
+    {"encodingProfile": os.environ["E2E_PROFILE"]}
+    if os.environ.get("E2E_PROFILE")
+    else {}
+)
+
+
+def static_keys(pipeline) -> set:
+    objects = pipeline.s3.list_objects_v2(Bucket=STATIC_BUCKET).get("Contents", [])
+    return {o["Key"] for o in objects}
+
+
+def mp4_top_level_boxes(data: bytes) -> list:
+    boxes = []
+    offset = 0
+    while offset + 8 <= len(data):
+        size, box = struct.unpack(">I4s", data[offset : offset + 8])
+        if size == 1:
+            size = struct.unpack(">Q", data[offset + 8 : offset + 16])[0]
+        boxes.append(box.decode())
+        if size == 0:
+            break
+        offset += size
+    return boxes
+
+
+def test_trimmed_upload_is_transcoded_and_transcribed(pipeline, fixture_video):
+    report = pipeline.upload_answer(
+        fixture_video, MENTOR, QUESTION, trim={"start": 1, "end": 8}, **OPTIONS
+    )
+    print(f"\n{report.format()}")
+    assert report.response["statusCode"] == 200
+    assert report.status == "SUCCEEDED", report.errors
+    task = pipeline.graphql.upload_tasks[(MENTOR, QUESTION)]
+    for name in [
+        "trimUploadTask",
+        "transcodeWebTask",
+        "transcodeMobileTask",
+        "transcribeTask",
+    ]:
+        assert task[name]["status"] == "DONE", name
+    answer = pipeline.graphql.answers[(MENTOR, QUESTION)]
+    assert answer["transcript"] == pipeline.transcribe.transcript
+    assert {
+        f"videos/{MENTOR}/{QUESTION}/{name}"
+        for name in [
+            "original.mp4",
+            "original.mediainfo.json",
+            "web.mp4",
+            "mobile.mp4",
+            "en.vtt",
+        ]
+    } <= static_keys(pipeline)
+    # renditions are faststart mp4 unless STREAM_RENDITION_UPLOADS is on
+    web = pipeline.s3.get_object(
+        Bucket=STATIC_BUCKET, Key=f"videos/{MENTOR}/{QUESTION}/web.mp4"
+    )["Body"].read()
+    boxes = mp4_top_level_boxes(web)
+    assert boxes.index("moov") < boxes.index("mdat")
+    assert ("moof" in boxes) == (
+        os.environ.get("STREAM_RENDITION_UPLOADS", "false").lower() == "true"
+    )
+    metadata = json.loads(answer["webMedia"]["stringMetadata"])
+    assert (
+        metadata["mediainfoKey"]
+        == f"videos/{MENTOR}/{QUESTION}/original.mediainfo.json"
+    )
+
+
+def test_reupload_reuses_processed_media(pipeline, fixture_video):
+    first = pipeline.upload_answer(fixture_video, MENTOR, QUESTION, **OPTIONS)
+    print(f"\n{first.format()}")
+    assert first.status == "SUCCEEDED", first.errors
+    pipeline.graphql.delete_upload_task(MENTOR, QUESTION)
+    second = pipeline.upload_answer(fixture_video, MENTOR, "e2e-question-2", **OPTIONS)
+    print(f"\n{second.format()}")
+    # found in the content index by the first state, nothing else runs
+    assert second.status == "SUCCEEDED", second.errors
+    stages = {t.stage for t in second.timings}
+    assert "lambda step_find_content" in stages
+    assert "lambda step_transcode" not in stages
+    task = pipeline.graphql.upload_tasks[(MENTOR, "e2e-question-2")]
+    assert task["transcodeWebTask"]["status"] == "DONE"
+    assert second.e2e_secs < first.e2e_secs
+    answer = pipeline.graphql.answers[(MENTOR, "e2e-question-2")]
+    metadata = json.loads(answer["mobileMedia"]["stringMetadata"])
+    assert metadata["mediainfoKey"] in static_keys(pipeline)
+    assert "e2e-question-2" in metadata["mediainfoKey"]
@@ -0,0 +1,131 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from module import api, http_client
+from module.api import (
+    FetchUploadTaskReq,
+    UpdateTaskStatusRequest,
+    batch_gql,
+    batch_gql_query,
+    question_name_read,
+    upload_in_progress_read,
+    upload_task_status_update,
+    user_can_edit_mentor_read,
+)
+
+
+def test_batch_gql_query_aliases_reads_and_their_variables():
+    query = batch_gql_query(
+        [
+            user_can_edit_mentor_read("m1"),
+            upload_in_progress_read(FetchUploadTaskReq("m1", "q1")),
+        ]
+    )
+    assert query["query"].startswith(
+        "query MentorCanEdit_UploadTask($r0_mentor: ID!, $r1_mentorId: ID!, $r1_questionId: ID!)"
+    )
+    assert "r0: mentorCanEdit(mentor: $r0_mentor)" in query["query"]
+    assert (
+        "r1: uploadTask(mentorId: $r1_mentorId, questionId: $r1_questionId)"
+        in query["query"]
+    )
+    assert query["variables"] == {
+        "r0_mentor": "m1",
+        "r1_mentorId": "m1",
+        "r1_questionId": "q1",
+    }
+
+
+@pytest.mark.parametrize(
+    "tdjson",
+    [
+        {"data": {"r0": True, "r1": None}},
+        {
+            "data": {"r0": True, "r1": None},
+            "errors": [{"message": "question not found", "path": ["r1"]}],
+        },
+    ],
+)
+def test_batch_gql_optional_reads_may_be_missing(monkeypatch, tdjson):
+    monkeypatch.setattr(api, "__auth_gql", lambda query, headers: tdjson)
+    reads = [user_can_edit_mentor_read("m1"), question_name_read("q1", optional=True)]
+    assert batch_gql(reads) == [True, None]
+    with pytest.raises(Exception):
+        batch_gql([user_can_edit_mentor_read("m1"), question_name_read("q1")])
+
+
+@pytest.fixture
+def apq_server(monkeypatch):
+    """graphql that answers every query with {"data": {}} and
+    supports automatic persisted queries, server.bodies are the posts"""
+    monkeypatch.setattr(http_client, "session", http_client.create_session())
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            httpd.bodies.append(body)
+            query_hash = body["extensions"]["persistedQuery"]["sha256Hash"]
+            if "query" in body:
+                httpd.persisted[query_hash] = body["query"]
+            if query_hash in httpd.persisted:
+                result = {"data": {}}
+            else:
+                result = {
+                    "errors": [
+                        {
+                            "message": "PersistedQueryNotFound",
+                            "extensions": {"code": "PERSISTED_QUERY_NOT_FOUND"},
+                        }
+                    ]
+                }
+            response = json.dumps(result).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.bodies = []
+    httpd.persisted = {}
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    monkeypatch.setenv("GRAPHQL_ENDPOINT", f"http://127.0.0.1:{httpd.server_port}")
+    monkeypatch.setenv("GRAPHQL_PERSISTED_QUERIES", "true")
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_persisted_queries_send_the_full_query_once(apq_server):
+    req = UpdateTaskStatusRequest(
+        mentor="m1", question="q1", transcode_web_task={"status": "DONE"}
+    )
+    upload_task_status_update(req)
+    upload_task_status_update(req)
+    assert ["query" in body for body in apq_server.bodies] == [False, True, False]
+    assert apq_server.bodies[0]["variables"] == apq_server.bodies[2]["variables"]
+
+
+def test_persisted_query_hashes_are_precomputed():
+    queries = [
+        api.upload_task_status_req_gql(
+            UpdateTaskStatusRequest(mentor="m1", question="q1")
+        )["query"],
+        api.fetch_task_gql("m1", "q1")["query"],
+        batch_gql_query(
+            [
+                user_can_edit_mentor_read("m1"),
+                upload_in_progress_read(FetchUploadTaskReq("m1", "q1")),
+            ]
+        )["query"],
+        batch_gql_query(
+            [api.upload_task_read("m1", "q1"), question_name_read("q1", optional=True)]
+        )["query"],
+    ]
+    for query in queries:
+        assert api.persisted_query_hashes[query] == api.persisted_query_hash(query)
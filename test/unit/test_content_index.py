@@ -0,0 +1,100 @@
+from botocore.exceptions import ClientError
+
+from module.content_index import (
+    LocalContentIndex,
+    content_index_key,
+    content_index_options,
+    find_current_entry,
+    get_artifacts,
+)
+
+
+class FakeS3Client:
+    def __init__(self, objects):
+        self.objects = objects
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {
+            "ETag": self.objects[Key],
+            "ContentType": "video/mp4",
+            "ContentLength": 10,
+        }
+
+    def list_objects_v2(self, Bucket, Prefix, ContinuationToken="0"):
+        # one key per page
+        keys = sorted(k for k in self.objects if k.startswith(Prefix))
+        page = int(ContinuationToken)
+        return {
+            "Contents": [{"Key": k, "ETag": self.objects[k]} for k in keys][
+                page : page + 1
+            ],
+            "IsTruncated": page + 1 < len(keys),
+            "NextContinuationToken": str(page + 1),
+        }
+
+
+def test_key_depends_on_options_not_their_order():
+    options = {"trim": {"start": 1, "end": 2}, "isVbgVideo": False}
+    assert content_index_key("abc", options) == content_index_key(
+        "abc", dict(reversed(options.items()))
+    )
+    assert content_index_key("abc", options) != content_index_key(
+        "abc", {**options, "isVbgVideo": True}
+    )
+    assert content_index_key("abc", options).startswith("abc-")
+
+
+def test_local_index_round_trip(tmp_path):
+    index = LocalContentIndex(str(tmp_path / "index.json"))
+    assert index.get("k") is None
+    index.put("k", {"s3Path": "videos/m/q"})
+    assert LocalContentIndex(str(tmp_path / "index.json")).get("k") == {
+        "s3Path": "videos/m/q"
+    }
+
+
+def test_entry_is_only_current_while_artifacts_are_unchanged(tmp_path):
+    index = LocalContentIndex(str(tmp_path / "index.json"))
+    index.put("k", {"artifacts": {"videos/m/q/web.mp4": '"etag-1"'}})
+    s3 = FakeS3Client({"videos/m/q/web.mp4": '"etag-1"'})
+    entry = find_current_entry(s3, "bucket", index, "k")
+    assert entry["objects"] == {
+        "videos/m/q/web.mp4": {"contentType": "video/mp4", "size": 10}
+    }
+    s3.objects["videos/m/q/web.mp4"] = '"etag-2"'
+    assert find_current_entry(s3, "bucket", index, "k") is None
+    s3.objects.clear()
+    assert find_current_entry(s3, "bucket", index, "k") is None
+
+
+def test_options_are_none_when_outputs_are_not_reusable():
+    request = {
+        "maintain_original_aspect_ratio": False,
+        "isVbgVideo": False,
+        "transcribeTask": {"task_name": "transcribing"},
+        "generate_thumbnail": False,
+    }
+    options = content_index_options(request)
+    assert options["trim"] is None
+    assert set(options["encodingProfile"]) == {"trim", "web", "mobile"}
+    assert content_index_options({**request, "generate_thumbnail": True}) is None
+    # an edited transcript has no transcribe task
+    assert content_index_options({**request, "transcribeTask": None}) is None
+
+
+def test_artifacts_are_listed_across_pages():
+    s3 = FakeS3Client(
+        {
+            "videos/m/q/web.mp4": '"etag-1"',
+            "videos/m/q/mobile.mp4": '"etag-2"',
+            "videos/m/q/en.vtt": '"etag-3"',
+            "videos/m/q2/web.mp4": '"etag-4"',
+        }
+    )
+    assert get_artifacts(s3, "bucket", "videos/m/q") == {
+        "videos/m/q/web.mp4": '"etag-1"',
+        "videos/m/q/mobile.mp4": '"etag-2"',
+        "videos/m/q/en.vtt": '"etag-3"',
+    }
@@ -0,0 +1,14 @@
+from module.encoding_profiles import ARCHIVAL, BALANCED
+
+
+def test_archival_keeps_the_original_encoder_args():
+    assert ARCHIVAL.x264_args() == ("-c:v", "libx264", "-crf", "10")
+    assert ARCHIVAL.vp9_args() == ("-c:v", "libvpx-vp9", "-crf", "10")
+
+
+def test_vp9_constant_quality_and_threading():
+    args = BALANCED.vp9_args()
+    assert args[args.index("-b:v") + 1] == "0"
+    assert args[args.index("-row-mt") + 1] == "1"
+    assert args[args.index("-tile-columns") + 1] == "2"
+    assert int(args[args.index("-threads") + 1]) >= 1
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from module import transfer
+from module.fan_out import FanOutExecutor
+
+
+def test_fan_out_bounds_concurrency_and_collects_errors():
+    lock = threading.Lock()
+    running = [0, 0]  # now, max
+
+    def work(i):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        if i % 5 == 0:
+            raise ValueError("failed")
+        return i
+
+    with FanOutExecutor(concurrency=4) as executor:
+        result = asyncio.run(executor.fan_out(work, range(20), lambda i: f"item {i}"))
+    assert running[1] == 4
+    assert result.results == [i for i in range(20) if i % 5]
+    assert result.errors == [f"item {i}: failed" for i in range(0, 20, 5)]
+
+
+class FakeS3Client:
+    def __init__(self):
+        self.uploads = []
+
+    def upload_file(self, file_path, bucket, key, ExtraArgs):
+        self.uploads.append(key)
+
+
+def test_transfer_answers_aggregates_errors(tmp_path, monkeypatch):
+    updates = []
+    monkeypatch.setattr(
+        transfer, "update_answers_gql", lambda req, headers: updates.append(req)
+    )
+    video = tmp_path / "web.mp4"
+    video.write_bytes(b"video")
+    answers = [
+        {
+            "question": {"_id": f"q{i}"},
+            "media": [
+                {"type": "video", "tag": "web", "needsTransfer": True, "url": url}
+            ],
+        }
+        for i, url in enumerate([video.as_uri(), (tmp_path / "missing.mp4").as_uri()])
+    ]
+    s3 = FakeS3Client()
+    with FanOutExecutor(concurrency=2) as executor:
+        result = asyncio.run(
+            transfer.transfer_answers(answers, "m", s3, "bucket", {}, executor)
+        )
+    assert s3.uploads == ["videos/m/q0/web.mp4"]
+    assert len(updates) == 1 and updates[0].answers[0]["questionId"] == "q0"
+    assert len(result.errors) == 1 and "missing.mp4" in result.errors[0]
+
+
+def test_transfer_answers_raises_when_an_update_fails(monkeypatch):
+    def fail(req, headers):
+        raise Exception("graphql is down")
+
+    monkeypatch.setattr(transfer, "update_answers_gql", fail)
+    monkeypatch.setattr(
+        transfer,
+        "transfer_mentor_videos_in_parellel",
+        lambda answer, mentor, s3_client, s3_bucket: ([{"questionId": "q0"}], []),
+    )
+    with FanOutExecutor(concurrency=2) as executor:
+        with pytest.raises(Exception, match="graphql is down"):
+            asyncio.run(
+                transfer.transfer_answers([{}], "m", None, "bucket", {}, executor)
+            )
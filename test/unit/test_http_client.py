@@ -0,0 +1,120 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from urllib3.exceptions import (
+    ConnectTimeoutError,
+    MaxRetryError,
+    NewConnectionError,
+    ReadTimeoutError,
+)
+
+from module import http_client
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """answers every post with the next status of server.statuses (200 when empty)"""
+    monkeypatch.setattr(http_client, "RETRY_BACKOFF_SECS", 0)
+    monkeypatch.setattr(http_client, "session", http_client.create_session())
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            httpd.requests += 1
+            status = httpd.statuses.pop(0) if httpd.statuses else 200
+            body = json.dumps({"data": {}}).encode()
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.requests = 0
+    httpd.statuses = []
+    httpd.url = f"http://127.0.0.1:{httpd.server_port}/graphql"
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_reuses_connections(server):
+    before = dict(http_client.connection_stats)
+    for _ in range(3):
+        http_client.post(server.url, {"query": "query Q {}"}, {}, idempotent=True)
+    assert http_client.connection_stats["new"] - before["new"] == 1
+    assert http_client.connection_stats["reused"] - before["reused"] == 2
+
+
+def test_retries_idempotent_requests(server):
+    server.statuses = [503, 502]
+    res = http_client.post(server.url, {"query": "query Q {}"}, {}, idempotent=True)
+    assert res.status_code == 200
+    assert server.requests == 3
+
+
+def test_does_not_retry_sent_mutations(server):
+    server.statuses = [503]
+    res = http_client.post(server.url, {"query": "mutation M {}"}, {}, idempotent=False)
+    assert res.status_code == 503
+    assert server.requests == 1
+
+
+def test_retries_failed_connections(server, monkeypatch):
+    retries = []
+    monkeypatch.setattr(http_client, "_backoff", lambda attempt: retries.append(0) or 0)
+    port = server.server_port
+    server.shutdown()
+    server.server_close()
+    with pytest.raises(requests.exceptions.ConnectionError):
+        http_client.post(
+            f"http://127.0.0.1:{port}/graphql",
+            {"query": "mutation M {}"},
+            {},
+            idempotent=False,
+        )
+    assert len(retries) == http_client.RETRIES
+
+
+@pytest.mark.parametrize(
+    "reason,sent",
+    [
+        (ConnectTimeoutError("connect timed out"), False),
+        (NewConnectionError(None, "connection refused"), False),
+        (ReadTimeoutError(None, "/graphql", "read timed out"), True),
+    ],
+)
+def test_was_sent(reason, sent):
+    e = requests.exceptions.ConnectionError(MaxRetryError(None, "/graphql", reason))
+    assert http_client._was_sent(e) == sent
+
+
+def test_read_timeout(server, monkeypatch):
+    timeouts = []
+    post = http_client.session.post
+    monkeypatch.setattr(
+        http_client.session,
+        "post",
+        lambda *args, **kwargs: timeouts.append(kwargs["timeout"])
+        or post(*args, **kwargs),
+    )
+    http_client.post(server.url, {"query": "query Q {}"}, {}, idempotent=True)
+    http_client.post(
+        server.url,
+        {"query": "mutation M {}"},
+        {},
+        idempotent=False,
+        read_timeout_secs=http_client.BULK_READ_TIMEOUT_SECS,
+    )
+    assert [t[1] for t in timeouts] == [
+        http_client.READ_TIMEOUT_SECS,
+        http_client.BULK_READ_TIMEOUT_SECS,
+    ]
@@ -0,0 +1,66 @@
+import json
+import logging
+
+import pytest
+
+from module import logger
+
+
+@pytest.fixture
+def records(monkeypatch):
+    records = []
+    monkeypatch.setattr(logger.metrics_log, "handle", records.append)
+    monkeypatch.setattr(logger, "metric_dimensions", {"Handler": "step-transcode"})
+    return records
+
+
+def format_json(record) -> dict:
+    return json.loads(logger.JSONFormatter().format(record))
+
+
+def test_json_formatter_formats_args():
+    record = logging.makeLogRecord(
+        {"msg": "%s downloaded to %s", "args": ("a.mp4", "/tmp"), "levelname": "INFO"}
+    )
+    assert format_json(record)["message"] == "a.mp4 downloaded to /tmp"
+
+
+def test_json_formatter_masks_authorization():
+    record = logging.makeLogRecord(
+        {
+            "msg": {"headers": {"Authorization": "Bearer 1234567890"}},
+            "levelname": "INFO",
+        }
+    )
+    assert format_json(record)["message"]["headers"]["Authorization"] == "Bearer 1..."
+
+
+def test_span_emits_embedded_metrics(records):
+    logger.set_metric_dimensions(**logger.video_metric_dimensions(90.0, 1280, 720))
+    with logger.span("download") as s:
+        s.add_bytes(100)
+        s.add_bytes(20)
+    doc = format_json(records[0])
+    metrics = doc["_aws"]["CloudWatchMetrics"][0]
+    assert metrics["Dimensions"] == [
+        ["Stage"],
+        ["Handler", "Outcome", "Resolution", "Stage", "VideoDuration"],
+    ]
+    assert {m["Name"]: m["Unit"] for m in metrics["Metrics"]} == {
+        "Bytes": "Bytes",
+        "Duration": "Milliseconds",
+    }
+    assert doc["Bytes"] == 120
+    assert doc["Duration"] >= 0
+    assert (doc["Stage"], doc["Outcome"], doc["VideoDuration"]) == (
+        "download",
+        "ok",
+        "1-5m",
+    )
+
+
+def test_span_records_errors(records):
+    with pytest.raises(ValueError):
+        with logger.span("encode"):
+            raise ValueError("ffmpeg failed")
+    assert format_json(records[0])["Outcome"] == "error"
@@ -0,0 +1,250 @@
+import os
+import threading
+import time
+
+import pytest
+
+import media_tools
+from module.constants import MP4, WEBM_VP9
+
+KEYFRAMES = [0.0, 2.0, 4.0, 6.0, 8.0]
+
+
+@pytest.fixture
+def h264_mp4(monkeypatch):
+    monkeypatch.setattr(media_tools, "get_file_mime", lambda f: "video/mp4")
+    monkeypatch.setattr(media_tools, "get_video_encoding_type", lambda f: "h264")
+
+
+@pytest.mark.parametrize(
+    "start,end,expected",
+    [
+        (0, 7.5, "copy"),
+        (4.01, 7.5, "copy"),
+        (3.0, 9.0, "smart"),
+        (4.5, 5.5, "reencode"),
+        (8.5, 9.5, "reencode"),
+    ],
+)
+def test_trim_mode(h264_mp4, start, end, expected):
+    assert media_tools.get_trim_mode("f", start, end, MP4, KEYFRAMES) == expected
+
+
+def test_trim_mode_reencodes_without_keyframes(h264_mp4):
+    assert media_tools.get_trim_mode("f", 0, 7.5, MP4, []) == "reencode"
+
+
+def test_trim_mode_reencodes_other_codecs(h264_mp4):
+    assert media_tools.get_trim_mode("f", 0, 7.5, WEBM_VP9, KEYFRAMES) == "reencode"
+
+
+@pytest.mark.parametrize(
+    "container,audio_codec,expected",
+    [
+        ("MPEG-4", "AAC", "mp4"),
+        ("WebM", "Opus", "webm"),
+        ("WebM", "Vorbis", None),
+        ("QuickTime", "PCM", None),
+    ],
+)
+def test_transcribe_media_format(container, audio_codec, expected):
+    probe = media_tools.MediaProbe(
+        path="f", size=1, mtime_ns=1, container=container, audio_codec=audio_codec
+    )
+    assert media_tools.get_transcribe_media_format(probe) == expected
+
+
+def test_parse_ffmpeg_progress():
+    lines = [
+        "frame=0\n",
+        "fps=0.00\n",
+        "out_time_us=N/A\n",
+        "total_size=N/A\n",
+        "speed=N/A\n",
+        "progress=continue\n",
+        "frame=45\n",
+        "fps=29.97\n",
+        "out_time_us=1500000\n",
+        "out_time=00:00:01.500000\n",
+        "total_size=262192\n",
+        "speed=1.02x\n",
+        "progress=end\n",
+    ]
+    assert list(media_tools.parse_ffmpeg_progress(lines)) == [
+        media_tools.FFmpegProgress(),
+        media_tools.FFmpegProgress(
+            frame=45,
+            fps=29.97,
+            speed=1.02,
+            out_time_secs=1.5,
+            total_size=262192,
+            done=True,
+        ),
+    ]
+
+
+def test_sum_ffmpeg_progress():
+    total = media_tools.sum_ffmpeg_progress(
+        [
+            media_tools.FFmpegProgress(frame=10, out_time_secs=1.0, done=True),
+            media_tools.FFmpegProgress(frame=20, out_time_secs=2.0),
+        ]
+    )
+    assert (total.frame, total.out_time_secs, total.done) == (30, 3.0, False)
+
+
+def test_throttle_progress(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(media_tools.time, "monotonic", lambda: now[0])
+    reported = []
+    report = media_tools.throttle_progress(reported.append, 10)
+    for secs, frame in [(0, 1), (5, 2), (10, 3), (15, 4), (21, 5)]:
+        now[0] = 100.0 + secs
+        report(media_tools.FFmpegProgress(frame=frame))
+    assert [p.frame for p in reported] == [1, 3, 5]
+
+
+def test_background_progress_keeps_the_reader_moving():
+    release = threading.Event()
+    reported = []
+
+    def slow_report(progress):
+        release.wait(5)
+        reported.append(progress.frame)
+
+    with media_tools.BackgroundProgress(slow_report) as report:
+        started = time.monotonic()
+        for frame in range(1, 6):
+            report(media_tools.FFmpegProgress(frame=frame))
+        assert time.monotonic() - started < 1
+        release.set()
+    # the first report was running, only the latest of the others waited
+    # (and closing may drop it)
+    assert reported in ([1], [1, 5])
+    report(media_tools.FFmpegProgress(frame=6))
+    assert 6 not in reported
+
+
+def test_background_progress_logs_failures():
+    def fail(progress):
+        raise Exception("graphql is down")
+
+    with media_tools.BackgroundProgress(fail) as report:
+        report(media_tools.FFmpegProgress(frame=1))
+
+
+def test_compact_media_metadata():
+    probe = media_tools.MediaProbe(
+        path="f",
+        size=1000,
+        mtime_ns=0,
+        width=1280,
+        height=720,
+        duration=13.7,
+        video_codec="h264",
+        pix_fmt="yuv420p",
+        container="MPEG-4",
+        audio_codec="AAC",
+        frame_rate=29.97,
+        bit_rate=786735,
+        has_audio=True,
+        has_video=True,
+        metadata_json='{"tracks": []}',
+    )
+    key = media_tools.mediainfo_sidecar_key("videos/m/q/original.mp4")
+    assert key == "videos/m/q/original.mediainfo.json"
+    assert media_tools.compact_media_metadata(probe, key) == {
+        "version": media_tools.MEDIA_METADATA_VERSION,
+        "container": "MPEG-4",
+        "fileSize": 1000,
+        "duration": 13.7,
+        "bitRate": 786735,
+        "video": {
+            "codec": "h264",
+            "width": 1280,
+            "height": 720,
+            "frameRate": 29.97,
+            "pixFmt": "yuv420p",
+        },
+        "audio": {"codec": "AAC"},
+        "mediainfoKey": key,
+    }
+
+
+def test_probe_media_is_memoized_per_file_version(monkeypatch, tmp_path):
+    parses = []
+
+    def parse(path, size, mtime_ns):
+        parses.append((size, mtime_ns))
+        return media_tools.MediaProbe(path=path, size=size, mtime_ns=mtime_ns)
+
+    monkeypatch.setattr(media_tools, "_parse_media_probe", parse)
+    media_tools.probe_media_cache_clear()
+    video = tmp_path / "video.mp4"
+    video.write_bytes(b"12345")
+    os.utime(video, ns=(1_000_000_000, 1_000_000_000))
+    first = media_tools.probe_media(str(video))
+    assert media_tools.probe_media(str(video)) is first
+    assert len(parses) == 1
+    # same size, new mtime
+    os.utime(video, ns=(2_000_000_000, 2_000_000_000))
+    assert media_tools.probe_media(str(video)).mtime_ns == 2_000_000_000
+    # new size, same mtime
+    video.write_bytes(b"123456")
+    os.utime(video, ns=(2_000_000_000, 2_000_000_000))
+    assert media_tools.probe_media(str(video)).size == 6
+    assert parses == [
+        (5, 1_000_000_000),
+        (5, 2_000_000_000),
+        (6, 2_000_000_000),
+    ]
+    media_tools.probe_media_cache_clear()
+
+
+def test_segment_count(monkeypatch):
+    monkeypatch.setattr(media_tools, "find_duration", lambda src_file: 60.0)
+    monkeypatch.setattr(media_tools, "available_cpus", lambda: 8)
+    assert media_tools.get_segment_count("video.mp4") == 1
+    monkeypatch.setattr(media_tools, "SEGMENTED_ENCODE", True)
+    assert media_tools.get_segment_count("video.mp4") == 4
+    monkeypatch.setattr(media_tools, "available_cpus", lambda: 1)
+    assert media_tools.get_segment_count("video.mp4") == 1
+
+
+def test_ffmpeg_run_builds_argv_without_stdin(monkeypatch):
+    calls = []
+
+    class FakeProcess:
+        def wait(self, timeout=None):
+            return 0
+
+    def popen(cmd, **kwargs):
+        calls.append((cmd, kwargs))
+        return FakeProcess()
+
+    monkeypatch.setattr(media_tools.subprocess, "Popen", popen)
+    media_tools.ffmpeg_run(
+        ("-y",),
+        {"in file.mp4": ("-ss", "1.0"), "audio.wav": None},
+        {"out.mp4": ("-vf", "scale='min(1280,iw)':-2")},
+    )
+    ((cmd, kwargs),) = calls
+    assert kwargs["stdin"] == media_tools.subprocess.DEVNULL
+    progress_fd = kwargs["pass_fds"][0]
+    assert cmd == [
+        media_tools.FFMPEG_EXECUTABLE,
+        "-nostdin",
+        "-y",
+        "-nostats",
+        "-progress",
+        f"pipe:{progress_fd}",
+        "-ss",
+        "1.0",
+        "-i",
+        "in file.mp4",
+        "-i",
+        "audio.wav",
+        "-vf",
+        "scale='min(1280,iw)':-2",
+        "out.mp4",
+    ]
@@ -0,0 +1,61 @@
+import io
+
+from botocore.exceptions import ClientError
+
+from module.rendition_manifest import (
+    load_rendition_manifest,
+    rendition_manifest_key,
+    save_rendition_manifest,
+)
+
+
+class FakeS3Client:
+    def __init__(self):
+        self.objects = {}
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        body = self.objects[(Bucket, Key)]
+        return {
+            "ETag": f'"{hash(body)}"',
+            "ContentType": "video/mp4",
+            "ContentLength": len(body),
+        }
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self.objects[(Bucket, Key)] = Body.encode("utf-8")
+
+
+def test_key_changes_with_the_source_and_the_options():
+    s3 = FakeS3Client()
+    s3.objects[("media", "videos/m/q/original.mp4")] = b"v1"
+    key = rendition_manifest_key(s3, "media", "videos/m/q/original.mp4", {"a": 1})
+    assert key == rendition_manifest_key(
+        s3, "media", "videos/m/q/original.mp4", {"a": 1}
+    )
+    assert key != rendition_manifest_key(
+        s3, "media", "videos/m/q/original.mp4", {"a": 2}
+    )
+    s3.objects[("media", "videos/m/q/original.mp4")] = b"v2"
+    assert key != rendition_manifest_key(
+        s3, "media", "videos/m/q/original.mp4", {"a": 1}
+    )
+
+
+def test_manifest_is_only_used_while_renditions_are_unchanged():
+    s3 = FakeS3Client()
+    assert load_rendition_manifest(s3, "uploads", "manifest.json", "media") is None
+    s3.objects[("media", "videos/m/q/web.mp4")] = b"web"
+    save_rendition_manifest(
+        s3, "uploads", "manifest.json", "media", ["videos/m/q/web.mp4"], media={}
+    )
+    manifest = load_rendition_manifest(s3, "uploads", "manifest.json", "media")
+    assert manifest["media"] == {}
+    s3.objects[("media", "videos/m/q/web.mp4")] = b"web again"
+    assert load_rendition_manifest(s3, "uploads", "manifest.json", "media") is None
@@ -0,0 +1,191 @@
+import hashlib
+import io
+
+import pytest
+from module import s3_utils
+from module.s3_utils import S3RangeReader, S3ReadLimitExceeded, S3StreamUpload
+
+
+class FakeS3Client:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.ranges = []
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.data)}
+
+    def get_object(self, Bucket, Key, Range):
+        start, end = map(int, Range[len("bytes=") :].split("-"))
+        self.ranges.append((start, end))
+        return {"Body": io.BytesIO(self.data[start : end + 1])}
+
+
+def test_range_reader_reads_and_seeks():
+    data = bytes(range(256)) * 40
+    s3 = FakeS3Client(data)
+    reader = S3RangeReader(s3, "bucket", "key", block_size=1000)
+    assert reader.read(10) == data[:10]
+    reader.seek(-50, io.SEEK_END)
+    assert reader.read() == data[-50:]
+    reader.seek(990)
+    assert reader.read(20) == data[990:1010]
+    assert s3.ranges == [(0, 999), (10000, 10239), (1000, 1999)]
+    assert reader.bytes_fetched == 2240
+
+
+def test_range_reader_fetches_missing_blocks_in_one_request():
+    data = b"x" * 5000
+    s3 = FakeS3Client(data)
+    reader = S3RangeReader(s3, "bucket", "key", block_size=1000)
+    reader.seek(2500)
+    reader.read(10)
+    reader.seek(0)
+    assert reader.read() == data
+    assert s3.ranges == [(2000, 2999), (0, 1999), (3000, 4999)]
+
+
+def test_range_reader_raises_when_over_limit():
+    s3 = FakeS3Client(b"x" * 5000)
+    reader = S3RangeReader(s3, "bucket", "key", block_size=1000, max_bytes=2000)
+    reader.read(1500)
+    with pytest.raises(S3ReadLimitExceeded):
+        reader.read(1000)
+
+
+class FakeCopyS3Client:
+    def __init__(self):
+        self.calls = []
+
+    def copy_object(self, **kwargs):
+        self.calls.append(("copy_object", kwargs))
+
+    def create_multipart_upload(self, **kwargs):
+        self.calls.append(("create_multipart_upload", kwargs))
+        return {"UploadId": "upload-id"}
+
+    def upload_part_copy(self, **kwargs):
+        self.calls.append(("upload_part_copy", kwargs))
+        return {"CopyPartResult": {"ETag": f"etag-{kwargs['PartNumber']}"}}
+
+    def complete_multipart_upload(self, **kwargs):
+        self.calls.append(("complete_multipart_upload", kwargs))
+
+
+def test_copy_small_object_is_one_request():
+    s3 = FakeCopyS3Client()
+    s3_utils.copy_s3_object(s3, "src", "a.mp4", "dst", "b.mp4", "video/mp4", size=10)
+    assert s3.calls == [
+        (
+            "copy_object",
+            {
+                "CopySource": {"Bucket": "src", "Key": "a.mp4"},
+                "Bucket": "dst",
+                "Key": "b.mp4",
+                "ContentType": "video/mp4",
+                "MetadataDirective": "REPLACE",
+            },
+        )
+    ]
+
+
+def test_copy_large_object_copies_parts(monkeypatch):
+    monkeypatch.setattr(s3_utils, "COPY_MULTIPART_THRESHOLD", 100)
+    monkeypatch.setattr(s3_utils, "COPY_PART_SIZE", 100)
+    s3 = FakeCopyS3Client()
+    s3_utils.copy_s3_object(
+        s3, "src", "a.webm", "dst", "b.webm", "video/webm", size=250
+    )
+    create, *part_copies, complete = s3.calls
+    assert create[1]["ContentType"] == "video/webm"
+    assert sorted(c[1]["CopySourceRange"] for c in part_copies) == [
+        "bytes=0-99",
+        "bytes=100-199",
+        "bytes=200-249",
+    ]
+    assert complete[1]["MultipartUpload"]["Parts"] == [
+        {"PartNumber": 1, "ETag": "etag-1"},
+        {"PartNumber": 2, "ETag": "etag-2"},
+        {"PartNumber": 3, "ETag": "etag-3"},
+    ]
+
+
+class ChunkedStream(io.RawIOBase):
+    """returns short reads like a pipe does"""
+
+    def __init__(self, data: bytes, chunk_size: int):
+        self.data = data
+        self.chunk_size = chunk_size
+
+    def read(self, size=-1):
+        n = self.chunk_size if size < 0 else min(size, self.chunk_size)
+        chunk, self.data = self.data[:n], self.data[n:]
+        return chunk
+
+
+class FakeUploadS3Client(FakeCopyS3Client):
+    def upload_part(self, **kwargs):
+        self.calls.append(("upload_part", kwargs))
+        return {"ETag": f"etag-{kwargs['PartNumber']}"}
+
+    def abort_multipart_upload(self, **kwargs):
+        self.calls.append(("abort_multipart_upload", kwargs))
+
+
+def test_stream_upload_fills_parts_from_short_reads():
+    s3 = FakeUploadS3Client()
+    upload = S3StreamUpload(s3, "dst", "web.mp4", "video/mp4", part_size=100)
+    upload.upload_from(ChunkedStream(bytes(250), 30))
+    upload.complete()
+    create, *parts, complete = s3.calls
+    assert create[1]["ContentType"] == "video/mp4"
+    assert sorted((p[1]["PartNumber"], len(p[1]["Body"])) for p in parts) == [
+        (1, 100),
+        (2, 100),
+        (3, 50),
+    ]
+    assert [p["PartNumber"] for p in complete[1]["MultipartUpload"]["Parts"]] == [
+        1,
+        2,
+        3,
+    ]
+    assert upload.bytes_uploaded == 250
+
+
+def test_stream_upload_of_empty_stream_has_one_part():
+    s3 = FakeUploadS3Client()
+    upload = S3StreamUpload(s3, "dst", "web.mp4", "video/mp4", part_size=100)
+    upload.upload_from(ChunkedStream(b"", 30))
+    assert upload.parts == [{"PartNumber": 1, "ETag": "etag-1"}]
+
+
+class ShortReadBody(io.RawIOBase):
+    """returns at most the next of chunk_sizes bytes per readinto, like a socket"""
+
+    def __init__(self, data: bytes, chunk_sizes):
+        self.data = data
+        self.offset = 0
+        self.chunk_sizes = list(chunk_sizes)
+
+    def readinto(self, buffer) -> int:
+        size = self.chunk_sizes.pop(0) if self.chunk_sizes else len(buffer)
+        n = min(size, len(buffer), len(self.data) - self.offset)
+        buffer[:n] = self.data[self.offset : self.offset + n]
+        self.offset += n
+        return n
+
+
+def test_download_file_with_hash_handles_short_reads(monkeypatch, tmp_path):
+    monkeypatch.setattr(s3_utils, "DOWNLOAD_BUFFER_SIZE", 64)
+    data = bytes(range(256)) * 3 + b"tail"
+    body = ShortReadBody(data, [1, 63, 64, 7, 100, 33])
+
+    class S3:
+        def get_object(self, Bucket, Key):
+            return {"Body": body}
+
+    file_path = str(tmp_path / "original")
+    digest = s3_utils.download_file_with_hash(S3(), "bucket", "key", file_path)
+    with open(file_path, "rb") as f:
+        assert f.read() == data
+    assert digest == hashlib.sha1(data).hexdigest()
+    assert body.closed
@@ -0,0 +1,33 @@
+import time
+
+from module.ttl_cache import TTLCache
+
+
+def test_expires_entries():
+    cache = TTLCache(max_size=2)
+    cache.put("a", True, 0.05)
+    assert cache.get("a") == (True, True)
+    time.sleep(0.06)
+    assert cache.get("a") == (False, None)
+    assert cache.hit_rate() == 0.5
+
+
+def test_drops_least_recently_used():
+    cache = TTLCache(max_size=2)
+    cache.put("a", 1, 60)
+    cache.put("b", 2, 60)
+    cache.get("a")
+    cache.put("c", 3, 60)
+    assert cache.get("b") == (False, None)
+    assert cache.get("a") == (True, 1)
+    assert cache.get("c") == (True, 3)
+
+
+def test_invalidates():
+    cache = TTLCache(max_size=2)
+    cache.put("a", 1, 60)
+    cache.put("b", 2, 60)
+    cache.invalidate("a")
+    assert cache.get("a") == (False, None)
+    cache.invalidate()
+    assert cache.get("b") == (False, None)
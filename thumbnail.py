@@ -16,7 +16,7 @@ from module.api import (
     mentor_thumbnail_update,
     user_can_edit_mentor,
 )
-from module.logger import get_logger
+from module.logger import get_logger, metrics_handler
 from module.utils import (
     create_json_response,
     s3_bucket,
@@ -43,6 +43,7 @@ thumbnail_upload_json_schema = {
 
 
 # TODO: probably want to force the size and quality of this image
+@metrics_handler()
 def handler(event, context):
     log.info(event)
     if "body" not in event:
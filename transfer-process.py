@@ -6,11 +6,12 @@
 #
 import json
 import boto3
+from botocore.config import Config
 import gzip
 from base64 import b64decode
 from module.utils import load_sentry, require_env, s3_bucket
-from module.logger import get_logger
-from module.transfer import process_transfer_mentor
+from module.logger import get_logger, metrics_handler
+from module.transfer import TRANSFER_CONCURRENCY, process_transfer_mentor
 
 
 load_sentry()
@@ -18,11 +19,16 @@ log = get_logger("transfer-process")
 JOBS_TABLE_NAME = require_env("JOBS_TABLE_NAME")
 log.info(f"using table {JOBS_TABLE_NAME}")
 aws_region = require_env("REGION")
-s3_client = boto3.client("s3", region_name=aws_region)
+s3_client = boto3.client(
+    "s3",
+    region_name=aws_region,
+    config=Config(max_pool_connections=TRANSFER_CONCURRENCY),
+)
 dynamodb = boto3.resource("dynamodb", region_name=aws_region)
 job_table = dynamodb.Table(JOBS_TABLE_NAME)
 
 
+@metrics_handler()
 def handler(event, context):
     log.info(event)
     records = list(
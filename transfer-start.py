@@ -11,7 +11,7 @@ import uuid
 import gzip
 from datetime import datetime
 from os import environ
-from module.logger import get_logger
+from module.logger import get_logger, metrics_handler
 from module.transfer_mentor_schema import transfer_mentor_json_schema
 from jsonschema import validate, ValidationError
 from module.api import import_task_create_gql, ImportTaskGQLRequest, user_can_edit_mentor
@@ -33,6 +33,7 @@ dynamodb = boto3.resource("dynamodb", region_name=aws_region)
 job_table = dynamodb.Table(JOBS_TABLE_NAME)
 
 
+@metrics_handler()
 def handler(event, context):
     log.info(event)
     if "body" not in event:
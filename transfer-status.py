@@ -7,7 +7,7 @@
 import boto3
 from module.api import user_can_edit_mentor
 from module.utils import get_auth_headers, load_sentry, create_json_response, require_env
-from module.logger import get_logger
+from module.logger import get_logger, metrics_handler
 
 load_sentry()
 log = get_logger("status")
@@ -18,6 +18,7 @@ dynamodb = boto3.resource("dynamodb", region_name=aws_region)
 job_table = dynamodb.Table(JOBS_TABLE_NAME)
 
 
+@metrics_handler()
 def handler(event, context):
     log.info(event)
     status_id = event["pathParameters"]["id"]
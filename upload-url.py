@@ -8,7 +8,7 @@
 import boto3
 import json
 import uuid
-from module.logger import get_logger
+from module.logger import get_logger, metrics_handler
 from module.utils import create_json_response, load_sentry, require_env
 
 
@@ -19,6 +19,7 @@ aws_region = require_env("REGION")
 s3_client = boto3.client("s3", region_name=aws_region)
 
 
+@metrics_handler()
 def handler(event, context):
     log.info("creating signed url")
     token = json.loads(event["requestContext"]["authorizer"]["token"])
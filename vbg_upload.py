@@ -16,7 +16,7 @@ from module.api import (
     mentor_vbg_update,
     user_can_edit_mentor,
 )
-from module.logger import get_logger
+from module.logger import get_logger, metrics_handler
 from module.utils import (
     create_json_response,
     s3_bucket,
@@ -32,6 +32,7 @@ aws_region = require_env("REGION")
 s3_client = boto3.client("s3", region_name=aws_region)
 
 
+@metrics_handler()
 def handler(event, context):
     log.info(event)
     if "body" not in event: